@@ -0,0 +1,177 @@
+# Measures pretraining throughput with the original pad-to-512 collation against dynamic
+# padding, with and without length-grouped batching, on a tiny CPU-sized BERT. Then measures
+# collation alone: the previous collator, which masked with DataCollatorForLanguageModeling,
+# against the vectorized collator with token, whole-word and span masking.
+#
+#   python -m com.mhire.benchmarks.collator_benchmark --examples 2000 --steps 30
+
+import time
+import random
+import argparse
+import tempfile
+from logging import basicConfig, INFO, info as log
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, RandomSampler
+from transformers import DataCollatorForLanguageModeling
+
+from com.mhire.benchmarks.tiny_bert import build_model, build_tokenizer, random_sentence
+from com.mhire.data_processing.token_store import SentencePairDataset, TokenStore
+from com.mhire.pre_training.data_collator import DynamicPaddingCollator
+from com.mhire.pre_training.samplers import LengthGroupedSampler, dataset_lengths
+
+
+def build_examples(tokenizer, count, max_length, median_words, seed=0):
+    """Tokenized NSP-style sentence pairs with a long-tailed length distribution."""
+    rng = random.Random(seed)
+    pairs = [(random_sentence(rng, median_words), random_sentence(rng, median_words)) for _ in range(count)]
+    encoded = tokenizer([a for a, _ in pairs], [b for _, b in pairs], truncation=True, max_length=max_length)
+    return [
+        {
+            "input_ids": encoded["input_ids"][i],
+            "token_type_ids": encoded["token_type_ids"][i],
+            "attention_mask": encoded["attention_mask"][i],
+            "next_sentence_label": rng.randint(0, 1),
+        }
+        for i in range(count)
+    ]
+
+
+def padded_collator(tokenizer, max_length):
+    """The original collation: samples padded to max_length, masked by DataCollatorForLanguageModeling."""
+    mlm_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=True, mlm_probability=0.15)
+
+    def collate_fn(batch):
+        padded = [tokenizer.pad(item, padding="max_length", max_length=max_length) for item in batch]
+        mlm_outputs = mlm_collator([
+            {"input_ids": item["input_ids"], "attention_mask": item["attention_mask"]} for item in padded
+        ])
+        mlm_outputs["next_sentence_label"] = torch.tensor([item["next_sentence_label"] for item in batch])
+        return mlm_outputs
+
+    return collate_fn
+
+
+def previous_collator(tokenizer, mlm_probability=0.15, pad_to_multiple_of=8):
+    """The collator before vectorized masking: a copy per sample, then DataCollatorForLanguageModeling's masking."""
+    mlm_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=True, mlm_probability=mlm_probability)
+    special_token_ids = torch.tensor(sorted(tokenizer.all_special_ids))
+
+    def collate_fn(batch):
+        lengths = [int(np.count_nonzero(np.asarray(item["attention_mask"]))) for item in batch]
+        max_length = -(-max(lengths) // pad_to_multiple_of) * pad_to_multiple_of
+        input_ids = torch.full((len(batch), max_length), tokenizer.pad_token_id, dtype=torch.long)
+        token_type_ids = torch.zeros((len(batch), max_length), dtype=torch.long)
+        for i, (item, length) in enumerate(zip(batch, lengths)):
+            input_ids[i, :length] = torch.from_numpy(np.asarray(item["input_ids"][:length], dtype=np.int64))
+            token_type_ids[i, :length] = torch.from_numpy(np.asarray(item["token_type_ids"][:length], dtype=np.int64))
+        attention_mask = torch.arange(max_length) < torch.tensor(lengths).unsqueeze(1)
+        special_tokens_mask = ~attention_mask | torch.isin(input_ids, special_token_ids)
+        input_ids, labels = mlm_collator.torch_mask_tokens(input_ids, special_tokens_mask=special_tokens_mask)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask.long(),
+            "token_type_ids": token_type_ids,
+            "labels": labels,
+            "next_sentence_label": torch.tensor([int(item["next_sentence_label"]) for item in batch]),
+        }
+
+    return collate_fn
+
+
+def as_sentence_pair_dataset(tokenizer, examples):
+    """The examples laid out like the token store: flat arrays of views, with word starts."""
+    input_ids = np.concatenate([np.asarray(example["input_ids"], dtype=np.uint16) for example in examples])
+    return SentencePairDataset(
+        input_ids,
+        np.concatenate([np.asarray(example["token_type_ids"], dtype=np.uint8) for example in examples]),
+        np.array([example["next_sentence_label"] for example in examples], dtype=np.int8),
+        np.concatenate([[0], np.cumsum([len(example["input_ids"]) for example in examples])]).astype(np.int64),
+        TokenStore.word_start_table(tokenizer).astype(np.uint8)[input_ids],
+    )
+
+
+def measure_collation(dataset, collate_fn, batch_size, batches, seed=0):
+    """Collates `batches` random batches and returns examples per second."""
+    rng = np.random.default_rng(seed)
+    samples = [[dataset[int(i)] for i in rng.integers(len(dataset), size=batch_size)] for _ in range(batches)]
+    start = time.perf_counter()
+    for batch in samples:
+        collate_fn(batch)
+    return batches * batch_size / (time.perf_counter() - start)
+
+
+def measure(model, loader, steps):
+    """Runs `steps` training steps and returns (seconds, real tokens, padded positions)."""
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    model.train()
+    batches = iter(loader)
+    seconds = real_tokens = positions = 0
+    for _ in range(steps):
+        start = time.perf_counter()
+        batch = next(batches)
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        seconds += time.perf_counter() - start
+        real_tokens += int(batch["attention_mask"].sum())
+        positions += batch["input_ids"].numel()
+    return seconds, real_tokens, positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark padded against dynamically padded pretraining batches.')
+    parser.add_argument('--examples', type=int, default=2000)
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-length', type=int, default=512)
+    parser.add_argument('--median-words', type=int, default=15)
+    parser.add_argument('--collate-batches', type=int, default=200)
+    parser.add_argument('--collate-batch-size', type=int, default=64)
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tokenizer = build_tokenizer(work_dir, args.max_length)
+    examples = build_examples(tokenizer, args.examples, args.max_length, args.median_words)
+    lengths = dataset_lengths(examples)
+    log(f"{args.examples} examples, median length {int(np.median(lengths))} tokens")
+
+    generator = torch.Generator().manual_seed(0)
+    runs = [
+        ('padded to max_length', DataLoader(
+            examples, batch_size=args.batch_size, sampler=RandomSampler(examples, generator=generator),
+            collate_fn=padded_collator(tokenizer, args.max_length))),
+        ('dynamic padding', DataLoader(
+            examples, batch_size=args.batch_size, sampler=RandomSampler(examples, generator=generator),
+            collate_fn=DynamicPaddingCollator(tokenizer))),
+        ('dynamic + length grouped', DataLoader(
+            examples, batch_size=args.batch_size, sampler=LengthGroupedSampler(lengths, args.batch_size),
+            collate_fn=DynamicPaddingCollator(tokenizer))),
+    ]
+    baseline = None
+    for name, loader in runs:
+        model = build_model(tokenizer, args.max_length)
+        seconds, real_tokens, positions = measure(model, loader, args.steps)
+        tokens_per_second = real_tokens / seconds
+        baseline = baseline or tokens_per_second
+        log(f"{name:>26}: {tokens_per_second:10,.0f} real tokens/s  {real_tokens / positions:6.1%} of positions "
+            f"are real tokens  speedup {tokens_per_second / baseline:5.2f}x")
+
+    dataset = as_sentence_pair_dataset(tokenizer, examples)
+    collators = [('previous collator', previous_collator(tokenizer))] + [
+        (f'{masking} masking', DynamicPaddingCollator(tokenizer, masking=masking))
+        for masking in ('token', 'whole_word', 'span')
+    ]
+    baseline = None
+    for name, collate_fn in collators:
+        examples_per_second = measure_collation(dataset, collate_fn, args.collate_batch_size, args.collate_batches)
+        baseline = baseline or examples_per_second
+        log(f"{name:>26}: {examples_per_second:10,.0f} examples/s collated  "
+            f"speedup {examples_per_second / baseline:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Measures the throughput of the batched sentence splitting and chunking engine in
+# DataPreparation against the original per-line, per-word implementation.
+#
+#   python -m com.mhire.benchmarks.data_preparation_benchmark --lines 200000 --files 8
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from logging import basicConfig, INFO, info as log
+from com.mhire.benchmarks.synthetic_corpus import write_synthetic_corpus
+from com.mhire.data_processing.data_preparation import DataPreparation
+
+
+def baseline_process_all_files_in_directory(input_dir, output_dir, max_tokens=512):
+    """The original implementation: one regex split, word loop and json.dumps per line and chunk."""
+    os.makedirs(output_dir, exist_ok=True)
+    for jsonl_file in sorted(os.listdir(input_dir)):
+        with open(os.path.join(input_dir, jsonl_file), 'r', encoding='utf-8') as infile, \
+                open(os.path.join(output_dir, jsonl_file), 'w', encoding='utf-8') as outfile:
+            for line in infile:
+                data = json.loads(line.strip())
+                sentences = [sentence.strip() for sentence in re.split(r'[.!?]', data['text']) if sentence]
+                for sentence in sentences:
+                    for chunk in DataPreparation.split_sentence_into_chunks(sentence, max_tokens):
+                        if chunk:
+                            outfile.write(json.dumps({'sentence': chunk}) + '\n')
+
+
+def _read_outputs(directory):
+    return {name: open(os.path.join(directory, name), encoding='utf-8').read() for name in sorted(os.listdir(directory))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DataPreparation splitting engine.')
+    parser.add_argument('--lines', type=int, default=200_000)
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-tokens', type=int, default=512)
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+
+    work_dir = tempfile.mkdtemp(prefix='data_preparation_benchmark_')
+    try:
+        input_dir = os.path.join(work_dir, 'input')
+        os.makedirs(input_dir)
+        write_synthetic_corpus(input_dir, args.files, args.lines)
+        input_bytes = sum(os.path.getsize(os.path.join(input_dir, f)) for f in os.listdir(input_dir))
+
+        runs = [
+            ('baseline', lambda out: baseline_process_all_files_in_directory(input_dir, out, args.max_tokens)),
+            ('batched', lambda out: DataPreparation.process_all_files_in_directory(input_dir, out, args.max_tokens)),
+            (f'batched x{args.workers}', lambda out: DataPreparation.process_all_files_in_directory(
+                input_dir, out, args.max_tokens, num_workers=args.workers)),
+        ]
+        results, outputs = {}, {}
+        for name, run in runs:
+            output_dir = os.path.join(work_dir, name.replace(' ', '_'))
+            start = time.perf_counter()
+            run(output_dir)
+            results[name] = time.perf_counter() - start
+            outputs[name] = _read_outputs(output_dir)
+
+        identical = all(output == outputs['baseline'] for output in outputs.values())
+        log(f"{args.lines} lines, {input_bytes / 1e6:.1f} MB, outputs identical: {identical}")
+        for name, seconds in results.items():
+            log(f"{name:>14}: {seconds:7.2f}s  {args.lines / seconds:12,.0f} lines/s  "
+                f"{input_bytes / 1e6 / seconds:7.1f} MB/s  speedup {results['baseline'] / seconds:5.2f}x")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Measures how training throughput on CPU scales with the number of data-parallel processes.
+# For each process count, a tiny BERT trains one epoch over the same synthetic examples under
+# torchrun with the gloo backend (see pre_training/distributed.py), with a fixed global batch
+# size, so only the split of the work changes. Every process is pinned to its own CPUs.
+# Also checks that the processes trained on disjoint shards covering the whole dataset.
+#
+#   python -m com.mhire.benchmarks.distributed_benchmark --processes 1 2 4 --examples 8192
+
+import os
+import json
+import time
+import argparse
+import tempfile
+from logging import basicConfig, INFO, info as log
+
+from torch.utils.data import Dataset
+from transformers import TrainingArguments
+
+from com.mhire.benchmarks.collator_benchmark import as_sentence_pair_dataset, build_examples
+from com.mhire.benchmarks.tiny_bert import build_model, build_tokenizer
+from com.mhire.pre_training import distributed
+from com.mhire.pre_training.data_collator import DynamicPaddingCollator
+from com.mhire.pre_training.pre_training import PretrainingTrainer
+
+MODULE = "com.mhire.benchmarks.distributed_benchmark"
+
+
+class _RecordingDataset(Dataset):
+    """A dataset that remembers which examples were read from it."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.read = []
+
+    @property
+    def lengths(self):
+        return self.dataset.lengths
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        self.read.append(int(idx))
+        return self.dataset[idx]
+
+
+def worker(args):
+    """One training process: trains an epoch and writes its timings and the examples it read."""
+    rank, local_rank, world_size, local_world_size = distributed.distributed_env()
+    distributed.init_distributed()
+    cpus = distributed.pin_threads(local_rank, local_world_size) if args.pin else sorted(os.sched_getaffinity(0))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tokenizer = build_tokenizer(work_dir, args.max_length)
+        dataset = _RecordingDataset(as_sentence_pair_dataset(
+            tokenizer, build_examples(tokenizer, args.examples, args.max_length, args.median_words)))
+        model = build_model(tokenizer, args.max_length, hidden_size=args.hidden_size, layers=args.layers,
+                            heads=args.hidden_size // 64)
+        training_args = TrainingArguments(
+            output_dir=work_dir,
+            num_train_epochs=1,
+            per_device_train_batch_size=args.global_batch_size // (world_size * args.accumulation),
+            gradient_accumulation_steps=args.accumulation,
+            save_strategy="no",
+            eval_strategy="no",
+            logging_steps=10 ** 9,
+            report_to=[],
+            use_cpu=True,
+            ddp_backend=distributed.BACKEND,
+            ddp_find_unused_parameters=False,
+        )
+        trainer = PretrainingTrainer(model=model, args=training_args, train_dataset=dataset,
+                                     data_collator=DynamicPaddingCollator(tokenizer), group_by_length=True)
+        start = time.perf_counter()
+        output = trainer.train()
+        seconds = time.perf_counter() - start
+
+    with open(os.path.join(args.result_dir, f"rank{rank}.json"), "w", encoding="utf-8") as f:
+        json.dump({"cpus": cpus, "seconds": seconds, "steps": output.global_step, "read": dataset.read}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark data-parallel CPU training throughput.')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--examples', type=int, default=8192)
+    parser.add_argument('--global-batch-size', type=int, default=64)
+    parser.add_argument('--accumulation', type=int, default=1, help='Gradient accumulation steps')
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--median-words', type=int, default=15)
+    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--no-pin', dest='pin', action='store_false')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--result-dir', help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+    basicConfig(level=INFO)
+    if args.worker:
+        worker(args)
+        return
+
+    log(f"{os.cpu_count()} CPUs in {len(distributed.numa_nodes())} NUMA nodes, {args.examples} examples, "
+        f"global batch {args.global_batch_size} ({args.accumulation} accumulation steps)")
+    worker_args = ['--worker', '--examples', str(args.examples), '--global-batch-size', str(args.global_batch_size),
+                   '--accumulation', str(args.accumulation), '--max-length', str(args.max_length),
+                   '--median-words', str(args.median_words), '--hidden-size', str(args.hidden_size),
+                   '--layers', str(args.layers)] + ([] if args.pin else ['--no-pin'])
+    baseline = None
+    for processes in args.processes:
+        if args.global_batch_size % (processes * args.accumulation):
+            log(f"Skipping {processes} processes: they cannot split a global batch of {args.global_batch_size}")
+            continue
+        with tempfile.TemporaryDirectory() as result_dir:
+            distributed.launch(MODULE, processes, worker_args + ['--result-dir', result_dir])
+            ranks = []
+            for rank in range(processes):
+                with open(os.path.join(result_dir, f"rank{rank}.json"), "r", encoding="utf-8") as f:
+                    ranks.append(json.load(f))
+
+        seconds = max(rank['seconds'] for rank in ranks)
+        throughput = args.examples / seconds
+        # Throughput of one process, from the first (smallest) process count measured.
+        baseline = baseline or throughput / processes
+        shards = [set(rank['read']) for rank in ranks]
+        overlap = sum(len(a & b) for i, a in enumerate(shards) for b in shards[i + 1:])
+        covered = len(set().union(*shards))
+        log(f"{processes:3d} processes: {throughput:8.1f} examples/s  speedup {throughput / baseline:5.2f}x  "
+            f"efficiency {throughput / baseline / processes:5.0%}  {ranks[0]['steps']} optimizer steps  "
+            f"{len(ranks[0]['cpus'])} CPUs per process  examples covered {covered}/{args.examples}, "
+            f"read by two processes {overlap}")
+
+
+if __name__ == '__main__':
+    main()
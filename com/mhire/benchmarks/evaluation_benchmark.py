@@ -0,0 +1,82 @@
+# Measures what evaluation costs per training epoch on a tiny CPU-sized BERT. Baseline: the
+# previous setup, Trainer.evaluate over the whole validation set every 10 steps. New setup: a
+# stratified sample every --eval-steps steps, plus one full evaluation at the epoch's end.
+# Also shows how closely the sample's metrics track those of the full validation set.
+#
+#   python -m com.mhire.benchmarks.evaluation_benchmark --examples 20000 --sample-size 2000
+
+import time
+import argparse
+import tempfile
+from logging import basicConfig, INFO, info as log
+
+from transformers import Trainer, TrainingArguments
+
+from com.mhire.benchmarks.collator_benchmark import as_sentence_pair_dataset, build_examples
+from com.mhire.benchmarks.tiny_bert import build_model, build_tokenizer
+from com.mhire.pre_training.data_collator import DynamicPaddingCollator
+from com.mhire.pre_training.evaluation import PretrainingEvaluator
+from com.mhire.pre_training.samplers import split_dataset
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full Trainer evaluation against sampled evaluation.')
+    parser.add_argument('--examples', type=int, default=20000)
+    parser.add_argument('--validation-fraction', type=float, default=0.2)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--previous-eval-steps', type=int, default=10)
+    parser.add_argument('--eval-steps', type=int, default=200)
+    parser.add_argument('--eval-batch-size', type=int, default=64)
+    parser.add_argument('--sample-size', type=int, default=2000)
+    parser.add_argument('--max-length', type=int, default=512)
+    parser.add_argument('--median-words', type=int, default=15)
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tokenizer = build_tokenizer(work_dir, args.max_length)
+        dataset = as_sentence_pair_dataset(
+            tokenizer, build_examples(tokenizer, args.examples, args.max_length, args.median_words))
+        train_dataset, val_dataset = split_dataset(dataset, validation_fraction=args.validation_fraction)
+        model = build_model(tokenizer, args.max_length)
+        collator = DynamicPaddingCollator(tokenizer)
+        steps_per_epoch = -(-len(train_dataset) // args.batch_size)
+        log(f"{len(train_dataset)} training examples ({steps_per_epoch} steps per epoch), "
+            f"{len(val_dataset)} validation examples")
+
+        trainer = Trainer(
+            model=model,
+            args=TrainingArguments(output_dir=work_dir, report_to=[], use_cpu=True,
+                                   per_device_eval_batch_size=args.batch_size),
+            eval_dataset=val_dataset,
+            data_collator=collator,
+        )
+        previous_seconds, _ = timed(trainer.evaluate)
+        previous_evaluations = steps_per_epoch // args.previous_eval_steps
+        previous_epoch = previous_evaluations * previous_seconds
+
+        evaluator = PretrainingEvaluator(collator, batch_size=args.eval_batch_size, sample_size=args.sample_size)
+        prepare_seconds, _ = timed(lambda: evaluator.sample_batches(val_dataset))
+        sample_seconds, (sample_metrics, sample_size) = timed(lambda: evaluator.evaluate(model, val_dataset))
+        full_seconds, (full_metrics, _) = timed(lambda: evaluator.evaluate(model, val_dataset, full=True))
+        sampled_evaluations = steps_per_epoch // args.eval_steps
+        new_epoch = prepare_seconds + sampled_evaluations * sample_seconds + full_seconds
+
+    log(f"{'Trainer.evaluate, full set':>30}: {previous_seconds:8.2f}s per evaluation, "
+        f"{previous_evaluations} per epoch = {previous_epoch:8.1f}s")
+    log(f"{'sampled, ' + str(sample_size) + ' examples':>30}: {sample_seconds:8.2f}s per evaluation, "
+        f"{sampled_evaluations} per epoch (+{prepare_seconds:.2f}s to collate the sample once)")
+    log(f"{'streaming, full set':>30}: {full_seconds:8.2f}s, once per epoch")
+    log(f"Evaluation per epoch: {previous_epoch:.1f}s -> {new_epoch:.1f}s ({previous_epoch / new_epoch:.1f}x less)")
+    for name in ('mlm_accuracy', 'mlm_perplexity', 'nsp_accuracy'):
+        log(f"{name:>16}: sample {sample_metrics[name]:.4f}  full set {full_metrics[name]:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Measures the inference service under concurrent load on a tiny CPU-sized BERT: one text per
+# forward pass against micro-batching, and the fp32 weights against int8 quantization.
+# Clients send embedding requests from a pool of texts, a share of them repeated, and the
+# latency percentiles and throughput they observe are reported. With --http the requests
+# go through the HTTP server on a local port instead of calling the service directly.
+#
+#   python -m com.mhire.benchmarks.inference_benchmark --clients 32 --requests 20
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from logging import basicConfig, INFO, info as log
+
+import numpy as np
+
+from com.mhire.benchmarks.tiny_bert import build_model, build_tokenizer, random_sentence
+from com.mhire.inference.inference_model import InferenceModel
+from com.mhire.inference.server import InferenceServer, InferenceService
+
+
+def build_texts(count, repeat_fraction, median_words, seed=0):
+    """`count` request texts, of which about `repeat_fraction` repeat an earlier one."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        if texts and rng.random() < repeat_fraction:
+            texts.append(rng.choice(texts))
+        else:
+            texts.append(random_sentence(rng, median_words, max_words=100))
+    return texts
+
+
+async def _http_embed(reader, writer, text):
+    body = json.dumps({'texts': [text]}).encode('utf-8')
+    writer.write(f"POST /embed HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    length = 0
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return json.loads(await reader.readexactly(length))
+
+
+async def run_load(service, texts, clients, http_port=None):
+    """Sends `texts` from `clients` concurrent clients; returns (latencies in seconds, wall seconds)."""
+    latencies = []
+    chunks = [texts[i::clients] for i in range(clients)]
+
+    async def client(chunk):
+        connection = await asyncio.open_connection('127.0.0.1', http_port) if http_port else None
+        for text in chunk:
+            start = time.perf_counter()
+            if connection:
+                await _http_embed(*connection, text)
+            else:
+                await service.embed([text])
+            latencies.append(time.perf_counter() - start)
+        if connection:
+            connection[1].close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(chunk) for chunk in chunks))
+    return latencies, time.perf_counter() - start
+
+
+async def benchmark(model, texts, clients, max_batch_size, max_wait_ms, cache_size, http):
+    service = InferenceService(model, max_batch_size, max_wait_ms, cache_size)
+    asyncio_server = port = None
+    if http:
+        server = InferenceServer(service, port=0)
+        asyncio_server = await server.start()
+        port = server.port
+    else:
+        service.start()
+    try:
+        latencies, seconds = await run_load(service, texts, clients, port)
+    finally:
+        if asyncio_server:
+            asyncio_server.close()
+            await asyncio_server.wait_closed()
+        stats = service.stats()['embed']
+        await service.close()
+    return np.asarray(latencies) * 1000, seconds, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched inference under concurrent load.')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help='Requests per client')
+    parser.add_argument('--repeat-fraction', type=float, default=0.2)
+    parser.add_argument('--median-words', type=int, default=15)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--http', action='store_true')
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+
+    texts = build_texts(args.clients * args.requests, args.repeat_fraction, args.median_words)
+    runs = [
+        ('one text per pass', 'torch', 1, 0),
+        ('micro-batched', 'torch', args.max_batch_size, args.cache_size),
+        ('micro-batched + int8', 'int8', args.max_batch_size, args.cache_size),
+    ]
+    with tempfile.TemporaryDirectory() as model_dir:
+        tokenizer = build_tokenizer(model_dir)
+        build_model(tokenizer, hidden_size=256, layers=4, heads=4).save_pretrained(model_dir)
+        tokenizer.save_pretrained(model_dir)
+
+        baseline = None
+        for name, backend, max_batch_size, cache_size in runs:
+            model = InferenceModel(model_dir, backend=backend)
+            latencies, seconds, stats = asyncio.run(benchmark(
+                model, texts, args.clients, max_batch_size, args.max_wait_ms, cache_size, args.http))
+            throughput = len(texts) / seconds
+            baseline = baseline or throughput
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            log(f"{name:>22}: {throughput:8.1f} requests/s ({throughput / baseline:5.2f}x)  "
+                f"latency p50 {p50:7.1f}ms p90 {p90:7.1f}ms p99 {p99:7.1f}ms  "
+                f"mean batch {stats['mean_batch_size']:5.1f}  cache hits {stats['cache_hit_rate']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
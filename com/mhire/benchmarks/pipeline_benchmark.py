@@ -0,0 +1,226 @@
+# Benchmarks every stage of the data pipeline and the training input path on a synthetic
+# corpus, on CPU and without network access: PDF parsing, sentence splitting, merging, NSP
+# pair generation, tokenization into the token store, collation, and a few training steps
+# of a tiny BERT. Each stage's wall time, CPU time, peak memory and items/s go to a JSON
+# run report in --results-dir, and two reports (e.g. from two commits) can be compared.
+#
+#   python -m com.mhire.benchmarks.pipeline_benchmark --pdfs 8 --pages 50 --lines 20000
+#   python -m com.mhire.benchmarks.pipeline_benchmark --compare old.json new.json
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from logging import info as log, warning
+
+import torch
+from torch.utils.data import DataLoader
+
+from com.mhire.benchmarks.synthetic_corpus import write_synthetic_corpus, write_synthetic_pdfs
+from com.mhire.benchmarks.tiny_bert import build_model, build_tokenizer
+from com.mhire.data_processing import jsonl_shards
+from com.mhire.data_processing.data_preparation import DataPreparation
+from com.mhire.data_processing.nsp_formatter import NSPGenerator
+from com.mhire.data_processing.pdf_parser import PDFParser
+from com.mhire.data_processing.pre_training_data_handler import PreTrainingDataHandler
+from com.mhire.pre_training.data_collator import DynamicPaddingCollator
+from com.mhire.pre_training.samplers import LengthGroupedSampler
+from com.mhire.utility.instrumentation import RunReport, configure_logging
+
+STAGES = ['parse', 'split', 'merge', 'nsp', 'tokenize', 'collate', 'train']
+# The stage whose output each stage reads.
+DEPENDENCIES = {'parse': None, 'split': None, 'merge': 'split', 'nsp': 'merge', 'tokenize': 'nsp',
+                'collate': 'tokenize', 'train': 'tokenize'}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def with_dependencies(stages):
+    """The selected stages plus every stage whose output they read."""
+    selected = set()
+    for stage in stages:
+        while stage and stage not in selected:
+            selected.add(stage)
+            stage = DEPENDENCIES[stage]
+    return selected
+
+
+def run_benchmark(args, work_dir, report):
+    """Generates the synthetic inputs, then runs and times the selected stages and their dependencies in order."""
+    stages = with_dependencies(args.stages)
+    dirs = {name: os.path.join(work_dir, name) for name in ('pdfs', 'parsed', 'text', 'split', 'store')}
+    for directory in dirs.values():
+        os.makedirs(directory)
+    # Sharded like the pipeline's outputs, unless --shard-size is 0.
+    merged_file = os.path.join(work_dir, 'mlm_format' if args.shard_size else 'mlm_format.jsonl')
+    nsp_file = os.path.join(work_dir, 'nsp_format' if args.shard_size else 'nsp_format.jsonl')
+    compression = None if args.compression == 'none' else args.compression
+
+    # Inputs are generated outside the timed stages. Splitting starts from its own corpus of
+    # paragraphs, so each stage can be measured even when the ones before it are skipped.
+    write_synthetic_pdfs(dirs['pdfs'], args.pdfs, args.pages, seed=args.seed)
+    write_synthetic_corpus(dirs['text'], args.files, args.lines, seed=args.seed)
+    tokenizer = build_tokenizer(work_dir, args.max_length)
+
+    if 'parse' in stages:
+        with report.stage('parse') as stage:
+            PDFParser(num_workers=args.workers).parse_pdfs(dirs['pdfs'], dirs['parsed'])
+            stage.items = args.pdfs * args.pages
+            stage.bytes = _directory_size(dirs['pdfs'])
+            stage.extra['unit'] = 'pages'
+
+    if 'split' in stages:
+        with report.stage('split') as stage:
+            DataPreparation.process_all_files_in_directory(
+                dirs['text'], dirs['split'], max_tokens=args.max_tokens, num_workers=args.workers)
+            stage.items = args.lines // args.files * args.files
+            stage.bytes = _directory_size(dirs['text'])
+            stage.extra['unit'] = 'lines'
+
+    if 'merge' in stages:
+        with report.stage('merge') as stage:
+            stage.items = DataPreparation.combine_jsonl_files(
+                dirs['split'], merged_file, shard_size=args.shard_size, compression=compression)
+            stage.bytes = jsonl_shards.dataset_size(merged_file)
+            stage.extra['unit'] = 'sentences'
+
+    if 'nsp' in stages:
+        with report.stage('nsp') as stage:
+            stage.items = NSPGenerator.generate_nsp_streaming(
+                [merged_file], nsp_file, seed=args.seed, shard_size=args.shard_size, compression=compression,
+                num_workers=args.workers)
+            stage.bytes = jsonl_shards.dataset_size(nsp_file)
+            stage.extra['unit'] = 'pairs'
+
+    if 'tokenize' in stages:
+        with report.stage('tokenize') as stage:
+            data_handler = PreTrainingDataHandler(tokenizer)
+            dataset = data_handler.prepare_token_store_dataset(
+                nsp_file, dirs['store'], args.max_length, num_workers=args.workers)
+            stage.items = len(dataset)
+            stage.bytes = jsonl_shards.dataset_size(nsp_file)
+            stage.extra.update(unit='examples', tokens=int(dataset.offsets[-1]))
+
+    if 'collate' in stages:
+        with report.stage('collate') as stage:
+            loader = DataLoader(
+                dataset, batch_size=args.batch_size,
+                sampler=LengthGroupedSampler(dataset.lengths, args.batch_size, seed=args.seed),
+                collate_fn=DynamicPaddingCollator(tokenizer),
+            )
+            examples = tokens = 0
+            for batch in loader:
+                examples += len(batch['input_ids'])
+                tokens += int(batch['attention_mask'].sum())
+            stage.items = examples
+            stage.extra.update(unit='examples', tokens=tokens)
+
+    if 'train' in stages:
+        model = build_model(tokenizer, args.max_length, seed=args.seed)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+        loader = DataLoader(
+            dataset, batch_size=args.batch_size,
+            sampler=LengthGroupedSampler(dataset.lengths, args.batch_size, seed=args.seed),
+            collate_fn=DynamicPaddingCollator(tokenizer),
+        )
+        with report.stage('train') as stage:
+            model.train()
+            examples = tokens = steps = 0
+            for batch in loader:
+                if steps == args.train_steps:
+                    break
+                model(**batch).loss.backward()
+                optimizer.step()
+                optimizer.zero_grad()
+                steps += 1
+                examples += len(batch['input_ids'])
+                tokens += int(batch['attention_mask'].sum())
+            stage.items = examples
+            stage.extra.update(unit='examples', tokens=tokens, steps=steps)
+
+
+def compare(old_path, new_path):
+    """Logs, per stage, how wall time, throughput and peak memory changed between two reports."""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    old_stages = {stage['name']: stage for stage in old['stages']}
+
+    def mib(value):
+        return f"{value / 2**20:8.0f}" if value is not None else f"{'-':>8}"
+
+    log(f"{old_path} ({old['metadata'].get('commit')}) -> {new_path} ({new['metadata'].get('commit')})")
+    changed = sorted(key for key in set(old['metadata'].get('args', {})) | set(new['metadata'].get('args', {}))
+                     if key not in ('results_dir', 'work_dir', 'profile_stage')
+                     and old['metadata'].get('args', {}).get(key) != new['metadata'].get('args', {}).get(key))
+    if changed:
+        warning(f"The runs used different parameters ({', '.join(changed)}); compare items/s rather than seconds")
+    log(f"{'stage':>10} {'old s':>9} {'new s':>9} {'old items/s':>13} {'new items/s':>13} {'speedup':>8} "
+        f"{'old MiB':>8} {'new MiB':>8}")
+    for stage in new['stages']:
+        before = old_stages.get(stage['name'])
+        if before is None:
+            log(f"{stage['name']:>10}  only in {new_path}")
+            continue
+        # Throughput stays comparable when the corpus sizes differ; wall time does not.
+        if before['items_per_s'] and stage['items_per_s']:
+            speedup = stage['items_per_s'] / before['items_per_s']
+        else:
+            speedup = before['wall_s'] / stage['wall_s'] if stage['wall_s'] else float('nan')
+        log(f"{stage['name']:>10} {before['wall_s']:9.3f} {stage['wall_s']:9.3f} "
+            f"{before['items_per_s'] or 0:13,.0f} {stage['items_per_s'] or 0:13,.0f} {speedup:7.2f}x "
+            f"{mib(before['peak_rss_bytes'])} {mib(stage['peak_rss_bytes'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data pipeline stages on a synthetic corpus.')
+    parser.add_argument('--pdfs', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--lines', type=int, default=20_000)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-tokens', type=int, default=512)
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--shard-size', type=int, default=jsonl_shards.DEFAULT_SHARD_SIZE,
+                        help='Records per output shard; 0 writes single JSONL files.')
+    parser.add_argument('--compression', choices=['gzip', 'zstd', 'none'], default=jsonl_shards.DEFAULT_COMPRESSION)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--train-steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--profile-stage', choices=STAGES)
+    parser.add_argument('--results-dir', default='benchmark_results')
+    parser.add_argument('--work-dir', help='Where to generate the corpus; a temporary directory by default.')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two saved results instead.')
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='pipeline_benchmark_', dir=args.work_dir)
+    metadata = {'commit': _git_commit(), 'args': {k: v for k, v in vars(args).items() if k != 'compare'}}
+    try:
+        with RunReport('pipeline_benchmark', args.results_dir, profile_stage=args.profile_stage,
+                       metadata=metadata) as report:
+            run_benchmark(args, work_dir, report)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# Generates synthetic corpora for the benchmarks: text-only PDFs written without any PDF
+# library, and JSONL files of random prose in the layout the pipeline stages read. Book-like
+# PDFs set paragraphs of prose in columns, with indents, hyphenation and page numbers.
+
+import os
+import json
+import random
+
+WORDS = [
+    'patient', 'clinical', 'treatment', 'dose', 'therapy', 'cardiac', 'renal', 'hepatic', 'acute',
+    'chronic', 'diagnosis', 'syndrome', 'infection', 'pathophysiology', 'the', 'of', 'and', 'in',
+    'with', 'was', 'a', 'is', 'were', 'mg', 'study', 'results', 'significant', 'mortality',
+]
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+LINES_PER_PAGE = 60
+MARGIN = 50
+GUTTER = 20
+# Helvetica has no /Widths in these PDFs; this is the average advance of its lowercase letters.
+CHAR_WIDTH = FONT_SIZE * 0.5
+
+
+def random_paragraph(rng):
+    """A few sentences of random prose, mostly short with the occasional run-on that needs chunking."""
+    sentences = []
+    for _ in range(rng.randint(1, 4)):
+        length = rng.randint(3, 40) if rng.random() < 0.97 else rng.randint(100, 400)
+        sentences.append(' '.join(rng.choice(WORDS) for _ in range(length)))
+    return rng.choice('.!?').join(sentences) + '.'
+
+
+def write_synthetic_corpus(directory, files, lines, seed=0):
+    """Writes `files` JSONL files with `lines` lines of random prose in total, as {'text': ...} records."""
+    rng = random.Random(seed)
+    for file_index in range(files):
+        with open(os.path.join(directory, f'doc{file_index:04d}.jsonl'), 'w', encoding='utf-8') as outfile:
+            for _ in range(lines // files):
+                outfile.write(json.dumps({'text': random_paragraph(rng)}) + '\n')
+
+
+def _pdf_string(text):
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def random_prose(rng, sentences=(2, 6)):
+    """A paragraph of capitalized sentences of random words, separated by spaces."""
+    paragraph = []
+    for _ in range(rng.randint(*sentences)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 30))]
+        paragraph.append(' '.join(words).capitalize() + rng.choice('...!?'))
+    return ' '.join(paragraph)
+
+
+def wrap_paragraph(paragraph, width, indent):
+    """Greedily wraps a paragraph into lines of at most `width` characters, hyphenating long words."""
+    lines, line = [], ' ' * indent
+    for word in paragraph.split():
+        if line.strip() and len(line) + 1 + len(word) > width:
+            room = width - len(line) - 2
+            if len(word) >= 8 and room >= 3:
+                lines.append(f'{line} {word[:room]}-')
+                word = word[room:]
+            else:
+                lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line.strip() else line + word
+    lines.append(line)
+    return lines
+
+
+def write_pdf(path, pages):
+    """
+    Writes a minimal PDF with one page per entry of `pages`, each a list of text lines set
+    in Helvetica. Enough for text extraction, which is all the parser needs. A line can also
+    be an (x, y, text) tuple, placed at that position instead of below the previous one.
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # the page tree, filled in once the page objects are numbered
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_ids = []
+    for lines in pages:
+        content = [f'BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL 40 {PAGE_HEIGHT - 40} Td']
+        content.extend(f'1 0 0 1 {line[0]:.2f} {line[1]:.2f} Tm {_pdf_string(line[2])} Tj' if isinstance(line, tuple)
+                       else f'{_pdf_string(line)} Tj T*' for line in lines)
+        content.append('ET')
+        stream = '\n'.join(content).encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append((
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>'
+        ).encode('ascii'))
+        page_ids.append(len(objects))
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+    objects[1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode('ascii')
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        xref = f.tell()
+        f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        f.writelines(b'%010d 00000 n \n' % offset for offset in offsets)
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+
+
+def write_synthetic_pdfs(directory, files, pages, seed=0):
+    """Writes `files` PDFs of `pages` pages each, filled with lines of random prose."""
+    rng = random.Random(seed)
+    for file_index in range(files):
+        write_pdf(
+            os.path.join(directory, f'doc{file_index:04d}.pdf'),
+            [[' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))) + rng.choice(' ..')
+              for _ in range(LINES_PER_PAGE)] for _ in range(pages)],
+        )
+
+
+def write_book_pdf(path, paragraphs, columns=2):
+    """
+    Sets `paragraphs` in `columns` columns per page, with indented first lines, hyphenated
+    line ends and a page number at the bottom. Lines are written row by row across the columns,
+    the content stream order that extracting text line by line cannot read correctly.
+    """
+    column_width = (PAGE_WIDTH - 2 * MARGIN - GUTTER * (columns - 1)) / columns
+    rows = int((PAGE_HEIGHT - 2 * MARGIN) / LINE_HEIGHT)
+    lines = [line for paragraph in paragraphs
+             for line in wrap_paragraph(paragraph, int(column_width / CHAR_WIDTH), indent=3)]
+
+    pages = []
+    per_page = rows * columns
+    for page_start in range(0, len(lines), per_page):
+        page_lines = lines[page_start:page_start + per_page]
+        placed = []
+        for row in range(rows):
+            for column in range(columns):
+                index = column * rows + row
+                if index < len(page_lines):
+                    line = page_lines[index]
+                    indent = (len(line) - len(line.lstrip())) * CHAR_WIDTH
+                    x = MARGIN + column * (column_width + GUTTER) + indent
+                    placed.append((x, PAGE_HEIGHT - MARGIN - row * LINE_HEIGHT, line.strip()))
+        placed.append((PAGE_WIDTH / 2, MARGIN / 2, str(len(pages) + 1)))
+        pages.append(placed)
+    write_pdf(path, pages)
+
+
+def write_synthetic_book_pdfs(directory, files, paragraphs, columns=2, seed=0):
+    """Writes `files` book-like PDFs of `paragraphs` paragraphs each; returns the paragraphs of every file."""
+    rng = random.Random(seed)
+    texts = {}
+    for file_index in range(files):
+        name = f'book{file_index:04d}.pdf'
+        texts[name] = [random_prose(rng) for _ in range(paragraphs)]
+        write_book_pdf(os.path.join(directory, name), texts[name], columns)
+    return texts
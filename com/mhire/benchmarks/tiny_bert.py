@@ -0,0 +1,44 @@
+# Builds a tiny BERT tokenizer and model locally, so benchmarks run on CPU without
+# downloading bert-base-uncased.
+
+import os
+
+import torch
+from transformers import BertConfig, BertForPreTraining, BertTokenizerFast
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+WORDS = [
+    'patient', 'clinical', 'treatment', 'dose', 'therapy', 'cardiac', 'renal', 'hepatic', 'acute',
+    'chronic', 'diagnosis', 'syndrome', 'infection', 'the', 'of', 'and', 'in', 'with', 'was', 'a',
+    'is', 'were', 'mg', 'study', 'results', 'significant', 'mortality', 'blood', 'pressure', 'heart',
+]
+
+
+def build_tokenizer(directory, max_length=512):
+    """Writes a small WordPiece vocabulary to `directory` and returns a fast tokenizer over it."""
+    letters = [chr(c) for c in range(ord('a'), ord('z') + 1)] + [str(d) for d in range(10)]
+    vocab = SPECIAL_TOKENS + list(".,;:!?-()") + WORDS + letters + ['##' + c for c in letters]
+    vocab_file = os.path.join(directory, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(vocab) + '\n')
+    return BertTokenizerFast(vocab_file, model_max_length=max_length)
+
+
+def build_model(tokenizer, max_length=512, hidden_size=128, layers=2, heads=2, seed=0):
+    """Returns a randomly initialized BertForPreTraining sized for quick CPU runs."""
+    config = BertConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        num_hidden_layers=layers,
+        num_attention_heads=heads,
+        intermediate_size=hidden_size * 4,
+        max_position_embeddings=max_length,
+    )
+    torch.manual_seed(seed)
+    return BertForPreTraining(config)
+
+
+def random_sentence(rng, median_words=20, max_words=400):
+    """A random sentence whose length follows a long-tailed distribution around `median_words`."""
+    length = min(max_words, max(1, int(rng.lognormvariate(0, 0.8) * median_words)))
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
@@ -1,12 +1,49 @@
 # This file handles the second level of parsing, where the extracted text from the first parsing is split into sentences.
 # It ensures that each sentence is stored in a JSONL file and splits longer sentences into smaller chunks if they exceed the 512-token limit.
+# Sentences are split either on every '.', '!' and '?' (the 'regex' segmenter) or by NLTK's punkt tokenizer
+# ('punkt'), which keeps abbreviations, decimals and initials inside their sentence.
 
 import os
 import json
 import re
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, islice
+from json.encoder import encode_basestring_ascii
 from logging import info as log
+from com.mhire.data_processing.jsonl_shards import DEFAULT_COMPRESSION, open_writer
+from com.mhire.utility.ntlk_util import load_sentence_tokenizer
+
+SENTENCE_BOUNDARY = re.compile(r'[.!?]')
+SEGMENTERS = ('regex', 'punkt')
+
+# Number of input lines split and written together by the batched engine.
+DEFAULT_BATCH_SIZE = 4096
+
+
+def _process_file(input_path, output_path, max_tokens, batch_size, segmenter='regex'):
+    """Worker entry point: splits one JSONL file into sentence chunks, a block of lines at a time."""
+    with open(input_path, 'r', encoding='utf-8') as infile, open(output_path, 'w', encoding='utf-8') as outfile:
+        while True:
+            batch = list(islice(infile, batch_size))
+            if not batch:
+                break
+            lines = [line for line in batch if not line.isspace()]
+            if not lines:
+                continue
+            records = json.loads('[' + ','.join(lines) + ']')
+            chunks = DataPreparation.split_block_into_chunks([data['text'] for data in records], max_tokens, segmenter)
+            # Same bytes as json.dumps({'sentence': chunk}), without building a dict per chunk.
+            outfile.write(''.join(['{"sentence": ' + encode_basestring_ascii(chunk) + '}\n' for chunk in chunks]))
+    return input_path
+
 
 class DataPreparation:
+    @staticmethod
+    def clean_sentence(sentence):
+        """Collapses runs of whitespace in a sentence into single spaces."""
+        return ' '.join(sentence.split())
+
     @staticmethod
     def split_sentence_into_chunks(sentence, max_tokens=512):
         """Splits a sentence into chunks with a maximum number of tokens (words)."""
@@ -28,35 +65,87 @@ class DataPreparation:
         return chunks
 
     @staticmethod
-    def process_all_files_in_directory(input_dir, output_dir, max_tokens=512):
-        """Processes all files in a directory, extracting sentences and splitting long sentences."""
+    def split_block_into_chunks(texts, max_tokens=512, segmenter='regex'):
+        """
+        Splits a block of texts into sentences and chunks them like `split_sentence_into_chunks`.
+        With the 'regex' segmenter the texts are joined on a sentence boundary and split with one
+        compiled regex call; with 'punkt' the whole block goes through the punkt tokenizer at once.
+        Chunk boundaries are found by bisecting cumulative word lengths instead of a per-word loop.
+        Unlike `split_sentence_into_chunks`, no empty chunk is emitted before an over-long first word.
+        """
+        if segmenter == 'punkt':
+            sentences = [sentence for text_sentences in load_sentence_tokenizer().tokenize_sents(texts)
+                         for sentence in text_sentences]
+        elif segmenter == 'regex':
+            sentences = SENTENCE_BOUNDARY.split('.'.join(texts))
+        else:
+            raise ValueError(f"Unknown sentence segmenter {segmenter!r}; use one of {SEGMENTERS}")
+
+        chunks = []
+        for sentence in sentences:
+            # Words plus separators can never be longer than the sentence plus one.
+            if len(sentence) < max_tokens:
+                words = sentence.split()
+                if words:
+                    chunks.append(' '.join(words))
+                continue
+
+            words = sentence.split()
+            boundaries = list(accumulate(map((1).__add__, map(len, words)), initial=0))
+            start = 0
+            while start < len(words):
+                end = bisect_right(boundaries, boundaries[start] + max_tokens, lo=start + 1) - 1
+                end = max(end, start + 1)
+                chunks.append(' '.join(words[start:end]))
+                start = end
+        return chunks
+
+    @staticmethod
+    def process_all_files_in_directory(input_dir, output_dir, max_tokens=512, jsonl_files=None,
+                                       num_workers=1, batch_size=DEFAULT_BATCH_SIZE, segmenter='regex'):
+        """
+        Processes all files in a directory, extracting sentences and splitting long sentences.
+        If `jsonl_files` is given, only those files of the input directory are processed.
+        With `num_workers` > 1 the files are spread across a process pool.
+        `segmenter` is 'regex' or 'punkt', see `split_block_into_chunks`.
+        """
+        if segmenter not in SEGMENTERS:
+            raise ValueError(f"Unknown sentence segmenter {segmenter!r}; use one of {SEGMENTERS}")
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        for jsonl_file in os.listdir(input_dir):
-            if jsonl_file.endswith(".jsonl"):
-                input_path = os.path.join(input_dir, jsonl_file)
-                output_path = os.path.join(output_dir, jsonl_file)
-
-                with open(input_path, 'r', encoding='utf-8') as infile, open(output_path, 'w', encoding='utf-8') as outfile:
-                    for line in infile:
-                        data = json.loads(line.strip())
-                        sentences = [sentence.strip() for sentence in re.split(r'[.!?]', data['text']) if sentence]
-                        
-                        for sentence in sentences:
-                            chunks = DataPreparation.split_sentence_into_chunks(sentence, max_tokens)
-                            for chunk in chunks:
-                                outfile.write(json.dumps({'sentence': chunk}) + '\n')
-                log(f"Processed file: {jsonl_file}")
+        if jsonl_files is None:
+            jsonl_files = os.listdir(input_dir)
+        tasks = [
+            (os.path.join(input_dir, jsonl_file), os.path.join(output_dir, jsonl_file), max_tokens, batch_size,
+             segmenter)
+            for jsonl_file in sorted(jsonl_files) if jsonl_file.endswith(".jsonl")
+        ]
+
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                for input_path in executor.map(_process_file, *zip(*tasks)) if tasks else []:
+                    log(f"Processed file: {os.path.basename(input_path)}")
+            return
+
+        for task in tasks:
+            _process_file(*task)
+            log(f"Processed file: {os.path.basename(task[0])}")
 
     @staticmethod
-    def combine_jsonl_files(input_dir, output_file):
-        """Combines all individual JSONL files into one."""
-        with open(output_file, 'w', encoding='utf-8') as outfile:
-            for jsonl_file in os.listdir(input_dir):
+    def combine_jsonl_files(input_dir, output_file, shard_size=None, compression=DEFAULT_COMPRESSION):
+        """
+        Combines all individual JSONL files into one and returns the number of lines written.
+        With `shard_size`, `output_file` is a directory of compressed shards of that many lines instead.
+        """
+        line_count = 0
+        with open_writer(output_file, shard_size, compression) as outfile:
+            for jsonl_file in sorted(os.listdir(input_dir)):
                 if jsonl_file.endswith(".jsonl"):
                     input_path = os.path.join(input_dir, jsonl_file)
                     with open(input_path, 'r', encoding='utf-8') as infile:
                         for line in infile:
                             outfile.write(line)
+                            line_count += 1
                     log(f"Merged file: {jsonl_file}")
+        return line_count
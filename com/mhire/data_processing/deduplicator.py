@@ -0,0 +1,301 @@
+# This file removes repeated sentences from the split sentence JSONL files before they are merged.
+# PDF extraction repeats running headers, footers, page numbers and copyright lines on every
+# page; they are dropped as exact duplicates of their normalized text (lowercased, whitespace
+# collapsed, and in short capitalized header-like lines the page number folded to 0) or as near duplicates
+# found with MinHash signatures over character shingles and locality-sensitive hashing. Near
+# duplicates must have the same numbers, so sentences differing only in a dose or a lab value
+# are all kept. The first occurrence is kept.
+#
+# The index lives in an SQLite file, so it is not bounded by memory and persists between runs:
+# files added later are deduplicated against everything indexed before, and a document's
+# entries can be removed when its file changes or disappears.
+
+import os
+import re
+import json
+import sqlite3
+import hashlib
+from itertools import islice
+from logging import info as log
+
+import numpy as np
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_SHINGLE_SIZE = 5
+DEFAULT_BATCH_SIZE = 10000
+# Fixed seed so signatures stay comparable with the ones already in the index.
+_HASH_SEED = 1234
+# Bound parameters per query; older SQLite builds allow at most 999.
+SQLITE_MAX_PARAMETERS = 999
+SQLITE_CACHE_KIB = 256 * 1024
+
+# Version of the normalization and band keys; an index built by another version is cleared.
+NORMALIZATION_VERSION = 2
+# Capitalized lines of at most this many words look like running headers or footers, e.g.
+# 'Chapter 3 Cardiology 112' or '12 Journal of Clinical Medicine'.
+HEADER_MAX_WORDS = 8
+
+_NUMBERS = re.compile(r'\d+')
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sentences (
+    id INTEGER PRIMARY KEY,
+    doc TEXT NOT NULL,
+    hash INTEGER NOT NULL UNIQUE,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sentences_doc ON sentences (doc);
+CREATE TABLE IF NOT EXISTS buckets (key INTEGER PRIMARY KEY, sentence_id INTEGER NOT NULL);
+"""
+
+
+class Deduplicator:
+    """
+    Exact and near-duplicate sentence removal backed by a persistent MinHash-LSH index.
+
+    Signatures have `num_perm` hash values split into `bands` bands. Two sentences become
+    candidates when all values of any band agree. With the defaults (16 bands of 4), pairs
+    with Jaccard similarity 0.8 collide with probability above 0.999. Candidates count as
+    duplicates when their signatures estimate a similarity of at least `threshold`.
+    """
+
+    def __init__(self, index_path, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD,
+                 shingle_size=DEFAULT_SHINGLE_SIZE, batch_size=DEFAULT_BATCH_SIZE, tokenizer=None):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.index_path = index_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.batch_size = batch_size
+        # Used only to report the tokens that removed sentences would have cost; words otherwise.
+        self.tokenizer = tokenizer
+
+        rng = np.random.RandomState(_HASH_SEED)
+        # Multiply-shift hashing: (a * x + b) mod 2**64, keeping the top 32 bits. `a` must be odd.
+        self._a = rng.randint(0, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.randint(0, 2**63, size=num_perm, dtype=np.uint64)
+        self._band_multipliers = rng.randint(0, 2**63, size=(bands, self.rows), dtype=np.uint64) | np.uint64(1)
+        self._band_offsets = np.arange(bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(index_path)
+        # The index is a rebuildable cache, so trade durability on power loss for write speed.
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}")
+        self.connection.executescript(_SCHEMA)
+        self._check_params()
+        self._next_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM sentences").fetchone()[0]
+
+    def _check_params(self):
+        params = json.dumps({'num_perm': self.num_perm, 'bands': self.bands, 'shingle_size': self.shingle_size,
+                             'seed': _HASH_SEED, 'normalization': NORMALIZATION_VERSION})
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is not None and row[0] != params:
+            # Signatures built with other parameters cannot be compared; start over.
+            log(f"Dedup index {self.index_path} was built with other parameters; clearing it")
+            self.connection.executescript("DELETE FROM sentences; DELETE FROM buckets;")
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+        self.connection.commit()
+
+    @staticmethod
+    def is_header_like(words):
+        """
+        True for a short line of capitalized words, such as a running header or footer: every
+        word is capitalized, a number or a short function word ('of', 'and').
+        """
+        return len(words) <= HEADER_MAX_WORDS and all(
+            word[:1].isupper() or word.isdigit() or (len(word) <= 3 and word.isalpha()) for word in words)
+
+    @staticmethod
+    def normalize(sentence):
+        """
+        Text used for hashing: lowercased and whitespace collapsed. In a header-like line (see
+        is_header_like) a number standing first or last, the page number, is folded to 0 so
+        that the line matches on every page. All other digits are kept, so sentences that
+        differ in a dose or a lab value stay distinct.
+        """
+        words = sentence.split()
+        if words and Deduplicator.is_header_like(words):
+            for index in {0, len(words) - 1}:
+                if words[index].isdigit():
+                    words[index] = '0'
+        return ' '.join(words).lower()
+
+    @staticmethod
+    def exact_hash(normalized):
+        return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+    def signatures(self, normalized_texts):
+        """
+        MinHash signatures of a batch of normalized texts as a (len(texts), num_perm) uint32 array.
+        The shingles of the whole batch are computed at once on one concatenated byte buffer.
+        """
+        k = self.shingle_size
+        encoded = [text.encode('utf-8').ljust(k, b'\0') for text in normalized_texts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+
+        # Every k-byte window of the buffer packed into one integer.
+        windows = len(buffer) - k + 1
+        grams = np.zeros(windows, dtype=np.uint64)
+        for i in range(k):
+            grams |= buffer[i:i + windows] << np.uint64(8 * i)
+
+        # Keep only the windows that lie within one text.
+        counts = lengths - k + 1
+        segment_starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        positions = np.arange(counts.sum()) + np.repeat(starts - segment_starts, counts)
+        grams = grams[positions]
+
+        signatures = np.empty((len(encoded), self.num_perm), dtype=np.uint32)
+        for p in range(self.num_perm):
+            hashed = (self._a[p] * grams + self._b[p]) >> np.uint64(32)
+            signatures[:, p] = np.minimum.reduceat(hashed, segment_starts)
+        return signatures
+
+    def band_keys(self, signatures, number_hashes):
+        """
+        LSH bucket keys of every band of every signature, as a (len(signatures), bands) int64 array.
+        The hash of each text's numbers is mixed into its keys, so only texts with the same
+        numbers become candidates.
+        """
+        banded = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        numbers = np.array(number_hashes, dtype=np.int64).view(np.uint64)[:, None]
+        keys = (banded * self._band_multipliers).sum(axis=2) + self._band_offsets + numbers
+        return keys.view(np.int64)
+
+    def _lookup(self, query, values):
+        """Runs `query`, whose `{}` stands for a parameter list, over `values` in chunks SQLite accepts."""
+        rows = []
+        for start in range(0, len(values), SQLITE_MAX_PARAMETERS):
+            chunk = values[start:start + SQLITE_MAX_PARAMETERS]
+            rows.extend(self.connection.execute(query.format(','.join('?' * len(chunk))), chunk))
+        return rows
+
+    def _dedup_batch(self, doc, normalized):
+        """
+        Returns None for every text of a batch that is kept, or 'exact' or 'near' for duplicates, and
+        indexes the kept texts. The index is read with a few bulk queries per batch and the batch's
+        own new sentences are tracked in memory, so duplicates within the batch are caught too.
+        """
+        signatures = self.signatures(normalized)
+        band_keys = self.band_keys(signatures, [self.exact_hash(' '.join(_NUMBERS.findall(text))) for text in normalized])
+        exact_hashes = [self.exact_hash(text) for text in normalized]
+
+        known_hashes = {row[0] for row in self._lookup(
+            "SELECT hash FROM sentences WHERE hash IN ({})", list(set(exact_hashes)))}
+        buckets = dict(self._lookup(
+            "SELECT key, sentence_id FROM buckets WHERE key IN ({})", np.unique(band_keys).tolist()))
+        candidate_signatures = {
+            sentence_id: np.frombuffer(signature, dtype=np.uint32)
+            for sentence_id, signature in self._lookup(
+                "SELECT id, signature FROM sentences WHERE id IN ({})", list(set(buckets.values())))
+        }
+
+        min_agreeing = self.threshold * self.num_perm
+        duplicates, new_sentences, new_keys, new_key_ids = [], [], [], []
+        for exact, signature, keys in zip(exact_hashes, signatures, band_keys.tolist()):
+            if exact in known_hashes:
+                duplicates.append('exact')
+                continue
+            candidates = {buckets[key] for key in keys if key in buckets}
+            if candidates:
+                agreeing = np.count_nonzero(
+                    np.stack([candidate_signatures[candidate] for candidate in candidates]) == signature, axis=1)
+                if agreeing.max() >= min_agreeing:
+                    duplicates.append('near')
+                    continue
+
+            sentence_id = self._next_id
+            self._next_id += 1
+            known_hashes.add(exact)
+            candidate_signatures[sentence_id] = signature
+            new_sentences.append((sentence_id, doc, exact, signature.tobytes()))
+            for key in keys:
+                # The first sentence seen in a bucket represents it.
+                if key not in buckets:
+                    buckets[key] = sentence_id
+                    new_keys.append(key)
+                    new_key_ids.append(sentence_id)
+            duplicates.append(None)
+
+        self.connection.executemany(
+            "INSERT INTO sentences (id, doc, hash, signature) VALUES (?, ?, ?, ?)", new_sentences)
+        # Inserting in key order walks the bucket B-tree sequentially instead of at random.
+        order = np.argsort(np.array(new_keys, dtype=np.int64), kind='stable')
+        self.connection.executemany("INSERT INTO buckets (key, sentence_id) VALUES (?, ?)",
+                                    zip(np.array(new_keys, dtype=np.int64)[order].tolist(),
+                                        np.array(new_key_ids, dtype=np.int64)[order].tolist()))
+        return duplicates
+
+    def _token_count(self, sentences):
+        if not sentences:
+            return 0
+        if self.tokenizer is None:
+            return sum(len(sentence.split()) for sentence in sentences)
+        encoded = self.tokenizer(sentences, add_special_tokens=False, return_attention_mask=False,
+                                 return_token_type_ids=False)
+        return sum(map(len, encoded['input_ids']))
+
+    def dedup_file(self, input_path, output_path, doc=None):
+        """
+        Copies the sentences of `input_path` that are not duplicates of an indexed sentence or of
+        an earlier sentence of the file to `output_path`, and indexes them under `doc` (the file
+        name by default). Returns counts of what was read and removed.
+        """
+        doc = doc or os.path.basename(input_path)
+        stats = {'sentences': 0, 'exact_duplicates': 0, 'near_duplicates': 0, 'words': 0, 'removed_tokens': 0}
+        with open(input_path, 'r', encoding='utf-8') as infile, open(output_path, 'w', encoding='utf-8') as outfile:
+            while True:
+                lines = list(islice(infile, self.batch_size))
+                if not lines:
+                    break
+                lines = [line for line in lines if not line.isspace()]
+                if not lines:
+                    continue
+                sentences = [record.get('sentence', '') for record in json.loads('[' + ','.join(lines) + ']')]
+                duplicates = self._dedup_batch(doc, [self.normalize(sentence) for sentence in sentences])
+
+                kept, removed = [], []
+                for line, sentence, duplicate in zip(lines, sentences, duplicates):
+                    if duplicate is None:
+                        kept.append(line)
+                        continue
+                    stats['exact_duplicates' if duplicate == 'exact' else 'near_duplicates'] += 1
+                    removed.append(sentence)
+                outfile.writelines(kept)
+                stats['sentences'] += len(lines)
+                stats['words'] += sum(len(sentence.split()) for sentence in sentences)
+                stats['removed_tokens'] += self._token_count(removed)
+        self.connection.commit()
+
+        removed_count = stats['exact_duplicates'] + stats['near_duplicates']
+        log(f"Deduplicated {doc}: removed {stats['exact_duplicates']} exact and {stats['near_duplicates']} near "
+            f"duplicates of {stats['sentences']} sentences ({removed_count / max(stats['sentences'], 1):.1%}), "
+            f"saving {stats['removed_tokens']} {'tokens' if self.tokenizer else 'words'}")
+        return stats
+
+    def documents(self):
+        """Names of the documents that have sentences in the index."""
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT doc FROM sentences")]
+
+    def remove_document(self, doc):
+        """
+        Removes a document's sentences from the index, e.g. before its changed file is deduplicated
+        again. Sentences of other files that were dropped as its duplicates stay dropped until
+        those files are deduplicated again.
+        """
+        self.connection.execute(
+            "DELETE FROM buckets WHERE sentence_id IN (SELECT id FROM sentences WHERE doc = ?)", (doc,))
+        self.connection.execute("DELETE FROM sentences WHERE doc = ?", (doc,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
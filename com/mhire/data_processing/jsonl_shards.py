@@ -0,0 +1,253 @@
+# This file writes and reads JSONL datasets as directories of fixed-size, compressed shards.
+# A dataset directory holds:
+#   shard-00000.jsonl.gz ...  up to `shard_size` records each, gzip- or zstd-compressed
+#   index.json                compression, record and byte counts and sha256 of every shard
+# Readers take either such a directory or a plain JSONL file, so every stage works on both.
+# Shards are independent, so they can be read and decompressed concurrently.
+
+import io
+import os
+import gzip
+import json
+import shutil
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import info as log
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_FILE = 'index.json'
+DEFAULT_SHARD_SIZE = 100_000
+DEFAULT_COMPRESSION = 'gzip'
+EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst', None: '.jsonl'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3, None: None}
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd compression needs the 'zstandard' package: pip install zstandard")
+
+
+def compress(data, compression, level=None):
+    """Compresses one shard's bytes. gzip output carries no timestamp, so equal shards hash equally."""
+    level = DEFAULT_LEVELS[compression] if level is None else level
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if compression == 'zstd':
+        _require_zstandard()
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def _compression_of(path):
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def is_sharded(path):
+    """True if `path` is a shard directory written by ShardWriter."""
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def read_index(path):
+    with open(os.path.join(path, INDEX_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def output_path(path):
+    """
+    The file that stands for the dataset in build manifests: the index of a shard directory,
+    which holds the hash of every shard, or the file itself.
+    """
+    return os.path.join(path, INDEX_FILE) if is_sharded(path) else path
+
+
+def shard_paths(path):
+    """Paths of the shards of a shard directory, in order, or [path] for a single JSONL file."""
+    if not is_sharded(path):
+        return [path]
+    return [os.path.join(path, shard['file']) for shard in read_index(path)['shards']]
+
+
+def dataset_size(path):
+    """Bytes the dataset takes on disk."""
+    return sum(os.path.getsize(shard) for shard in shard_paths(path))
+
+
+def record_count(path):
+    """Number of records, read from the index of a shard directory or counted in a single file."""
+    if is_sharded(path):
+        return read_index(path)['records']
+    return sum(1 for _ in read_lines(path))
+
+
+def open_text(path):
+    """Opens one JSONL file or shard for reading text, decompressing by its extension."""
+    compression = _compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if compression == 'zstd':
+        _require_zstandard()
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True),
+                                encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def _read_shard(path):
+    with open(path, 'rb') as f:
+        return decompress(f.read(), _compression_of(path)).decode('utf-8')
+
+
+def read_lines(path, num_workers=1):
+    """
+    Yields the lines of a JSONL file or shard directory in order.
+
+    With `num_workers` > 1, up to that many upcoming shards are read and decompressed on a
+    thread pool while the current one is consumed; zlib and zstd release the GIL while they
+    work. Without workers the shards are streamed, holding only a buffer in memory.
+    """
+    paths = shard_paths(path)
+    if num_workers <= 1 or len(paths) == 1:
+        for shard in paths:
+            with open_text(shard) as f:
+                yield from f
+        return
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for shard in paths:
+            pending.append(executor.submit(_read_shard, shard))
+            if len(pending) >= num_workers:
+                yield from io.StringIO(pending.popleft().result())
+        while pending:
+            yield from io.StringIO(pending.popleft().result())
+
+
+class ShardWriter:
+    """
+    Writes JSONL lines into a shard directory, `shard_size` records per shard. Shards are
+    compressed on a thread pool while the next one fills. Everything is written to a
+    temporary directory that replaces `output_dir` on close, so readers never see a
+    half-written dataset.
+
+    Use as a context manager:
+
+        with ShardWriter('/tmp/datasets/nsp_format') as writer:
+            writer.write(json.dumps(record) + '\\n')
+    """
+
+    def __init__(self, output_dir, shard_size=DEFAULT_SHARD_SIZE, compression=DEFAULT_COMPRESSION,
+                 compresslevel=None, max_workers=None):
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression {compression!r}; use one of {list(EXTENSIONS)}")
+        if compression == 'zstd':
+            _require_zstandard()
+        self.output_dir = output_dir.rstrip('/')
+        self.shard_size = shard_size
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self._tmp_dir = self.output_dir + '.tmp'
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir)
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._pending = deque()
+        self._buffer = []
+        self.shards = []
+        self.records = 0
+
+    def write(self, line):
+        self._buffer.append(line)
+        if len(self._buffer) >= self.shard_size:
+            self._flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _write_shard(self, name, lines):
+        data = ''.join(lines).encode('utf-8')
+        compressed = compress(data, self.compression, self.compresslevel)
+        with open(os.path.join(self._tmp_dir, name), 'wb') as f:
+            f.write(compressed)
+        return {'file': name, 'records': len(lines), 'bytes': len(data), 'compressed_bytes': len(compressed),
+                'sha256': hashlib.sha256(compressed).hexdigest()}
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        name = f'shard-{len(self.shards) + len(self._pending):05d}{EXTENSIONS[self.compression]}'
+        self._pending.append(self._executor.submit(self._write_shard, name, self._buffer))
+        self.records += len(self._buffer)
+        self._buffer = []
+        # Bound the shards held in memory.
+        while len(self._pending) > self._max_workers:
+            self.shards.append(self._pending.popleft().result())
+
+    def close(self):
+        """Writes the remaining records and the index, and moves the directory into place."""
+        self._flush()
+        try:
+            while self._pending:
+                self.shards.append(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+        index = {
+            'format': 'jsonl',
+            'compression': self.compression,
+            'shard_size': self.shard_size,
+            'records': self.records,
+            'bytes': sum(shard['bytes'] for shard in self.shards),
+            'compressed_bytes': sum(shard['compressed_bytes'] for shard in self.shards),
+            'shards': self.shards,
+        }
+        with open(os.path.join(self._tmp_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2)
+        # The path may still hold an earlier single-file dataset, which rmtree would leave in place.
+        if os.path.isdir(self.output_dir) and not os.path.islink(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        elif os.path.lexists(self.output_dir):
+            os.remove(self.output_dir)
+        os.replace(self._tmp_dir, self.output_dir)
+        if index['bytes']:
+            log(f"Wrote {self.records} records to {len(self.shards)} {self.compression or 'uncompressed'} shards "
+                f"in {self.output_dir}: {index['bytes']} bytes into {index['compressed_bytes']} "
+                f"({index['compressed_bytes'] / index['bytes']:.1%})")
+
+    def abort(self):
+        """Discards everything written so far."""
+        self._executor.shutdown(cancel_futures=True)
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def open_writer(path, shard_size=None, compression=DEFAULT_COMPRESSION):
+    """A ShardWriter for the directory `path` if `shard_size` is given, else a plain JSONL file."""
+    if shard_size:
+        return ShardWriter(path, shard_size=shard_size, compression=compression)
+    return open(path, 'w', encoding='utf-8')
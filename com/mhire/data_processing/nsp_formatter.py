@@ -1,8 +1,121 @@
-from data_processing.data_preparation import DataPreparation
-from logging import info as log
+from com.mhire.data_processing.data_preparation import DataPreparation
+from com.mhire.data_processing.jsonl_shards import DEFAULT_COMPRESSION, open_writer, read_lines
+from logging import info as log, warning
+from array import array
 import json
+import math
+import mmap
 import random
-import os, regex as re
+import struct
+import tempfile
+import os, re
+
+# Number of NSP records held in memory at once while shuffling.
+DEFAULT_SHUFFLE_BUFFER_SIZE = 1_000_000
+
+# Shard files open at once while scattering pairs, and the write buffer of each. Corpora that
+# need more shards are scattered again, shard by shard, so memory and file descriptors stay fixed.
+MAX_OPEN_SHARDS = 256
+SHARD_BUFFER_SIZE = 64 * 1024
+
+# Shard records are (index of sentence A, index of sentence B, label).
+_PAIR_RECORD = struct.Struct('<QQb')
+_OFFSET = struct.Struct('<Q')
+
+
+class _ShardScatter:
+    """
+    Scatters pair records uniformly at random over the shards `shard_count` shuffle buffers
+    need. At most MAX_OPEN_SHARDS files are written at once: with more shards, each file
+    is a bucket holding several of them, which `shuffled` scatters again when read.
+    """
+    def __init__(self, path_prefix, shard_count, rng):
+        self.rng = rng
+        self.fan_out = min(shard_count, MAX_OPEN_SHARDS)
+        # Shards every bucket still has to be split into.
+        self.bucket_shards = math.ceil(shard_count / self.fan_out)
+        self.paths = [f'{path_prefix}-{k:03d}.bin' for k in range(self.fan_out)]
+        self._files = [open(path, 'wb', buffering=SHARD_BUFFER_SIZE) for path in self.paths]
+
+    def write(self, record):
+        self._files[self.rng.randrange(self.fan_out)].write(record)
+
+    def close(self):
+        for shard in self._files:
+            shard.close()
+
+    def shuffled(self):
+        """Yields every record in uniformly random order, deleting the shard files as they are read."""
+        for path in self.paths:
+            if self.bucket_shards == 1:
+                with open(path, 'rb') as shard:
+                    records = list(_PAIR_RECORD.iter_unpack(shard.read()))
+                os.remove(path)
+                self.rng.shuffle(records)
+                yield from records
+                continue
+            scatter = _ShardScatter(path[:-len('.bin')], self.bucket_shards, self.rng)
+            try:
+                with open(path, 'rb') as bucket:
+                    for block in iter(lambda: bucket.read(_PAIR_RECORD.size * 4096), b''):
+                        for offset in range(0, len(block), _PAIR_RECORD.size):
+                            scatter.write(block[offset:offset + _PAIR_RECORD.size])
+            finally:
+                scatter.close()
+            os.remove(path)
+            yield from scatter.shuffled()
+
+
+class _SentenceStore:
+    """
+    Append-only on-disk sentence store with random access by index.
+    Sentences go into one data file and their end offsets into an index file;
+    both are memory-mapped for reading, so lookups cost no resident memory.
+    """
+    def __init__(self, directory):
+        self.data_path = os.path.join(directory, 'sentences.bin')
+        self.index_path = os.path.join(directory, 'sentences.idx')
+        self._data_file = open(self.data_path, 'wb')
+        self._index_file = open(self.index_path, 'wb')
+        self._index_buffer = array('Q')
+        self._end = 0
+        self.count = 0
+
+    def append(self, sentence):
+        encoded = sentence.encode('utf-8')
+        self._data_file.write(encoded)
+        self._end += len(encoded)
+        self._index_buffer.append(self._end)
+        self.count += 1
+        if len(self._index_buffer) >= 65536:
+            self._index_buffer.tofile(self._index_file)
+            self._index_buffer = array('Q')
+
+    def open_for_reading(self):
+        self._index_buffer.tofile(self._index_file)
+        self._data_file.close()
+        self._index_file.close()
+        self._data = self._map(self.data_path)
+        self._index = self._map(self.index_path)
+
+    @staticmethod
+    def _map(path):
+        if os.path.getsize(path) == 0:
+            return b''
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, i):
+        start = _OFFSET.unpack_from(self._index, (i - 1) * 8)[0] if i else 0
+        end = _OFFSET.unpack_from(self._index, i * 8)[0]
+        return self._data[start:end].decode('utf-8')
+
+    def close(self):
+        for mapped in (getattr(self, '_data', None), getattr(self, '_index', None)):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
 class NSPGenerator:
     """Handles Next Sentence Prediction (NSP) pair generation."""
     @staticmethod
@@ -32,15 +145,78 @@ class NSPGenerator:
         with open(output_file, 'w', encoding='utf-8') as outfile:
             for record in nsp_data:
                 record['sentence_a'] = DataPreparation.clean_sentence(record['sentence_a'])
-                record['sentence_b'] = DataPreparation.clean_sentence(record['sentence_b'])              
+                record['sentence_b'] = DataPreparation.clean_sentence(record['sentence_b'])
                 outfile.write(json.dumps(record, ensure_ascii=False) + '\n')
         log(f"NSP dataset created and saved to {output_file}")
+
+    @staticmethod
+    def generate_nsp_streaming(input_files, output_file, seed=None,
+                               shuffle_buffer_size=DEFAULT_SHUFFLE_BUFFER_SIZE, work_dir=None,
+                               shard_size=None, compression=DEFAULT_COMPRESSION, num_workers=1):
+        """
+        Generates the same positive/negative NSP pairs as `generate_nsp_pairs` with bounded memory.
+
+        Sentences are read from sentence JSONL files into a memory-mapped store, negatives are
+        drawn by index, and pair records are scattered over on-disk shards of about
+        `shuffle_buffer_size` records, at most MAX_OPEN_SHARDS of them open at once (see
+        _ShardScatter). Each shard is then shuffled in memory and appended to the output,
+        which yields a uniformly shuffled file. The output is reproducible under `seed`.
+        Inputs may be JSONL files or shard directories, read with `num_workers` threads. With
+        `shard_size`, the output is a directory of compressed shards of that many pairs.
+        Returns the number of pairs written.
+        """
+        rng = random.Random(seed)
+        with tempfile.TemporaryDirectory(dir=work_dir or os.path.dirname(os.path.abspath(output_file))) as tmp_dir:
+            store = _SentenceStore(tmp_dir)
+            for input_file in input_files:
+                for line in read_lines(input_file, num_workers):
+                    sentence = json.loads(line).get('sentence', '')
+                    if sentence:
+                        store.append(sentence)
+            store.open_for_reading()
+
+            try:
+                n = store.count
+                if n < 3:
+                    warning(f"Only {n} sentences found; negative NSP pairs need at least 3")
+                pair_count = 2 * max(n - 1, 0) if n >= 3 else max(n - 1, 0)
+                shard_count = max(1, math.ceil(pair_count / shuffle_buffer_size))
+                shards = _ShardScatter(os.path.join(tmp_dir, 'pairs'), shard_count, rng)
+                try:
+                    for i in range(n - 1):
+                        # Positive pair (next sentence is correct)
+                        shards.write(_PAIR_RECORD.pack(i, i + 1, 1))
+                        if n < 3:
+                            continue
+                        # Negative pair (next sentence is random)
+                        random_index = rng.randint(0, n - 1)
+                        while random_index == i or random_index == i + 1:
+                            random_index = rng.randint(0, n - 1)
+                        shards.write(_PAIR_RECORD.pack(i, random_index, 0))
+                finally:
+                    shards.close()
+
+                with open_writer(output_file, shard_size, compression) as outfile:
+                    outfile.writelines(
+                        json.dumps({
+                            "sentence_a": DataPreparation.clean_sentence(store[a]),
+                            "sentence_b": DataPreparation.clean_sentence(store[b]),
+                            "label": label,
+                        }, ensure_ascii=False) + '\n'
+                        for a, b, label in shards.shuffled()
+                    )
+            finally:
+                store.close()
+        log(f"NSP dataset with {pair_count} pairs created and saved to {output_file}")
+        return pair_count
+
     @staticmethod
-    def generate_nsp_from_directory(input_dir, output_dir, nsp_output_file, max_tokens=512):
+    def generate_nsp_from_directory(input_dir, output_dir, nsp_output_file, max_tokens=512, seed=None,
+                                    shuffle_buffer_size=DEFAULT_SHUFFLE_BUFFER_SIZE):
         """Processes all JSONL files in the input directory, splits sentences into chunks, and generates NSP pairs."""
-        sentences = []
+        output_paths = []
         # Process each file in the input directory
-        for jsonl_file in os.listdir(input_dir):
+        for jsonl_file in sorted(os.listdir(input_dir)):
             if jsonl_file.endswith(".jsonl"):
                 input_path = os.path.join(input_dir, jsonl_file)
                 output_path = os.path.join(output_dir, jsonl_file)
@@ -54,8 +230,9 @@ class NSPGenerator:
                             for sentence in sentences_in_file:
                                 chunks = DataPreparation.split_sentence_into_chunks(sentence, max_tokens)
                                 for chunk in chunks:
-                                    sentences.append(chunk)
                                     outfile.write(json.dumps({'sentence': chunk}) + '\n')
+                output_paths.append(output_path)
                 log(f"Processed file: {jsonl_file}")
-        # After processing files, generate NSP pairs
-        NSPGenerator.generate_nsp_pairs(sentences, nsp_output_file)
\ No newline at end of file
+        # After processing files, generate NSP pairs from the chunked sentences
+        NSPGenerator.generate_nsp_streaming(output_paths, nsp_output_file, seed=seed,
+                                            shuffle_buffer_size=shuffle_buffer_size)
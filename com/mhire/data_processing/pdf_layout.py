@@ -0,0 +1,308 @@
+# This file recovers the reading order and the paragraphs of PDF pages from the positions of their text.
+# PyPDF2's text extraction reports every run of text to a callback with its text matrix and font size:
+#   - runs on the same baseline are merged into lines, rotated text (margin stamps, watermarks) is dropped
+#   - gutters with no text across the page split it into columns, read one after the other; lines that
+#     span the columns (titles, figures captions) split the page into sections read top to bottom
+#   - consecutive lines are joined into a paragraph until a vertical gap, an indent, a change of font size
+#     or a short line ending a sentence; a paragraph left open at the end of a column or page carries on
+#   - words hyphenated across lines are rejoined
+#   - a page number alone on the top or bottom line of the page, in its header or footer margin, is dropped
+
+import re
+from collections import namedtuple
+from statistics import median
+
+from PyPDF2.generic import ContentStream, NameObject, TextStringObject
+
+TextLine = namedtuple('TextLine', ['x0', 'x1', 'y', 'size', 'text'])
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+SHOW_OPERATORS = (b'Tj', b'TJ', b"'", b'"')
+# Text state PyPDF2 does not report, by operator: character and word spacing, horizontal scaling and rise.
+TEXT_STATE_OPERATORS = {b'Tc': 0, b'Tw': 1, b'Tz': 2, b'Ts': 3}
+# Advance of a glyph, in thousandths of the font size, when the font does not list its widths.
+DEFAULT_GLYPH_WIDTH = 500
+TERMINAL_PUNCTUATION = ('.', '!', '?', ':', '"', '”')
+HYPHENATED = re.compile(r'[^\W\d_]-$')
+PAGE_NUMBER = re.compile(r'\d{1,4}|[ivxlc]{1,6}', re.IGNORECASE)
+# Headers and footers lie within this fraction of the page height from its top or bottom edge.
+HEADER_FOOTER_MARGIN = 0.1
+
+
+def _multiply(m, n):
+    return (
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5],
+    )
+
+
+def _advance(strings, font, size, char_spacing, word_spacing, scale):
+    """
+    Horizontal advance, in text space, of the strings and TJ adjustments of one text-showing
+    operator. Glyph widths come from the font's /Widths; two-byte fonts get a default width.
+    """
+    font = font or {}
+    two_byte = font.get('/Subtype') == '/Type0'
+    first_char = int(font['/FirstChar']) if '/FirstChar' in font else 0
+    widths = font['/Widths'] if '/Widths' in font and not two_byte else None
+    advance = 0.0
+    for item in strings:
+        if not isinstance(item, (str, bytes)):
+            advance -= float(item) / 1000 * size
+            continue
+        raw = bytes(item.get_original_bytes() if isinstance(item, TextStringObject) else item)
+        if two_byte:
+            glyphs, spaces = len(raw) // 2, 0
+            width = glyphs * DEFAULT_GLYPH_WIDTH
+        else:
+            glyphs, spaces = len(raw), raw.count(32)
+            width = sum(float(widths[code - first_char]) if widths is not None and 0 <= code - first_char < len(widths)
+                        else DEFAULT_GLYPH_WIDTH for code in raw)
+        advance += width / 1000 * size + glyphs * char_spacing + spaces * word_spacing
+    return advance * scale
+
+
+class _TextRuns:
+    """
+    Collects the text runs (x0, x1, y, size, text) of a page in page coordinates through the
+    callbacks of PyPDF2's text extraction. PyPDF2 only reports text when it flushes it, which
+    can merge the text of several operators, such as two columns written row by row, into one
+    string at one position. An identity `cm` after every text-showing operator flushes each
+    one on its own, at the text matrix it started at.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.runs = []
+
+    def run(self, content, resources, ctm):
+        """Collects the runs of `content`, whose fonts and forms are in `resources`, drawn with `ctm`."""
+        if not isinstance(content, ContentStream):
+            content = ContentStream(content, self.page.pdf)
+        marked = ContentStream(None, self.page.pdf)
+        for operation in content.operations:
+            marked.operations.append(operation)
+            if operation[1] in SHOW_OPERATORS:
+                marked.operations.append(([1, 0, 0, 1, 0, 0], b'cm'))
+        marked[NameObject('/Resources')] = resources
+
+        state, stack = [0.0, 0.0, 1.0, 0.0], []
+        # PyPDF2 does not move the text matrix past the text shown, so the advance since the
+        # matrix was last set is added here.
+        advanced = 0.0
+        shown = None
+        # Depth of the forms PyPDF2 extracts by itself; forms are run here instead, with their position.
+        depth = 0
+
+        def before(operator, operands, cm, tm):
+            nonlocal state, advanced, shown, depth
+            if operator == b'Do':
+                if depth == 0:
+                    self._run_form(operands[0], resources, _multiply(tuple(cm), ctm))
+                depth += 1
+            elif depth:
+                return
+            elif operator == b'q':
+                stack.append(list(state))
+            elif operator == b'Q':
+                state = stack.pop() if stack else state
+            elif operator in TEXT_STATE_OPERATORS:
+                value = float(operands[0])
+                state[TEXT_STATE_OPERATORS[operator]] = value / 100 if operator == b'Tz' else value
+            elif operator in (b'BT', b'Td', b'TD', b'Tm', b'T*'):
+                advanced = 0.0
+            elif operator in SHOW_OPERATORS:
+                if operator in (b"'", b'"'):
+                    advanced = 0.0
+                if operator == b'"':
+                    state[:2] = float(operands[1]), float(operands[0])
+                shown = {'strings': operands[0] if operator == b'TJ' else operands[-1:], 'text': '', 'at': None}
+
+        def after(operator, operands, cm, tm):
+            nonlocal advanced, shown, depth
+            if operator == b'Do':
+                depth -= 1
+            elif operator == b'cm' and shown is not None and not depth:
+                advanced += self._add_run(shown, advanced, *state, ctm)
+                shown = None
+
+        def visit_text(text, cm, tm, font, size):
+            if shown is not None and not depth:
+                shown['text'] += text
+                shown['at'] = (tuple(cm), tuple(tm), font, size)
+
+        self.page.extract_xform_text(marked, (0,), visitor_operand_before=before, visitor_operand_after=after,
+                                     visitor_text=visit_text)
+        return self.runs
+
+    def _run_form(self, name, resources, ctm):
+        forms = resources['/XObject'] if '/XObject' in resources else {}
+        form = forms[name] if name in forms else None
+        if form is not None and form.get('/Subtype') == '/Form':
+            matrix = tuple(map(float, form['/Matrix'])) if '/Matrix' in form else IDENTITY
+            self.run(form, form['/Resources'] if '/Resources' in form else resources, _multiply(matrix, ctm))
+
+    def _add_run(self, shown, offset, char_spacing, word_spacing, scale, rise, ctm):
+        """Adds the run of one text-showing operator drawn `offset` past the text matrix; returns its advance."""
+        if shown['at'] is None:
+            return 0.0
+        cm, tm, font, size = shown['at']
+        advance = _advance(shown['strings'], font, size, char_spacing, word_spacing, scale)
+        m = _multiply(_multiply((1.0, 0.0, 0.0, 1.0, offset, rise), tm), _multiply(cm, ctm))
+        # Only upright, horizontal text is part of the body.
+        if m[0] > 0 and m[3] > 0 and abs(m[1]) <= 0.01 * m[0]:
+            self.runs.append((m[4], m[4] + advance * m[0], m[5], size * m[3], shown['text']))
+        return advance
+
+
+def page_lines(page):
+    """
+    The lines of text of a page in content stream order, with their extent, baseline and font
+    size, without the page number.
+    """
+    contents = page.get_contents()
+    container = page
+    # Resources can be inherited from the page tree.
+    while '/Resources' not in container and '/Parent' in container:
+        container = container['/Parent']
+    if contents is None or '/Resources' not in container:
+        return []
+    runs = _TextRuns(page).run(contents, container['/Resources'], IDENTITY)
+
+    lines = []
+    for x0, x1, y, size, text in runs:
+        if lines:
+            line = lines[-1]
+            # Same baseline, give or take a superscript, and no wider apart than a word space.
+            if abs(y - line.y) <= 0.5 * max(size, line.size) and line.x1 - size <= x0 <= line.x1 + 0.8 * size:
+                separator = ' ' if x0 > line.x1 + 0.15 * size and not line.text.endswith(' ') else ''
+                lines[-1] = line._replace(x1=max(x1, line.x1), text=line.text + separator + text)
+                continue
+        if text.strip():
+            lines.append(TextLine(x0, x1, y, size, text))
+    lines = [line._replace(text=' '.join(line.text.split())) for line in lines if line.text.strip()]
+    return without_page_number(lines, float(page.mediabox.bottom), float(page.mediabox.top))
+
+
+def without_page_number(lines, bottom, top):
+    """
+    `lines` without the ones that only hold a page number: a number or roman numeral that is
+    the topmost or bottommost line of the page and lies in its header or footer margin. The
+    same text anywhere else, a table cell or a word such as 'mix', is kept.
+    """
+    if not lines:
+        return lines
+    margin = HEADER_FOOTER_MARGIN * (top - bottom)
+    highest, lowest = max(line.y for line in lines), min(line.y for line in lines)
+
+    def is_page_number(line):
+        return PAGE_NUMBER.fullmatch(line.text) is not None and (
+            line.y == highest and line.y >= top - margin or line.y == lowest and line.y <= bottom + margin)
+
+    return [line for line in lines if not is_page_number(line)]
+
+
+def find_gutters(lines, min_lines=3):
+    """
+    x ranges of the page crossed by no line, between at least `min_lines` lines on either side.
+    Lines wider than half the text block (titles, captions across the columns) are ignored.
+    """
+    if len(lines) < 2 * min_lines:
+        return []
+    left, right = min(line.x0 for line in lines), max(line.x1 for line in lines)
+    narrow = [line for line in lines if line.x1 - line.x0 <= (right - left) / 2]
+    min_width = median(line.size for line in lines)
+
+    gutters, covered_to = [], left
+    for line in sorted(narrow, key=lambda line: line.x0):
+        if line.x0 - covered_to >= min_width:
+            gutters.append((covered_to, line.x0))
+        covered_to = max(covered_to, line.x1)
+    return [(start, end) for start, end in gutters
+            if sum(line.x1 <= start for line in narrow) >= min_lines
+            and sum(line.x0 >= end for line in narrow) >= min_lines]
+
+
+def reading_order(lines):
+    """
+    `lines` as blocks of lines in reading order, one per column of every section of the page.
+    Without gutters, the whole page is one block in content stream order.
+    """
+    gutters = find_gutters(lines)
+    if not gutters:
+        return [lines] if lines else []
+
+    def column(line):
+        index = sum(line.x0 >= end for _, end in gutters)
+        # A line reaching into the next column spans the columns.
+        return None if index < len(gutters) and line.x1 > gutters[index][1] else index
+
+    blocks, section = [], {}
+    for line in sorted(lines, key=lambda line: -line.y):
+        index = column(line)
+        if index is None:
+            blocks.extend(section[key] for key in sorted(section))
+            blocks.append([line])
+            section = {}
+        else:
+            section.setdefault(index, []).append(line)
+    blocks.extend(section[key] for key in sorted(section))
+    return [sorted(block, key=lambda line: (-round(line.y), line.x0)) for block in blocks]
+
+
+def join_lines(text, line):
+    """Appends a wrapped line to a paragraph, rejoining a word hyphenated across the two."""
+    if text.endswith('\u00ad'):
+        return text[:-1] + line
+    if HYPHENATED.search(text) and line[:1].islower():
+        return text[:-1] + line
+    return text + ' ' + line
+
+
+class ParagraphBuilder:
+    """
+    Joins the lines of consecutive pages into paragraphs. Feed pages in order to `add_page`,
+    which returns the paragraphs completed on that page, and `finish` once after the last one.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.previous = None
+
+    def _breaks_before(self, line, left, right, spacing):
+        previous = self.previous
+        if previous is None:
+            return False
+        ends_sentence = self.text.endswith(TERMINAL_PUNCTUATION)
+        if abs(line.size - previous.size) > 0.15 * previous.size:
+            return True
+        if spacing is None:
+            # First line of a column or page: the paragraph goes on unless the last one ended or this one is indented.
+            return ends_sentence or line.x0 - left >= line.size
+        if line.x0 - previous.x0 >= line.size:
+            return True
+        gap = previous.y - line.y
+        if gap > 1.4 * spacing or gap < 0:
+            return True
+        return ends_sentence and previous.x1 < right - 0.2 * (right - left)
+
+    def add_page(self, lines):
+        paragraphs = []
+        for block in reading_order(lines):
+            left, right = min(line.x0 for line in block), max(line.x1 for line in block)
+            gaps = [a.y - b.y for a, b in zip(block, block[1:]) if a.y - b.y > 0.5 * b.size]
+            spacing = median(gaps) if gaps else None
+            for index, line in enumerate(block):
+                if self._breaks_before(line, left, right, spacing if index else None):
+                    paragraphs.append(self.text)
+                    self.text = ''
+                self.text = join_lines(self.text, line.text) if self.text else line.text
+                self.previous = line
+        return paragraphs
+
+    def finish(self):
+        """The paragraph left open after the last page, if any."""
+        paragraphs = [self.text] if self.text else []
+        self.text, self.previous = '', None
+        return paragraphs
@@ -1,30 +1,109 @@
 import os
 import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from logging import info as log
 from PyPDF2 import PdfReader
+from com.mhire.data_processing.pdf_layout import ParagraphBuilder, page_lines
+
+# PDFs with more pages than this are split into page ranges so that a single
+# large textbook is spread across several workers instead of pinning one.
+DEFAULT_PAGES_PER_TASK = 200
+
+
+def _write_texts(texts, outfile):
+    for text in texts:
+        json.dump({'text': text}, outfile)
+        outfile.write('\n')
+
+
+def _write_page_range(reader, outfile, start_page, end_page, layout):
+    """
+    Streams pages [start_page, end_page) of an open PDF to a JSONL file, as paragraphs with
+    `layout`, otherwise one record per extracted line. Paragraphs carry across pages of the
+    range but not past its end, so the serial and parallel paths write the same records.
+    """
+    if not layout:
+        for page_number in range(start_page, end_page):
+            lines = reader.pages[page_number].extract_text().splitlines()
+            _write_texts([line.strip() for line in lines if line.strip()], outfile)
+        return
+    paragraphs = ParagraphBuilder()
+    for page_number in range(start_page, end_page):
+        _write_texts(paragraphs.add_page(page_lines(reader.pages[page_number])), outfile)
+    _write_texts(paragraphs.finish(), outfile)
+
+
+def _parse_page_range(input_path, part_path, start_page, end_page, layout=True):
+    """Worker entry point: extracts pages [start_page, end_page) of a PDF into a part file."""
+    with open(input_path, 'rb') as f, open(part_path, 'w', encoding='utf-8') as outfile:
+        _write_page_range(PdfReader(f), outfile, start_page, end_page, layout)
+    return part_path
+
 
 class PDFParser:
-    def __init__(self):
+    def __init__(self, num_workers=1, pages_per_task=DEFAULT_PAGES_PER_TASK, layout=True):
         self.reader = None
+        self.num_workers = num_workers
+        self.pages_per_task = pages_per_task
+        self.layout = layout
 
-    def parse_pdfs(self, input_dir, output_dir):
-        """Parses PDFs in the input directory and creates JSONL file with line by line text."""
+    def parse_pdfs(self, input_dir, output_dir, pdf_files=None):
+        """
+        Parses PDFs in the input directory and creates a JSONL file of {'text': ...} records per PDF.
+        With `layout` (the default) every record is a paragraph, rebuilt from the positions of the
+        text on the page (see pdf_layout); otherwise every record is one line as PyPDF2 extracts it.
+        If `pdf_files` is given, only those PDFs of the input directory are parsed.
+        """
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        for pdf_file in os.listdir(input_dir):
-            if pdf_file.endswith(".pdf"):
+        if pdf_files is None:
+            pdf_files = os.listdir(input_dir)
+        pdf_files = sorted(pdf_file for pdf_file in pdf_files if pdf_file.endswith(".pdf"))
+        if self.num_workers > 1:
+            self._parse_pdfs_parallel(input_dir, output_dir, pdf_files)
+            return
+
+        for pdf_file in pdf_files:
+            input_path = os.path.join(input_dir, pdf_file)
+            output_path = os.path.join(output_dir, pdf_file.replace(".pdf", ".jsonl"))
+
+            with open(input_path, 'rb') as f, open(output_path, 'w', encoding='utf-8') as outfile:
+                self.reader = PdfReader(f)
+                page_count = len(self.reader.pages)
+                for start_page in range(0, page_count, self.pages_per_task):
+                    end_page = min(start_page + self.pages_per_task, page_count)
+                    _write_page_range(self.reader, outfile, start_page, end_page, self.layout)
+            log(f"Processed PDF and saved JSONL: {output_path}")
+
+    def _parse_pdfs_parallel(self, input_dir, output_dir, pdf_files):
+        """
+        Spreads PDFs, and page ranges of large PDFs, across a process pool.
+        Each task streams its pages to a part file; parts are concatenated in
+        page order so the result is byte-identical to the serial path.
+        """
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            pending = []
+            for pdf_file in pdf_files:
                 input_path = os.path.join(input_dir, pdf_file)
                 output_path = os.path.join(output_dir, pdf_file.replace(".pdf", ".jsonl"))
-
                 with open(input_path, 'rb') as f:
-                    self.reader = PdfReader(f)
-                    text_lines = []
-                    for page in self.reader.pages:
-                        text_lines.extend(page.extract_text().splitlines())
+                    page_count = len(PdfReader(f).pages)
+
+                futures = []
+                for start_page in range(0, page_count, self.pages_per_task):
+                    end_page = min(start_page + self.pages_per_task, page_count)
+                    part_path = f"{output_path}.part{start_page:08d}"
+                    futures.append(executor.submit(
+                        _parse_page_range, input_path, part_path, start_page, end_page, self.layout))
+                pending.append((output_path, futures))
 
+            for output_path, futures in pending:
                 with open(output_path, 'w', encoding='utf-8') as outfile:
-                    for line in text_lines:
-                        json.dump({'sentence': line.strip()}, outfile)
-                        outfile.write('\n')
+                    for future in futures:
+                        part_path = future.result()
+                        with open(part_path, 'r', encoding='utf-8') as part:
+                            shutil.copyfileobj(part, outfile)
+                        os.remove(part_path)
                 log(f"Processed PDF and saved JSONL: {output_path}")
@@ -1,45 +1,43 @@
-import torch
 from datasets import load_dataset
-from transformers import TextDatasetForNextSentencePrediction
-from torch.utils.data import Dataset
+from com.mhire.data_processing.jsonl_shards import shard_paths
+from com.mhire.data_processing.token_store import TokenStore, TokenStoreDataset
 import logging, json
 
 class PreTrainingDataHandler:
     def __init__(self, tokenizer):
         self.tokenizer = tokenizer
 
-    def prepare_nsp_dataset(self, file_path, block_size=512):
-        """
-        Use TextDatasetForNextSentencePrediction for NSP data preparation.
-        """
-        try:
-            logging.info(f"Preparing NSP dataset from {file_path}")
-            return TextDatasetForNextSentencePrediction(
-                tokenizer=self.tokenizer,
-                file_path=file_path,
-                block_size=block_size,
-                overwrite_cache=True,
-            )
-        except Exception as e:
-            logging.error(f"Error preparing NSP dataset: {str(e)}")
-            raise
-
-    def prepare_mlm_dataset(self, file_path, max_length=512):
+    def prepare_mlm_dataset(self, file_path, max_length=512, pad_to_max_length=False, num_proc=None):
         """
         Prepare MLM dataset using Hugging Face's load_dataset utility.
+        `file_path` may be a JSONL file or a shard directory, whose shards are loaded by `num_proc` processes.
+        Files packed by TokenPacker carry their token ids and are not tokenized again.
+        Sequences are left unpadded for the collator's dynamic padding unless pad_to_max_length is set.
         """
         try:
             logging.info(f"Preparing MLM dataset from {file_path}")
-            mlm_data = load_dataset("json", data_files=file_path, split="train")
-            mlm_data = mlm_data.map(
-                lambda x: self.tokenizer(
-                    x["sentence"],
-                    truncation=True,
-                    padding="max_length",
-                    max_length=max_length,
-                ),
-                batched=True,
-            )
+            mlm_data = load_dataset("json", data_files=shard_paths(file_path), split="train", num_proc=num_proc)
+            padding = "max_length" if pad_to_max_length else False
+            if "input_ids" in mlm_data.column_names:
+                # Packed by TokenPacker: already tokenized, only the attention mask and padding are left.
+                mlm_data = mlm_data.map(
+                    lambda x: self.tokenizer.pad(
+                        {"input_ids": x["input_ids"]},
+                        padding=padding,
+                        max_length=max_length,
+                    ),
+                    batched=True,
+                )
+            else:
+                mlm_data = mlm_data.map(
+                    lambda x: self.tokenizer(
+                        x["sentence"],
+                        truncation=True,
+                        padding=padding,
+                        max_length=max_length,
+                    ),
+                    batched=True,
+                )
             mlm_data = mlm_data.map(lambda x: {"labels": x["input_ids"]}, batched=True)
             mlm_data.set_format(type="torch", columns=["input_ids", "attention_mask", "labels"])
             return mlm_data
@@ -47,36 +45,32 @@ class PreTrainingDataHandler:
             logging.error(f"Error preparing MLM dataset: {str(e)}")
             raise
 
-    def combine_datasets(self, mlm_dataset, nsp_dataset):
-        class CombinedDataset(Dataset):
-            def __init__(self, mlm_dataset, nsp_dataset):
-                self.mlm_dataset = mlm_dataset
-                self.nsp_dataset = nsp_dataset
-
-            def __len__(self):
-                return max(len(self.mlm_dataset), len(self.nsp_dataset))
-
-            def __getitem__(self, idx):
-                mlm_example = self.mlm_dataset[idx % len(self.mlm_dataset)]
-                nsp_example = self.nsp_dataset[idx % len(self.nsp_dataset)]
-
-                input_ids = mlm_example["input_ids"]
-                attention_mask = mlm_example["attention_mask"]
-                labels = mlm_example["labels"]
-
-                token_type_ids = nsp_example.get("token_type_ids", torch.zeros_like(input_ids))
-                token_type_ids = token_type_ids[:len(input_ids)]
-                token_type_ids = torch.nn.functional.pad(token_type_ids, (0, len(input_ids) - len(token_type_ids)))
-
-                next_sentence_label = nsp_example.get("next_sentence_label", -1)
-
-                return {
-                    "input_ids": input_ids,
-                    "attention_mask": attention_mask,
-                    "token_type_ids": token_type_ids,
-                    "labels": labels,
-                    "next_sentence_label": next_sentence_label,
-                }
+    def prepare_token_store_dataset(self, file_path, store_dir, max_length=512, num_workers=1):
+        """
+        Compile the NSP pairs in file_path (a JSONL file or shard directory) into a memory-mapped
+        token store, unless store_dir already holds one compiled from the same file, and read from it.
+        Shards are decompressed by num_workers threads while compiling.
+        """
+        try:
+            if TokenStore.is_current(store_dir, self.tokenizer, file_path, max_length):
+                logging.info(f"Using compiled token store {store_dir}")
+            else:
+                logging.info(f"Compiling token store {store_dir} from {file_path}")
+                TokenStore.compile(self.tokenizer, file_path, store_dir, max_length, num_workers=num_workers)
+            return TokenStoreDataset(store_dir)
+        except Exception as e:
+            logging.error(f"Error preparing token store dataset: {str(e)}")
+            raise
 
-        logging.info("Combining MLM and NSP datasets")
-        return CombinedDataset(mlm_dataset, nsp_dataset)
+    def prepare_pair_dataset(self, file_path, max_length=512):
+        """
+        Build [CLS] A [SEP] B [SEP] examples from the NSP pairs in file_path in one batched pass.
+        Token ids, segment ids and NSP labels are stored contiguously, so every NSP label
+        belongs to the very tokens the MLM objective is trained on.
+        """
+        try:
+            logging.info(f"Preparing sentence pair dataset from {file_path}")
+            return TokenStore.build_in_memory(self.tokenizer, file_path, max_length)
+        except Exception as e:
+            logging.error(f"Error preparing sentence pair dataset: {str(e)}")
+            raise
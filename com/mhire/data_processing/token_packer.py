@@ -0,0 +1,85 @@
+# This file packs the merged sentence JSONL into blocks of exactly `max_length` wordpieces.
+# Lengths are measured with the model's own fast tokenizer, in batches, and the token ids
+# are stored next to the text so the MLM dataset never has to tokenize the corpus again.
+
+import json
+from itertools import islice
+from logging import info as log
+from com.mhire.data_processing.jsonl_shards import DEFAULT_COMPRESSION, open_writer, read_lines
+
+
+class TokenPacker:
+    """Packs consecutive sentences into full-length, pre-tokenized MLM blocks."""
+
+    def __init__(self, tokenizer, max_length=512, batch_size=1000):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.batch_size = batch_size
+        # Room left for [CLS] and [SEP] in every block.
+        self.block_tokens = max_length - tokenizer.num_special_tokens_to_add(pair=False)
+
+    def _tokenize_batches(self, infile):
+        """Yields (sentence, token ids, offsets) for every sentence, tokenizing a batch at a time."""
+        while True:
+            sentences = [json.loads(line)['sentence'] for line in islice(infile, self.batch_size)]
+            if not sentences:
+                break
+            encoded = self.tokenizer(
+                sentences,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )
+            yield from zip(sentences, encoded['input_ids'], encoded['offset_mapping'])
+
+    def _pieces(self, infile):
+        """Yields (text, token ids) pieces no longer than a block, splitting over-long sentences."""
+        for sentence, ids, offsets in self._tokenize_batches(infile):
+            for start in range(0, len(ids), self.block_tokens):
+                end = min(start + self.block_tokens, len(ids))
+                if start == 0 and end == len(ids):
+                    yield sentence, ids
+                else:
+                    yield sentence[offsets[start][0]:offsets[end - 1][1]], ids[start:end]
+
+    def pack_file(self, input_file, output_file, shard_size=None, compression=DEFAULT_COMPRESSION):
+        """
+        Packs the sentences of `input_file` (a JSONL file or shard directory) into blocks written
+        to `output_file` as JSONL, or as shards of `shard_size` blocks if given; returns the block count.
+        """
+        cls_id, sep_id = self.tokenizer.cls_token_id, self.tokenizer.sep_token_id
+        block_texts, block_ids = [], []
+        sentence_count = block_count = sentence_tokens = block_tokens = 0
+
+        infile = read_lines(input_file)
+        with open_writer(output_file, shard_size, compression) as outfile:
+            def flush():
+                nonlocal block_count, block_tokens
+                if block_ids:
+                    ids = [cls_id] + block_ids + [sep_id]
+                    outfile.write(json.dumps({'sentence': ' '.join(block_texts), 'input_ids': ids}) + '\n')
+                    block_count += 1
+                    block_tokens += len(ids)
+                    block_texts.clear()
+                    block_ids.clear()
+
+            for text, ids in self._pieces(infile):
+                if not ids:
+                    continue
+                sentence_count += 1
+                sentence_tokens += min(len(ids) + 2, self.max_length)
+                if len(block_ids) + len(ids) > self.block_tokens:
+                    flush()
+                block_texts.append(text)
+                block_ids.extend(ids)
+            flush()
+
+        if block_count:
+            log(
+                f"Packed {sentence_count} sentences into {block_count} blocks of up to {self.max_length} tokens: "
+                f"{block_tokens / (block_count * self.max_length):.1%} of padded positions hold real tokens, "
+                f"versus {sentence_tokens / (sentence_count * self.max_length):.1%} with one sentence per example"
+            )
+        log(f"Packed MLM dataset saved to {output_file}")
+        return block_count
@@ -0,0 +1,221 @@
+# This file turns the NSP pair JSONL into [CLS] A [SEP] B [SEP] examples stored in flat token
+# arrays, either in memory or compiled once into a memory-mapped store, so training can start
+# without tokenizing the corpus again. A store directory holds:
+#   input_ids.bin            token ids of every example back to back (uint16, or uint32 for large vocabularies)
+#   token_type_ids.bin       segment ids aligned with input_ids (uint8)
+#   word_starts.bin          1 where a token starts a word, 0 on '##' continuations (uint8), for whole-word masking
+#   next_sentence_label.bin  one NSP label per example (int8)
+#   offsets.bin              start of every example in input_ids, plus the total (int64)
+#   meta.json                dtypes, counts and the source the store was compiled from
+
+import os
+import json
+import hashlib
+import shutil
+from itertools import chain, islice
+from logging import info as log
+
+import numpy as np
+from torch.utils.data import Dataset
+
+from com.mhire.data_processing.jsonl_shards import output_path, read_lines
+
+META_FILE = 'meta.json'
+# Bumped whenever the store layout changes, so older stores are recompiled.
+STORE_FORMAT = 2
+
+
+class TokenStore:
+    """Tokenizes NSP pairs into flat token arrays, held in memory or compiled into a memory-mapped store."""
+
+    @staticmethod
+    def id_dtype(tokenizer):
+        """Smallest unsigned dtype that holds every token id of the tokenizer."""
+        return np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+    @staticmethod
+    def word_start_table(tokenizer):
+        """Boolean array over the vocabulary: True for tokens that begin a word, False for '##' continuations."""
+        vocab = tokenizer.get_vocab()
+        table = np.ones(max(len(tokenizer), max(vocab.values(), default=-1) + 1), dtype=bool)
+        continuations = [token_id for token, token_id in vocab.items() if token.startswith('##')]
+        table[continuations] = False
+        return table
+
+    @staticmethod
+    def encode_pairs(tokenizer, file_path, max_length=512, batch_size=1000, num_workers=1):
+        """
+        Yields (input_ids, token_type_ids, word_starts, labels, lengths) numpy arrays for batches of NSP pairs.
+        Each batch is tokenized as [CLS] A [SEP] B [SEP] in one tokenizer call and flattened into
+        contiguous arrays, so no per-example structures outlive the batch. `file_path` may be a
+        JSONL file or a shard directory, whose shards are decompressed by `num_workers` threads.
+        """
+        id_dtype = TokenStore.id_dtype(tokenizer)
+        word_starts = TokenStore.word_start_table(tokenizer).astype(np.uint8)
+        infile = read_lines(file_path, num_workers)
+        while True:
+            records = [json.loads(line) for line in islice(infile, batch_size)]
+            if not records:
+                break
+            encoded = tokenizer(
+                [record['sentence_a'] for record in records],
+                [record['sentence_b'] for record in records],
+                truncation=True,
+                max_length=max_length,
+                return_attention_mask=False,
+            )
+            lengths = np.fromiter(map(len, encoded['input_ids']), dtype=np.int64, count=len(records))
+            total = int(lengths.sum())
+            input_ids = np.fromiter(chain.from_iterable(encoded['input_ids']), dtype=id_dtype, count=total)
+            yield (
+                input_ids,
+                np.fromiter(chain.from_iterable(encoded['token_type_ids']), dtype=np.uint8, count=total),
+                word_starts[input_ids],
+                np.fromiter((record['label'] for record in records), dtype=np.int8, count=len(records)),
+                lengths,
+            )
+
+    @staticmethod
+    def build_in_memory(tokenizer, file_path, max_length=512, batch_size=1000):
+        """Tokenizes the NSP pairs in `file_path` into a SentencePairDataset held in memory."""
+        batches = list(TokenStore.encode_pairs(tokenizer, file_path, max_length, batch_size))
+        input_ids, token_type_ids, word_starts, labels, lengths = (
+            np.concatenate([batch[i] for batch in batches]) if batches else np.zeros(0, dtype=dtype)
+            for i, dtype in enumerate((TokenStore.id_dtype(tokenizer), np.uint8, np.uint8, np.int8, np.int64))
+        )
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(lengths)])
+        log(f"Built {len(labels)} sentence pairs ({int(offsets[-1])} tokens) from {file_path}")
+        return SentencePairDataset(input_ids, token_type_ids, labels, offsets, word_starts)
+
+    @staticmethod
+    def _source_meta(tokenizer, file_path, max_length):
+        # A shard directory is rewritten as a whole, index last, so the index stands for all of it.
+        stat = os.stat(output_path(file_path))
+        return {
+            'source': os.path.abspath(file_path),
+            'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns,
+            'tokenizer': tokenizer.name_or_path,
+            'vocab_size': len(tokenizer),
+            # Terms added by VocabularyExtender change the ids without changing the tokenizer's name.
+            'added_tokens': hashlib.sha256(json.dumps(sorted(tokenizer.get_added_vocab().items())).encode()).hexdigest(),
+            'max_length': max_length,
+            'format': STORE_FORMAT,
+        }
+
+    @staticmethod
+    def is_current(store_dir, tokenizer, file_path, max_length=512):
+        """True if `store_dir` was compiled from the current `file_path` with the same tokenizer settings."""
+        meta_path = os.path.join(store_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        expected = TokenStore._source_meta(tokenizer, file_path, max_length)
+        return all(meta.get(key) == value for key, value in expected.items())
+
+    @staticmethod
+    def compile(tokenizer, file_path, store_dir, max_length=512, batch_size=1000, num_workers=1):
+        """Tokenizes the NSP pairs in `file_path` (a JSONL file or shard directory) and writes them to `store_dir`."""
+        id_dtype = TokenStore.id_dtype(tokenizer)
+        tmp_dir = store_dir.rstrip('/') + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        count = total = 0
+        with open(os.path.join(tmp_dir, 'input_ids.bin'), 'wb') as ids_file, \
+                open(os.path.join(tmp_dir, 'token_type_ids.bin'), 'wb') as types_file, \
+                open(os.path.join(tmp_dir, 'word_starts.bin'), 'wb') as word_starts_file, \
+                open(os.path.join(tmp_dir, 'next_sentence_label.bin'), 'wb') as labels_file, \
+                open(os.path.join(tmp_dir, 'offsets.bin'), 'wb') as offsets_file:
+            np.zeros(1, dtype=np.int64).tofile(offsets_file)
+            for input_ids, token_type_ids, word_starts, labels, lengths in TokenStore.encode_pairs(
+                    tokenizer, file_path, max_length, batch_size, num_workers):
+                input_ids.tofile(ids_file)
+                token_type_ids.tofile(types_file)
+                word_starts.tofile(word_starts_file)
+                labels.tofile(labels_file)
+                (total + np.cumsum(lengths)).tofile(offsets_file)
+                count += len(labels)
+                total += len(input_ids)
+
+        meta = TokenStore._source_meta(tokenizer, file_path, max_length)
+        meta.update({'count': count, 'tokens': total, 'id_dtype': np.dtype(id_dtype).name})
+        with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.replace(tmp_dir, store_dir)
+        log(f"Compiled {count} examples ({total} tokens) from {file_path} into {store_dir}")
+
+
+class SentencePairDataset(Dataset):
+    """
+    Sentence-pair examples stored back to back: flat token id and segment id arrays located
+    through an offsets index, plus one NSP label per example, and optionally the word-start
+    mask used for whole-word masking. Items are numpy views into the arrays, so indexing
+    allocates nothing per token; the data collator turns a whole batch into tensors at once.
+    """
+
+    def __init__(self, input_ids, token_type_ids, next_sentence_label, offsets, word_starts=None):
+        self.input_ids = input_ids
+        self.token_type_ids = token_type_ids
+        self.next_sentence_label = next_sentence_label
+        self.offsets = offsets
+        self.word_starts = word_starts
+
+    @property
+    def lengths(self):
+        """Number of tokens of every example."""
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        item = {
+            "input_ids": self.input_ids[start:end],
+            "token_type_ids": self.token_type_ids[start:end],
+            "attention_mask": np.broadcast_to(np.uint8(1), (end - start,)),
+            "next_sentence_label": int(self.next_sentence_label[idx]),
+        }
+        if self.word_starts is not None:
+            item["word_starts"] = self.word_starts[start:end]
+        return item
+
+
+class TokenStoreDataset(SentencePairDataset):
+    """
+    Dataset over a compiled token store. The arrays are memory-mapped read-only, so DataLoader
+    workers share the page cache instead of holding copies.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._open()
+
+    def _open(self):
+        def load(name, dtype):
+            path = os.path.join(self.store_dir, name)
+            if os.path.getsize(path) == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode='r')
+
+        super().__init__(
+            load('input_ids.bin', np.dtype(self.meta['id_dtype'])),
+            load('token_type_ids.bin', np.uint8),
+            load('next_sentence_label.bin', np.int8),
+            load('offsets.bin', np.int64),
+            load('word_starts.bin', np.uint8),
+        )
+
+    def __getstate__(self):
+        # Reopen the maps in spawned workers instead of pickling their contents.
+        return {'store_dir': self.store_dir, 'meta': self.meta}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
@@ -0,0 +1,196 @@
+# This file mines frequent domain terms from the prepared sentence corpus and adds them to the
+# tokenizer as whole words. Medical terms that bert-base-uncased splits into many wordpieces
+# then cost one token each, so the same text fits in shorter sequences. The extended tokenizer
+# is saved with a vocabulary.json that records the new terms, their counts and their original
+# wordpieces, and the corpus it was mined from.
+
+import os
+import re
+import json
+import heapq
+import tempfile
+from collections import Counter
+from contextlib import ExitStack
+from itertools import groupby, islice
+from logging import info as log
+
+from tokenizers import AddedToken
+
+from com.mhire.data_processing.jsonl_shards import output_path, read_lines
+
+VOCABULARY_FILE = 'vocabulary.json'
+WORD = re.compile(r'[^\W\d_]+')
+
+
+class VocabularyExtender:
+    """
+    Extends a WordPiece tokenizer with the domain terms that save the most tokens.
+
+    Terms are counted in one streaming pass. Whenever more than `max_candidates` terms are
+    held in memory, their counts are spilled to a sorted run on disk, and the runs are merged
+    at the end, so memory stays flat and the counts are exact whatever the corpus order.
+    A term qualifies if it is at least `min_length` letters long, occurs `min_frequency`
+    times and the tokenizer splits it into `min_pieces` or more wordpieces; the
+    `max_new_tokens` terms saving the most tokens are added.
+    """
+
+    def __init__(self, tokenizer, max_new_tokens=5000, min_frequency=100, min_pieces=3, min_length=4,
+                 max_candidates=1_000_000, batch_size=10000):
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.min_frequency = min_frequency
+        self.min_pieces = min_pieces
+        self.min_length = min_length
+        self.max_candidates = max_candidates
+        self.batch_size = batch_size
+
+    def params(self):
+        return {
+            'base_tokenizer': self.tokenizer.name_or_path,
+            'max_new_tokens': self.max_new_tokens,
+            'min_frequency': self.min_frequency,
+            'min_pieces': self.min_pieces,
+            'min_length': self.min_length,
+        }
+
+    def _normalize(self, text):
+        normalizer = self.tokenizer.backend_tokenizer.normalizer
+        return normalizer.normalize_str(text) if normalizer else text
+
+    def _sentence_batches(self, corpus_path, num_workers=1):
+        lines = read_lines(corpus_path, num_workers)
+        while True:
+            batch = [json.loads(line)['sentence'] for line in islice(lines, self.batch_size)]
+            if not batch:
+                break
+            yield batch
+
+    def count_terms(self, corpus_path, num_workers=1, work_dir=None):
+        """
+        Counts the words of a sentence JSONL file or shard directory. Returns (counts of the
+        terms occurring at least `min_frequency` times, sentences read). Spilled runs are
+        written to a temporary directory in `work_dir`.
+        """
+        counts = Counter()
+        sentences = 0
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+            runs = []
+            for batch in self._sentence_batches(corpus_path, num_workers):
+                sentences += len(batch)
+                # Normalize and split the whole batch at once rather than sentence by sentence.
+                counts.update(word for word in WORD.findall(self._normalize('\n'.join(batch)))
+                              if len(word) >= self.min_length)
+                if len(counts) > self.max_candidates:
+                    runs.append(self._spill(counts, os.path.join(tmp_dir, f'run-{len(runs):05d}.tsv')))
+                    counts = Counter()
+            if runs:
+                runs.append(self._spill(counts, os.path.join(tmp_dir, f'run-{len(runs):05d}.tsv')))
+                log(f"Merging {len(runs)} spilled term count runs")
+                counts = self._merge_runs(runs)
+        return Counter({term: count for term, count in counts.items() if count >= self.min_frequency}), sentences
+
+    @staticmethod
+    def _spill(counts, path):
+        """Writes `counts` to `path` as 'term<TAB>count' lines sorted by term."""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(f'{term}\t{count}\n' for term, count in sorted(counts.items()))
+        return path
+
+    def _merge_runs(self, paths):
+        """Sums the counts of sorted runs in one merge pass, keeping the terms that reach `min_frequency`."""
+        def read_run(f):
+            for line in f:
+                term, _, count = line.rstrip('\n').partition('\t')
+                yield term, int(count)
+
+        counts = Counter()
+        with ExitStack() as stack:
+            runs = [read_run(stack.enter_context(open(path, 'r', encoding='utf-8'))) for path in paths]
+            for term, entries in groupby(heapq.merge(*runs), key=lambda entry: entry[0]):
+                count = sum(count for _, count in entries)
+                if count >= self.min_frequency:
+                    counts[term] = count
+        return counts
+
+    @staticmethod
+    def subword_ids(tokenizer, term):
+        """Ids of the wordpieces `term` is made of in the base vocabulary, ignoring added tokens."""
+        return [token.id for token in tokenizer.backend_tokenizer.model.tokenize(term)]
+
+    def select_terms(self, counts):
+        """Returns [(term, count, wordpiece ids)] of the terms to add, the largest token savings first."""
+        vocab = self.tokenizer.get_vocab()
+        frequent = [term for term, count in counts.items() if count >= self.min_frequency and term not in vocab]
+        candidates = []
+        for term in frequent:
+            pieces = self.subword_ids(self.tokenizer, term)
+            if len(pieces) >= self.min_pieces:
+                candidates.append((term, counts[term], pieces))
+        return heapq.nlargest(self.max_new_tokens, candidates, key=lambda c: (c[1] * (len(c[2]) - 1), c[0]))
+
+    def token_count(self, tokenizer, corpus_path, sample_size=None):
+        """Wordpieces the first `sample_size` sentences (all if None) take with `tokenizer`."""
+        total = read = 0
+        for batch in self._sentence_batches(corpus_path):
+            if sample_size is not None:
+                batch = batch[:sample_size - read]
+            total += sum(map(len, tokenizer(batch, add_special_tokens=False, return_attention_mask=False,
+                                             return_token_type_ids=False)['input_ids']))
+            read += len(batch)
+            if sample_size is not None and read >= sample_size:
+                break
+        return total
+
+    @staticmethod
+    def _source_meta(corpus_path):
+        stat = os.stat(output_path(corpus_path))
+        return {'source': os.path.abspath(corpus_path), 'source_size': stat.st_size,
+                'source_mtime_ns': stat.st_mtime_ns}
+
+    def is_current(self, output_dir, corpus_path):
+        """True if `output_dir` holds a tokenizer extended from the current corpus with the same settings."""
+        vocabulary_path = os.path.join(output_dir, VOCABULARY_FILE)
+        if not os.path.exists(vocabulary_path):
+            return False
+        with open(vocabulary_path, 'r', encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        expected = dict(self._source_meta(corpus_path), params=self.params())
+        return all(vocabulary.get(key) == value for key, value in expected.items())
+
+    def extend(self, corpus_path, output_dir, num_workers=1, sample_size=100_000):
+        """
+        Mines terms from `corpus_path`, adds them to a copy of the tokenizer saved in `output_dir`
+        and returns a report: terms added, and the corpus size in tokens before and after on a
+        sample of `sample_size` sentences.
+        """
+        counts, sentences = self.count_terms(corpus_path, num_workers)
+        terms = self.select_terms(counts)
+        log(f"{len(counts)} terms occur at least {self.min_frequency} times in {sentences} sentences; "
+            f"adding {len(terms)} to the vocabulary")
+
+        self.tokenizer.save_pretrained(output_dir)
+        extended = type(self.tokenizer).from_pretrained(output_dir)
+        # Whole words only, so a new term never matches inside a longer word.
+        extended.add_tokens([AddedToken(term, single_word=True, normalized=True) for term, _, _ in terms])
+        extended.save_pretrained(output_dir)
+
+        tokens_before = self.token_count(self.tokenizer, corpus_path, sample_size)
+        tokens_after = self.token_count(extended, corpus_path, sample_size)
+        report = {
+            'new_tokens': len(terms),
+            'vocab_size': len(extended),
+            'sampled_sentences': min(sentences, sample_size) if sample_size else sentences,
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'token_reduction': 1 - tokens_after / tokens_before if tokens_before else 0.0,
+        }
+        vocabulary = dict(self._source_meta(corpus_path), params=self.params(), report=report, terms=[
+            {'term': term, 'count': count, 'subword_ids': pieces} for term, count, pieces in terms
+        ])
+        tmp_path = os.path.join(output_dir, VOCABULARY_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f, indent=2)
+        os.replace(tmp_path, os.path.join(output_dir, VOCABULARY_FILE))
+        log(f"Extended tokenizer saved to {output_dir}: {tokens_before} -> {tokens_after} tokens on "
+            f"{report['sampled_sentences']} sentences ({report['token_reduction']:.1%} shorter)")
+        return report
@@ -0,0 +1,169 @@
+# This file groups concurrent inference requests into batches for the inference service.
+# A MicroBatcher queues single items from many asyncio tasks and runs them through a batch
+# function together, so one forward pass serves many requests. Results are kept in an LRU
+# cache, and identical items already in flight are computed once.
+
+import time
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_CACHE_SIZE = 10000
+# Latencies kept for the percentiles; older ones are dropped.
+LATENCY_WINDOW = 100_000
+_MISSING = object()
+
+
+class LRUCache:
+    """A dict bounded to `capacity` entries that evicts the least recently used one."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LatencyStats:
+    """Request latencies and batch sizes, summarized as percentiles and throughput."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.items = 0
+        self.started = time.perf_counter()
+
+    def record_request(self, seconds, items=1):
+        self.latencies.append(seconds)
+        self.requests += 1
+        self.items += items
+
+    def record_batch(self, size):
+        self.batch_sizes.append(size)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        summary = {
+            'requests': self.requests,
+            'items': self.items,
+            'requests_per_second': self.requests / elapsed if elapsed else 0.0,
+            'items_per_second': self.items / elapsed if elapsed else 0.0,
+            'batches': len(self.batch_sizes),
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+        }
+        if self.latencies:
+            p50, p90, p99 = np.percentile(np.asarray(self.latencies) * 1000, [50, 90, 99])
+            summary.update(latency_p50_ms=p50, latency_p90_ms=p90, latency_p99_ms=p99,
+                           latency_max_ms=max(self.latencies) * 1000)
+        return summary
+
+
+class MicroBatcher:
+    """
+    Runs `fn(items) -> results` on batches of items submitted one at a time by concurrent tasks.
+
+    After the first item of a batch arrives, the batcher waits at most `max_wait_ms` for more,
+    up to `max_batch_size`, then runs `fn` on a worker thread so the event loop keeps accepting
+    requests. While one batch runs, the next one fills, so batches grow with the load. Items
+    must be hashable: they are the keys of an LRU cache of `cache_size` results, and an item
+    already waiting or running is not queued a second time.
+    """
+
+    def __init__(self, fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache = LRUCache(cache_size)
+        self.stats = LatencyStats()
+        self._queue = None
+        self._arrived = None
+        self._in_flight = {}
+        self._worker = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro-batcher')
+
+    def start(self):
+        """Starts the batching task on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._arrived = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown()
+
+    async def submit(self, item):
+        """The result of `fn` for `item`."""
+        result = self.cache.get(item, _MISSING)
+        if result is not _MISSING:
+            return result
+        future = self._in_flight.get(item)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[item] = future
+            self._queue.put_nowait(item)
+            self._arrived.set()
+        return await asyncio.shield(future)
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            # Waiting on an event rather than on the queue, so a timeout can never drop an item.
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            self.stats.record_batch(len(batch))
+            try:
+                results = await loop.run_in_executor(self._executor, self.fn, batch)
+            except Exception as e:
+                for item in batch:
+                    self._in_flight.pop(item).set_exception(e)
+                continue
+            for item, result in zip(batch, results):
+                self.cache.put(item, result)
+                self._in_flight.pop(item).set_result(result)
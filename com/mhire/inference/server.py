@@ -0,0 +1,226 @@
+# This file serves the pretrained domain BERT over a small asyncio HTTP/1.1 JSON API:
+#   POST /embed      {"texts": [...]}               -> {"embeddings": [[float, ...], ...]}
+#   POST /fill_mask  {"texts": [...], "top_k": 5}   -> {"predictions": [[[{"token", "score"}, ...] per [MASK]] per text]}
+#   GET  /stats      latency percentiles, throughput, batch sizes and cache hit rates per endpoint
+#   GET  /health
+# The model is loaded once; concurrent requests are micro-batched and repeated texts are
+# answered from an LRU cache.
+#
+#   python -m com.mhire.inference.server --model-dir /tmp/trained_model --port 8080 --backend int8
+
+import json
+import time
+import asyncio
+import argparse
+from http import HTTPStatus
+from logging import info as log, exception
+
+from com.mhire.inference.inference_model import BACKENDS, InferenceModel
+from com.mhire.inference.micro_batcher import (
+    DEFAULT_CACHE_SIZE, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, MicroBatcher,
+)
+from com.mhire.utility.instrumentation import configure_logging
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_TEXTS_PER_REQUEST = 1024
+
+
+class InferenceService:
+    """
+    Embedding and [MASK] prediction requests over one InferenceModel. Each text of a request
+    is submitted to the endpoint's MicroBatcher on its own, so texts of concurrent requests
+    share forward passes and repeated texts hit the cache.
+    """
+
+    def __init__(self, model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.model = model
+        self.embedder = MicroBatcher(self._embed_batch, max_batch_size, max_wait_ms, cache_size)
+        self.mask_filler = MicroBatcher(self._fill_mask_batch, max_batch_size, max_wait_ms, cache_size)
+
+    def _embed_batch(self, texts):
+        return list(self.model.embed(texts))
+
+    def _fill_mask_batch(self, items):
+        top_k = max(k for _, k in items)
+        predictions = self.model.fill_mask([text for text, _ in items], top_k)
+        return [[masks[:k] for masks in text_predictions] for (_, k), text_predictions in zip(items, predictions)]
+
+    def start(self):
+        self.embedder.start()
+        self.mask_filler.start()
+
+    async def close(self):
+        await self.embedder.close()
+        await self.mask_filler.close()
+
+    @staticmethod
+    async def _request(batcher, items):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(item) for item in items))
+        batcher.stats.record_request(time.perf_counter() - start, len(items))
+        return results
+
+    async def embed(self, texts):
+        """Normalized sentence embeddings of `texts`, as float32 arrays."""
+        return await self._request(self.embedder, texts)
+
+    async def fill_mask(self, texts, top_k=5):
+        """The `top_k` (token, probability) predictions at every [MASK] of every text."""
+        return await self._request(self.mask_filler, [(text, top_k) for text in texts])
+
+    def stats(self):
+        stats = {}
+        for name, batcher in (('embed', self.embedder), ('fill_mask', self.mask_filler)):
+            cache = batcher.cache
+            lookups = cache.hits + cache.misses
+            stats[name] = dict(batcher.stats.summary(), cache_entries=len(cache),
+                               cache_hit_rate=cache.hits / lookups if lookups else 0.0)
+        return stats
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _texts(body):
+    texts = body.get('texts')
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "'texts' must be a list of strings")
+    if len(texts) > MAX_TEXTS_PER_REQUEST:
+        raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"At most {MAX_TEXTS_PER_REQUEST} texts per request")
+    return texts
+
+
+class InferenceServer:
+    """A minimal HTTP/1.1 server with keep-alive, routing JSON requests to an InferenceService."""
+
+    def __init__(self, service, host='127.0.0.1', port=8080):
+        self.service = service
+        self.host = host
+        self.port = port
+
+    async def route(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return {'status': 'ok', 'backend': self.service.model.backend}
+        if method == 'GET' and path == '/stats':
+            return self.service.stats()
+        if method == 'POST' and path == '/embed':
+            embeddings = await self.service.embed(_texts(body))
+            return {'embeddings': [embedding.tolist() for embedding in embeddings]}
+        if method == 'POST' and path == '/fill_mask':
+            top_k = body.get('top_k', 5)
+            if not isinstance(top_k, int) or top_k < 1:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "'top_k' must be a positive integer")
+            predictions = await self.service.fill_mask(_texts(body), top_k)
+            return {'predictions': [[[{'token': token, 'score': score} for token, score in mask] for mask in text]
+                                    for text in predictions]}
+        raise RequestError(HTTPStatus.NOT_FOUND, f"No route for {method} {path}")
+
+    @staticmethod
+    async def _read_request(reader):
+        """(method, path, version, headers, body) of the next request, or None at end of stream."""
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        try:
+            method, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Bodies are limited to {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b''
+        return method, path.split('?', 1)[0], version, headers, body
+
+    @staticmethod
+    def _response(status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        return head.encode('latin-1') + body
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, path, version, headers, body = request
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                    try:
+                        payload = json.loads(body) if body else {}
+                    except ValueError:
+                        raise RequestError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON")
+                    if not isinstance(payload, dict):
+                        raise RequestError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+                    response = self._response(HTTPStatus.OK, await self.route(method, path, payload), keep_alive)
+                except RequestError as e:
+                    response = self._response(e.status, {'error': str(e)}, keep_alive)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    exception(f"Inference request failed: {e}")
+                    response = self._response(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}, keep_alive)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Starts the service and listens; returns the asyncio server. Port 0 picks a free port."""
+        self.service.start()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        log(f"Serving {self.service.model.backend} inference on http://{self.host}:{self.port}")
+        return server
+
+    async def serve_forever(self):
+        server = await self.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve embeddings and [MASK] predictions of the pretrained model.')
+    parser.add_argument('--model-dir', default='/tmp/trained_model/')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--backend', choices=BACKENDS, default='torch')
+    parser.add_argument('--max-length', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads; all cores by default')
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE)
+    args = parser.parse_args()
+    configure_logging()
+
+    model = InferenceModel(args.model_dir, backend=args.backend, max_length=args.max_length,
+                           num_threads=args.threads)
+    service = InferenceService(model, args.max_batch_size, args.max_wait_ms, args.cache_size)
+    try:
+        asyncio.run(InferenceServer(service, args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
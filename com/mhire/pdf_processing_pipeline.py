@@ -1,20 +1,72 @@
-from logging import basicConfig, INFO
+import os
+from functools import lru_cache
+from logging import exception, info as log
 from com.mhire.data_processing.pdf_parser import PDFParser
 from com.mhire.data_processing.data_preparation import DataPreparation
+from com.mhire.data_processing.deduplicator import NORMALIZATION_VERSION, Deduplicator
+from com.mhire.data_processing import jsonl_shards
 from com.mhire.data_processing.nsp_formatter import NSPGenerator
+from com.mhire.data_processing.token_packer import TokenPacker
+from com.mhire.utility.build_manifest import BuildManifest
 from com.mhire.utility.directory_management import create_directories, cleanup_directories
+from com.mhire.utility.instrumentation import RunReport, configure_logging
 from com.mhire.utility.ntlk_util import ensure_nltk_data
-
-# Setup logging
-basicConfig(level=INFO)
+from transformers import BertTokenizerFast
 
 # Configuration
 INPUT_PDF_DIR = 'tmp/input/local_pdfs'
 INTERMEDIATE_JSONL_DIR = 'tmp/intermediate/local_jsonls'
 INTERMEDIATE_PROCESSED_JSONL_DIR = 'tmp/intermediate/processed_jsonls'
+INTERMEDIATE_DEDUP_JSONL_DIR = 'tmp/intermediate/dedup_jsonls'
 OUTPUT_JSONL_DIR = '/tmp/datasets/'
-MLM_OUTPUT_FILE = '/tmp/datasets/mlm_format.jsonl'
-NSP_OUTPUT_FILE = '/tmp/datasets/nsp_format.jsonl'
+MLM_OUTPUT_DIR = '/tmp/datasets/mlm_format'
+NSP_OUTPUT_DIR = '/tmp/datasets/nsp_format'
+MLM_PACKED_OUTPUT_DIR = '/tmp/datasets/mlm_packed'
+PDF_PARSER_WORKERS = os.cpu_count() or 1
+DATA_PREPARATION_WORKERS = os.cpu_count() or 1
+MAX_TOKENS = 512
+NSP_SEED = 42
+NSP_SHUFFLE_BUFFER_SIZE = 1_000_000
+
+# Layout-aware parsing writes one record per paragraph, with wrapped lines and hyphenated
+# words rejoined and columns read in order; False writes every extracted line as a record.
+# The paragraphs are split into sentences by SENTENCE_SEGMENTER ('punkt' or 'regex').
+PDF_LAYOUT = True
+SENTENCE_SEGMENTER = 'punkt'
+
+# The merged, packed and NSP datasets are written as directories of compressed JSONL shards
+# of OUTPUT_SHARD_SIZE records ('gzip', or 'zstd' with the zstandard package installed).
+OUTPUT_SHARD_SIZE = 100_000
+OUTPUT_COMPRESSION = 'gzip'
+READER_WORKERS = os.cpu_count() or 1
+
+# Tokenizer-aware packing of the merged sentences into full-length MLM blocks, for MLM-only
+# training with prepare_mlm_dataset. The pretraining runner trains on the NSP pairs and does
+# not read them, so the extra tokenization pass is off by default.
+PACK_MLM_BLOCKS = False
+TOKENIZER_NAME = 'bert-base-uncased'
+MODEL_MAX_LENGTH = 512
+
+# Removal of repeated headers, footers, page numbers and other boilerplate sentences:
+# exact duplicates after normalization and near duplicates found with MinHash-LSH, against
+# an index kept between runs.
+DEDUPLICATE = True
+DEDUP_INDEX_FILE = 'tmp/intermediate/dedup_index.sqlite'
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_THRESHOLD = 0.8
+
+# Incremental build: inputs, intermediates and outputs are kept between runs and
+# tracked in the manifest, so only the stages whose inputs changed are redone.
+INCREMENTAL_BUILD = True
+BUILD_MANIFEST_FILE = 'tmp/intermediate/build_manifest.json'
+
+# Per-stage timing, CPU, memory and throughput of every run are written to a JSON report
+# here. Set PROFILE_STAGE to a stage name ('parse', 'split', 'dedup', 'merge', 'pack', 'nsp') to
+# also run that stage under cProfile.
+LOG_FILE = 'logs/pdf_processing_pipeline.log'
+REPORT_DIR = 'tmp/reports'
+PROFILE_STAGE = None
 
 DIRECTORIES = [
     'tmp',
@@ -23,41 +75,210 @@ DIRECTORIES = [
     'tmp/intermediate',
     'tmp/intermediate/local_jsonls',
     'tmp/intermediate/processed_jsonls',
+    'tmp/intermediate/dedup_jsonls',
     '/tmp/datasets/'
 ]
 
+def _stale_entries(manifest, stage, keys):
+    """Returns the names in `keys` whose recorded output for `stage` is missing or out of date."""
+    if manifest is None:
+        return list(keys)
+    return [name for name, key in keys.items() if not manifest.is_current(stage, name, key)]
+
+def _record_entries(manifest, stage, keys, output_paths):
+    if manifest is None:
+        return
+    for name, key in keys.items():
+        if not manifest.is_current(stage, name, key):
+            manifest.record(stage, name, key, output_paths[name])
+    manifest.prune(stage, keys)
+    manifest.save()
+
+@lru_cache(maxsize=None)
+def _tokenizer():
+    return BertTokenizerFast.from_pretrained(TOKENIZER_NAME, model_max_length=MODEL_MAX_LENGTH)
+
+def _deduplicate(manifest, jsonl_files, stage):
+    """
+    Deduplicates the split JSONL files that changed against the persisted index, in file order.
+    Files that changed or disappeared have their old sentences removed from the index first.
+    """
+    if manifest is None and os.path.exists(DEDUP_INDEX_FILE):
+        # Without incremental builds every file is deduplicated again, so start from an empty index.
+        os.remove(DEDUP_INDEX_FILE)
+    dedup_params = {'num_perm': DEDUP_NUM_PERM, 'bands': DEDUP_BANDS, 'threshold': DEDUP_THRESHOLD,
+                    'normalization': NORMALIZATION_VERSION}
+    dedup_keys = {
+        jsonl_file: BuildManifest.stage_key([manifest.output_hash('split', jsonl_file)], dedup_params)
+        for jsonl_file in jsonl_files
+    } if manifest else dict.fromkeys(jsonl_files)
+    stale_jsonls = _stale_entries(manifest, 'dedup', dedup_keys)
+    log(f"Deduplicating {len(stale_jsonls)} of {len(jsonl_files)} JSONL files")
+
+    deduplicator = Deduplicator(DEDUP_INDEX_FILE, num_perm=DEDUP_NUM_PERM, bands=DEDUP_BANDS,
+                                threshold=DEDUP_THRESHOLD, tokenizer=_tokenizer() if stale_jsonls else None)
+    try:
+        for doc in set(deduplicator.documents()) - (set(jsonl_files) - set(stale_jsonls)):
+            deduplicator.remove_document(doc)
+        for jsonl_file in stale_jsonls:
+            file_stats = deduplicator.dedup_file(
+                os.path.join(INTERMEDIATE_PROCESSED_JSONL_DIR, jsonl_file),
+                os.path.join(INTERMEDIATE_DEDUP_JSONL_DIR, jsonl_file),
+                doc=jsonl_file,
+            )
+            for key, value in file_stats.items():
+                stage.extra[key] += value
+    finally:
+        deduplicator.close()
+    _record_entries(manifest, 'dedup', dedup_keys, {
+        jsonl_file: os.path.join(INTERMEDIATE_DEDUP_JSONL_DIR, jsonl_file) for jsonl_file in jsonl_files
+    })
+    stage.skipped = not stale_jsonls
+    if stale_jsonls:
+        log(f"Deduplication removed {stage.extra['exact_duplicates']} exact and {stage.extra['near_duplicates']} "
+            f"near duplicates of {stage.extra['sentences']} sentences, saving {stage.extra['removed_tokens']} tokens")
+
+def _file_sizes(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
 def main():
     """Main function for processing PDFs into a merged JSONL for MLM pretraining."""
-    try:
-        # Ensure required NLTK data
-        ensure_nltk_data()
+    configure_logging(log_file=LOG_FILE)
+    with RunReport('pdf_processing', REPORT_DIR, profile_stage=PROFILE_STAGE) as report:
+        try:
+            _run_pipeline(report)
+        except Exception:
+            exception("PDF processing pipeline failed")
+            raise
 
-        # Create required directories
-        create_directories(DIRECTORIES)
+def _run_pipeline(report):
+    # Ensure required NLTK data
+    ensure_nltk_data()
 
-        # Step 1: Parse PDFs into JSONL format (line by line)
-        pdf_parser = PDFParser()
-        pdf_parser.parse_pdfs(INPUT_PDF_DIR, INTERMEDIATE_JSONL_DIR)
+    # Create required directories
+    create_directories(DIRECTORIES)
+    manifest = BuildManifest(BUILD_MANIFEST_FILE) if INCREMENTAL_BUILD else None
 
-        # Step 2: Extract sentences from JSONL files and split them into chunks
+    # Step 1: Parse PDFs into JSONL format (paragraph by paragraph)
+    with report.stage('parse') as stage:
+        pdf_files = sorted(f for f in os.listdir(INPUT_PDF_DIR) if f.endswith(".pdf"))
+        parsed_files = {pdf_file: pdf_file.replace(".pdf", ".jsonl") for pdf_file in pdf_files}
+        parse_keys = {
+            pdf_file: BuildManifest.stage_key([manifest.file_hash(os.path.join(INPUT_PDF_DIR, pdf_file))],
+                                              {'layout': PDF_LAYOUT})
+            for pdf_file in pdf_files
+        } if manifest else dict.fromkeys(pdf_files)
+        stale_pdfs = _stale_entries(manifest, 'parse', parse_keys)
+        log(f"Parsing {len(stale_pdfs)} of {len(pdf_files)} PDFs")
+        pdf_parser = PDFParser(num_workers=PDF_PARSER_WORKERS, layout=PDF_LAYOUT)
+        pdf_parser.parse_pdfs(INPUT_PDF_DIR, INTERMEDIATE_JSONL_DIR, pdf_files=stale_pdfs)
+        _record_entries(manifest, 'parse', parse_keys, {
+            pdf_file: os.path.join(INTERMEDIATE_JSONL_DIR, parsed_files[pdf_file]) for pdf_file in pdf_files
+        })
+        stage.items = len(stale_pdfs)
+        stage.bytes = _file_sizes(os.path.join(INPUT_PDF_DIR, pdf_file) for pdf_file in stale_pdfs)
+        stage.skipped = not stale_pdfs
+
+    # Step 2: Extract sentences from JSONL files and split them into chunks
+    with report.stage('split') as stage:
+        jsonl_files = sorted(parsed_files.values())
+        split_keys = {
+            jsonl_file: BuildManifest.stage_key(
+                [manifest.file_hash(os.path.join(INTERMEDIATE_JSONL_DIR, jsonl_file))],
+                {'max_tokens': MAX_TOKENS, 'segmenter': SENTENCE_SEGMENTER},
+            )
+            for jsonl_file in jsonl_files
+        } if manifest else dict.fromkeys(jsonl_files)
+        stale_jsonls = _stale_entries(manifest, 'split', split_keys)
+        log(f"Splitting {len(stale_jsonls)} of {len(jsonl_files)} JSONL files")
         data_preparation = DataPreparation()
         data_preparation.process_all_files_in_directory(
-            INTERMEDIATE_JSONL_DIR, 
-            INTERMEDIATE_PROCESSED_JSONL_DIR, 
-            max_tokens=512
+            INTERMEDIATE_JSONL_DIR,
+            INTERMEDIATE_PROCESSED_JSONL_DIR,
+            max_tokens=MAX_TOKENS,
+            jsonl_files=stale_jsonls,
+            num_workers=DATA_PREPARATION_WORKERS,
+            segmenter=SENTENCE_SEGMENTER,
         )
+        _record_entries(manifest, 'split', split_keys, {
+            jsonl_file: os.path.join(INTERMEDIATE_PROCESSED_JSONL_DIR, jsonl_file) for jsonl_file in jsonl_files
+        })
+        stage.items = len(stale_jsonls)
+        stage.bytes = _file_sizes(os.path.join(INTERMEDIATE_JSONL_DIR, jsonl_file) for jsonl_file in stale_jsonls)
+        stage.skipped = not stale_jsonls
+
+    # Step 2b: Remove duplicate and boilerplate sentences
+    sentence_dir = INTERMEDIATE_PROCESSED_JSONL_DIR
+    sentence_stage = 'split'
+    if DEDUPLICATE:
+        with report.stage('dedup') as stage:
+            stage.extra.update(sentences=0, exact_duplicates=0, near_duplicates=0, words=0, removed_tokens=0)
+            _deduplicate(manifest, jsonl_files, stage)
+            stage.items = stage.extra['sentences']
+        sentence_dir = INTERMEDIATE_DEDUP_JSONL_DIR
+        sentence_stage = 'dedup'
 
-        # Step 3: Merge all sentence-only JSONLs into one file
-        data_preparation.combine_jsonl_files(INTERMEDIATE_PROCESSED_JSONL_DIR, MLM_OUTPUT_FILE)
+    # Step 3: Merge all sentence-only JSONLs into one sharded dataset
+    with report.stage('merge') as stage:
+        merge_keys = {MLM_OUTPUT_DIR: BuildManifest.stage_key(
+            [manifest.output_hash(sentence_stage, jsonl_file) for jsonl_file in jsonl_files],
+            {'shard_size': OUTPUT_SHARD_SIZE, 'compression': OUTPUT_COMPRESSION}
+        ) if manifest else None}
+        if _stale_entries(manifest, 'merge', merge_keys):
+            stage.items = data_preparation.combine_jsonl_files(
+                sentence_dir, MLM_OUTPUT_DIR, shard_size=OUTPUT_SHARD_SIZE, compression=OUTPUT_COMPRESSION)
+            stage.bytes = jsonl_shards.dataset_size(MLM_OUTPUT_DIR)
+            _record_entries(manifest, 'merge', merge_keys, {MLM_OUTPUT_DIR: jsonl_shards.output_path(MLM_OUTPUT_DIR)})
+        else:
+            log(f"Merged dataset is up to date: {MLM_OUTPUT_DIR}")
+            stage.skipped = True
 
-        # Step 4: Generate NSP dat# Step 4: Generate NSP dataset
-        NSPGenerator.generate_nsp_from_directory(MLM_OUTPUT_FILE, OUTPUT_JSONL_DIR, NSP_OUTPUT_FILE)
+    # Step 3b: Pack the merged sentences into pre-tokenized blocks of MODEL_MAX_LENGTH tokens
+    if PACK_MLM_BLOCKS:
+        with report.stage('pack') as stage:
+            pack_keys = {MLM_PACKED_OUTPUT_DIR: BuildManifest.stage_key(
+                [manifest.output_hash('merge', MLM_OUTPUT_DIR)],
+                {'tokenizer': TOKENIZER_NAME, 'max_length': MODEL_MAX_LENGTH,
+                 'shard_size': OUTPUT_SHARD_SIZE, 'compression': OUTPUT_COMPRESSION}
+            ) if manifest else None}
+            if _stale_entries(manifest, 'pack', pack_keys):
+                stage.items = TokenPacker(_tokenizer(), max_length=MODEL_MAX_LENGTH).pack_file(
+                    MLM_OUTPUT_DIR, MLM_PACKED_OUTPUT_DIR, shard_size=OUTPUT_SHARD_SIZE, compression=OUTPUT_COMPRESSION)
+                stage.bytes = jsonl_shards.dataset_size(MLM_PACKED_OUTPUT_DIR)
+                _record_entries(manifest, 'pack', pack_keys, {
+                    MLM_PACKED_OUTPUT_DIR: jsonl_shards.output_path(MLM_PACKED_OUTPUT_DIR)})
+            else:
+                log(f"Packed MLM dataset is up to date: {MLM_PACKED_OUTPUT_DIR}")
+                stage.skipped = True
 
-        # Step 5: Cleanup directories after successful task completion
-        cleanup_directories([INPUT_PDF_DIR, INTERMEDIATE_JSONL_DIR, INTERMEDIATE_PROCESSED_JSONL_DIR])
+    # Step 4: Generate NSP dataset
+    with report.stage('nsp') as stage:
+        nsp_keys = {NSP_OUTPUT_DIR: BuildManifest.stage_key(
+            [manifest.output_hash('merge', MLM_OUTPUT_DIR)],
+            {'seed': NSP_SEED, 'shuffle_buffer_size': NSP_SHUFFLE_BUFFER_SIZE,
+             'shard_size': OUTPUT_SHARD_SIZE, 'compression': OUTPUT_COMPRESSION}
+        ) if manifest else None}
+        if _stale_entries(manifest, 'nsp', nsp_keys):
+            stage.items = NSPGenerator.generate_nsp_streaming(
+                [MLM_OUTPUT_DIR],
+                NSP_OUTPUT_DIR,
+                seed=NSP_SEED,
+                shuffle_buffer_size=NSP_SHUFFLE_BUFFER_SIZE,
+                shard_size=OUTPUT_SHARD_SIZE,
+                compression=OUTPUT_COMPRESSION,
+                num_workers=READER_WORKERS,
+            )
+            stage.bytes = jsonl_shards.dataset_size(NSP_OUTPUT_DIR)
+            _record_entries(manifest, 'nsp', nsp_keys, {NSP_OUTPUT_DIR: jsonl_shards.output_path(NSP_OUTPUT_DIR)})
+        else:
+            log(f"NSP dataset is up to date: {NSP_OUTPUT_DIR}")
+            stage.skipped = True
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    # Step 5: Cleanup directories after successful task completion.
+    # Incremental builds keep them, since they are the cache for the next run.
+    if not INCREMENTAL_BUILD:
+        cleanup_directories([INPUT_PDF_DIR, INTERMEDIATE_JSONL_DIR, INTERMEDIATE_PROCESSED_JSONL_DIR,
+                             INTERMEDIATE_DEDUP_JSONL_DIR])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,102 @@
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from logging import info as log
+
+import torch
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+# Checkpoints are assembled here, inside the output directory, and renamed into place when complete.
+STAGING_DIR_NAME = ".checkpoint-staging"
+_CHECKPOINT_DIR = re.compile(rf"^{PREFIX_CHECKPOINT_DIR}-(\d+)$")
+
+
+def snapshot(state, memo=None):
+    """
+    Copies every tensor of a nested state dict to CPU memory, so training can go on updating
+    the originals while the copy is written. Tensors sharing memory, such as tied embeddings,
+    share their copy too.
+    """
+    memo = {} if memo is None else memo
+    if isinstance(state, torch.Tensor):
+        key = (state.data_ptr(), state.dtype, tuple(state.shape), state.stride())
+        if key not in memo:
+            memo[key] = state.detach().to("cpu", copy=True)
+        return memo[key]
+    if isinstance(state, dict):
+        return type(state)((key, snapshot(value, memo)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value, memo) for value in state)
+    return state
+
+
+def checkpoint_dirs(run_dir):
+    """The complete checkpoint directories of `run_dir`, oldest step first."""
+    if not os.path.isdir(run_dir):
+        return []
+    steps = []
+    for name in os.listdir(run_dir):
+        match = _CHECKPOINT_DIR.match(name)
+        if match and os.path.isdir(os.path.join(run_dir, name)):
+            steps.append((int(match.group(1)), os.path.join(run_dir, name)))
+    return [path for _, path in sorted(steps)]
+
+
+def rotate_checkpoints(run_dir, save_total_limit, keep=None):
+    """Deletes the oldest checkpoints of `run_dir` beyond `save_total_limit`, except `keep`."""
+    if not save_total_limit:
+        return
+    checkpoints = [path for path in checkpoint_dirs(run_dir) if path != keep]
+    limit = save_total_limit - 1 if keep else save_total_limit
+    for path in checkpoints[:max(len(checkpoints) - limit, 0)]:
+        log(f"Deleting older checkpoint {path} due to save_total_limit={save_total_limit}")
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class BackgroundCheckpointWriter:
+    """
+    Writes checkpoints on a background thread while training continues.
+
+    Slow writes (weights, optimizer state) are deferred with `defer` while a checkpoint is
+    staged, then `submit` runs them on the writer thread and renames the staging directory
+    to its final name. A checkpoint directory is therefore either absent or complete, and
+    get_last_checkpoint never resumes from a half-written one. At most one checkpoint is in
+    flight: submitting the next waits for the previous, which bounds the snapshots held in
+    memory to one. Errors of a background write are raised by the next `wait`.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending = None
+        self._tasks = []
+
+    def defer(self, fn, *args, **kwargs):
+        self._tasks.append((fn, args, kwargs))
+
+    def submit(self, staging_dir, checkpoint_dir, save_total_limit=None, keep=None):
+        self.wait()
+        tasks, self._tasks = self._tasks, []
+        self._pending = self._executor.submit(self._write, tasks, staging_dir, checkpoint_dir, save_total_limit, keep)
+
+    def discard(self):
+        """Drops deferred writes of a checkpoint that will not be submitted."""
+        self._tasks = []
+
+    def wait(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.result()
+
+    @staticmethod
+    def _write(tasks, staging_dir, checkpoint_dir, save_total_limit, keep):
+        for fn, args, kwargs in tasks:
+            fn(*args, **kwargs)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.replace(staging_dir, checkpoint_dir)
+        try:
+            os.rmdir(os.path.dirname(staging_dir))
+        except OSError:
+            pass
+        log(f"Checkpoint written to {checkpoint_dir}")
+        rotate_checkpoints(os.path.dirname(checkpoint_dir), save_total_limit, keep)
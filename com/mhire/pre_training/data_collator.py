@@ -0,0 +1,148 @@
+import numpy as np
+import torch
+
+from com.mhire.data_processing.token_store import TokenStore
+
+MASKING_STRATEGIES = ("token", "whole_word", "span")
+
+
+def _as_long_tensor(values):
+    """Converts a tensor, numpy array or list of token ids to an int64 tensor."""
+    if isinstance(values, torch.Tensor):
+        return values.long()
+    return torch.from_numpy(np.asarray(values, dtype=np.int64))
+
+
+class DynamicPaddingCollator:
+    """
+    MLM+NSP collator that pads every batch only to its longest member.
+    Samples that were already padded are trimmed to their attention mask first,
+    so it works with both padded and unpadded datasets.
+
+    The batch is assembled with one concatenation and one masked scatter per field, and
+    masking runs on the whole batch with tensor ops. `masking` selects what is masked:
+      'token'       every wordpiece independently, as in the original BERT
+      'whole_word'  all wordpieces of a word together, so a drug name is never half-visible
+      'span'        runs of whole words with geometric lengths (p=`span_p`, at most
+                    `max_span_length` words), as in SpanBERT
+    Word boundaries come from the samples' `word_starts` mask when the dataset stores one,
+    and from the tokenizer's '##' continuation pieces otherwise. Masked positions are
+    replaced by [MASK] 80% of the time, a random token 10% and left unchanged 10%.
+    """
+
+    def __init__(self, tokenizer, mlm_probability=0.15, pad_to_multiple_of=8, masking="token",
+                 max_span_length=10, span_p=0.2, generator=None):
+        if masking not in MASKING_STRATEGIES:
+            raise ValueError(f"Unknown masking {masking!r}; use one of {MASKING_STRATEGIES}")
+        self.tokenizer = tokenizer
+        self.mlm_probability = mlm_probability
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.masking = masking
+        self.generator = generator
+        self.vocab_size = len(tokenizer)
+        self.special_token_ids = torch.tensor(sorted(tokenizer.all_special_ids))
+        self.word_start_table = torch.from_numpy(TokenStore.word_start_table(tokenizer))
+
+        # Span lengths in words: a geometric distribution truncated at max_span_length.
+        span_lengths = np.arange(1, max_span_length + 1)
+        span_probs = span_p * (1 - span_p) ** (span_lengths - 1)
+        span_probs /= span_probs.sum()
+        self.span_length_probs = torch.from_numpy(span_probs)
+        # Starting spans at this rate per word masks about mlm_probability of the words.
+        self.span_start_probability = mlm_probability / float((span_lengths * span_probs).sum())
+
+    @staticmethod
+    def sample_length(item):
+        """Number of real (non-padding) tokens in a sample."""
+        if "attention_mask" in item:
+            return int(np.count_nonzero(np.asarray(item["attention_mask"])))
+        return len(item["input_ids"])
+
+    @staticmethod
+    def _pad(batch, key, lengths, attention_mask, fill_value):
+        """Packs one field of every sample into a padded batch tensor with a single masked scatter."""
+        flat = np.concatenate([np.asarray(item[key])[:length] for item, length in zip(batch, lengths)])
+        padded = torch.full(attention_mask.shape, fill_value, dtype=torch.long)
+        padded[attention_mask] = _as_long_tensor(flat)
+        return padded
+
+    def _rand(self, shape):
+        return torch.rand(shape, generator=self.generator)
+
+    def _word_mask(self, word_starts, candidates, probability):
+        """Selects words with `probability` and returns the mask of all their tokens."""
+        positions = torch.arange(word_starts.shape[1]).expand_as(word_starts)
+        # Position of the first token of each token's word.
+        word_start_position = torch.where(word_starts, positions, 0).cummax(dim=1).values
+        selected = word_starts & (self._rand(word_starts.shape) < probability)
+        return selected.gather(1, word_start_position) & candidates
+
+    def _span_mask(self, word_starts, candidates):
+        """
+        Masks spans of whole words starting at randomly selected words. A span ends at the
+        next special token, so it never runs from segment A across [SEP] into segment B.
+        """
+        word_index = word_starts.long().cumsum(dim=1)
+        starts = word_starts & candidates & (self._rand(word_starts.shape) < self.span_start_probability)
+        span_lengths = torch.zeros(word_starts.shape, dtype=torch.long)
+        start_count = int(starts.sum())
+        if start_count:
+            span_lengths[starts] = torch.multinomial(
+                self.span_length_probs, start_count, replacement=True, generator=self.generator) + 1
+        # Runs of candidates between special tokens are offset far enough apart that the end of a
+        # span in one run is below every word index of the next.
+        run_offset = (~candidates).long().cumsum(dim=1) * (word_starts.shape[1] + len(self.span_length_probs) + 1)
+        word_index = word_index + run_offset
+        # A token is covered if a span starting at or before it, in its run, extends past its word.
+        span_end = torch.where(starts, word_index + span_lengths, 0).cummax(dim=1).values
+        return (word_index < span_end) & candidates
+
+    def mask_tokens(self, input_ids, candidates, word_starts=None):
+        """Returns masked input ids and MLM labels (-100 on positions that are not predicted)."""
+        if self.masking == "token":
+            masked = candidates & (self._rand(input_ids.shape) < self.mlm_probability)
+        else:
+            if word_starts is None:
+                word_starts = self.word_start_table[input_ids]
+            # Special tokens and padding always start a word of their own.
+            word_starts = word_starts | ~candidates
+            if self.masking == "whole_word":
+                masked = self._word_mask(word_starts, candidates, self.mlm_probability)
+            else:
+                masked = self._span_mask(word_starts, candidates)
+
+        labels = input_ids.masked_fill(~masked, -100)
+        replacement = self._rand(input_ids.shape)
+        input_ids = input_ids.masked_fill(masked & (replacement < 0.8), self.tokenizer.mask_token_id)
+        random_tokens = masked & (replacement >= 0.8) & (replacement < 0.9)
+        input_ids[random_tokens] = torch.randint(
+            self.vocab_size, (int(random_tokens.sum()),), generator=self.generator)
+        return input_ids, labels
+
+    def __call__(self, batch):
+        lengths = [self.sample_length(item) for item in batch]
+        max_length = max(lengths)
+        if self.pad_to_multiple_of:
+            max_length = -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        attention_mask = torch.arange(max_length) < torch.tensor(lengths).unsqueeze(1)
+
+        input_ids = self._pad(batch, "input_ids", lengths, attention_mask, self.tokenizer.pad_token_id)
+        if "token_type_ids" in batch[0]:
+            token_type_ids = self._pad(batch, "token_type_ids", lengths, attention_mask, 0)
+        else:
+            token_type_ids = torch.zeros_like(input_ids)
+        word_starts = None
+        if self.masking != "token" and "word_starts" in batch[0]:
+            word_starts = self._pad(batch, "word_starts", lengths, attention_mask, 1).bool()
+
+        candidates = attention_mask & ~torch.isin(input_ids, self.special_token_ids)
+        input_ids, labels = self.mask_tokens(input_ids, candidates, word_starts)
+
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask.long(),
+            "token_type_ids": token_type_ids,
+            "labels": labels,
+            "next_sentence_label": torch.from_numpy(np.fromiter(
+                (item["next_sentence_label"] for item in batch), dtype=np.int64, count=len(batch))),
+        }
@@ -0,0 +1,130 @@
+import os
+import re
+from contextlib import contextmanager
+from datetime import timedelta
+from logging import info as log
+
+import torch
+import torch.distributed as dist
+
+NODE_DIR = "/sys/devices/system/node"
+BACKEND = "gloo"
+
+
+def parse_cpu_list(text):
+    """CPU ids of a Linux cpulist such as '0-3,8,10-11'."""
+    cpus = []
+    for part in text.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def numa_nodes():
+    """
+    The CPUs this process may run on, grouped by NUMA node, in node order. Machines
+    without NUMA information in sysfs are a single node.
+    """
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    if os.path.isdir(NODE_DIR):
+        names = [name for name in os.listdir(NODE_DIR) if re.fullmatch(r"node\d+", name)]
+        for name in sorted(names, key=lambda name: int(name[4:])):
+            with open(os.path.join(NODE_DIR, name, "cpulist"), "r", encoding="utf-8") as f:
+                cpus = [cpu for cpu in parse_cpu_list(f.read()) if cpu in allowed]
+            if cpus:
+                nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+
+def rank_cpus(local_rank, local_world_size, nodes):
+    """
+    The CPUs of one of `local_world_size` processes on a machine. Processes are spread evenly
+    over the NUMA nodes, in blocks of consecutive ranks, and every node's CPUs are split
+    evenly among its processes, so no two processes share a core and none spans two nodes
+    unless there are fewer processes than nodes.
+    """
+    if local_world_size <= len(nodes):
+        return sorted(cpu for node in nodes[local_rank::local_world_size] for cpu in node)
+    node = local_rank * len(nodes) // local_world_size
+    node_ranks = [rank for rank in range(local_world_size) if rank * len(nodes) // local_world_size == node]
+    cpus, index = nodes[node], node_ranks.index(local_rank)
+    share = cpus[index * len(cpus) // len(node_ranks):(index + 1) * len(cpus) // len(node_ranks)]
+    # More processes than cores: they have to share.
+    return share or [cpus[index % len(cpus)]]
+
+
+def pin_threads(local_rank, local_world_size):
+    """
+    Binds this process to its CPUs (see rank_cpus) and sizes the intra-op thread pool to
+    them. Linux allocates memory on the node of the CPU that first touches it, so the
+    activations and optimizer state of a pinned process stay on its own node.
+    """
+    cpus = rank_cpus(local_rank, local_world_size, numa_nodes())
+    os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    # Inherited by DataLoader workers and any other child process.
+    os.environ["OMP_NUM_THREADS"] = str(len(cpus))
+    log(f"Local rank {local_rank} pinned to {len(cpus)} CPUs: {cpus[0]}-{cpus[-1]}")
+    return cpus
+
+
+def distributed_env():
+    """(rank, local rank, world size, local world size) as set by torchrun; (0, 0, 1, 1) in a plain process."""
+    return tuple(int(os.environ.get(name, default)) for name, default in
+                 (("RANK", 0), ("LOCAL_RANK", 0), ("WORLD_SIZE", 1), ("LOCAL_WORLD_SIZE", 1)))
+
+
+def is_launched():
+    """True in a process started by torchrun."""
+    return "LOCAL_RANK" in os.environ
+
+
+def init_distributed(timeout_minutes=120):
+    """
+    Joins the process group of a torchrun launch, if there is more than one process. Trainer
+    reuses the group. The timeout also bounds how long the other ranks wait at a barrier
+    while the main process prepares the data.
+    """
+    if distributed_env()[2] > 1 and not dist.is_initialized():
+        dist.init_process_group(BACKEND, timeout=timedelta(minutes=timeout_minutes))
+
+
+def world():
+    """(rank, world size) of the initialized process group; (0, 1) without one."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+@contextmanager
+def main_process_first():
+    """Runs the block on rank 0 first and on the other ranks once it is done, e.g. to build shared files once."""
+    rank, world_size = world()
+    if world_size > 1 and rank > 0:
+        dist.barrier()
+    try:
+        yield
+    finally:
+        if world_size > 1 and rank == 0:
+            dist.barrier()
+
+
+def all_reduce_sum(values):
+    """Sums a float64 numpy array over all ranks, in place; a no-op in a single process."""
+    if world()[1] > 1:
+        dist.all_reduce(torch.from_numpy(values), op=dist.ReduceOp.SUM)
+    return values
+
+
+def launch(module, nproc_per_node, args=()):
+    """
+    Runs `python -m module *args` in `nproc_per_node` local processes under torchrun, with
+    RANK, LOCAL_RANK, WORLD_SIZE and the rendezvous set, and waits for all of them.
+    Raises if any process fails.
+    """
+    from torch.distributed.run import get_args_parser, run
+    log(f"Launching {nproc_per_node} {BACKEND} processes of {module}")
+    run(get_args_parser().parse_args(
+        ["--standalone", f"--nproc-per-node={nproc_per_node}", "--module", module, *args]))
@@ -0,0 +1,147 @@
+import copy
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Subset
+
+from com.mhire.pre_training.distributed import all_reduce_sum, world
+from com.mhire.pre_training.samplers import DatasetSplit, dataset_lengths
+
+
+def dataset_labels(dataset):
+    """Returns the NSP label of every example of a dataset as a numpy array."""
+    if isinstance(dataset, Subset):
+        return dataset_labels(dataset.dataset)[np.asarray(dataset.indices)]
+    if isinstance(dataset, DatasetSplit):
+        return dataset_labels(dataset.dataset)[dataset.indices(np.arange(len(dataset)))]
+    if hasattr(dataset, "next_sentence_label"):
+        return np.asarray(dataset.next_sentence_label)
+    return np.fromiter((int(dataset[i]["next_sentence_label"]) for i in range(len(dataset))),
+                       dtype=np.int64, count=len(dataset))
+
+
+def stratified_sample(lengths, labels, size, length_buckets=8, seed=42):
+    """
+    Sorted indices of `size` examples drawn so that every (NSP label, length quantile) stratum
+    keeps its share of the dataset, with the largest-remainder method for the rounding.
+    """
+    lengths, labels = np.asarray(lengths), np.asarray(labels)
+    n = len(lengths)
+    if size >= n:
+        return np.arange(n)
+    edges = np.quantile(lengths, np.linspace(0, 1, length_buckets + 1)[1:-1])
+    strata = labels.astype(np.int64) * length_buckets + np.searchsorted(edges, lengths, side="right")
+
+    _, counts = np.unique(strata, return_counts=True)
+    exact = size * counts / n
+    quotas = np.floor(exact).astype(np.int64)
+    quotas[np.argsort(quotas - exact, kind="stable")[:size - quotas.sum()]] += 1
+
+    # Shuffle, then group by stratum: each stratum's examples are in random order, so its first `quota` are a sample.
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(n)
+    order = order[np.argsort(strata[order], kind="stable")]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return np.sort(np.concatenate([order[start:start + quota] for start, quota in zip(starts, quotas)]))
+
+
+class PretrainingEvaluator:
+    """
+    MLM and NSP evaluation of a BertForPreTraining model, accumulated batch by batch.
+
+    Masks are drawn from a seeded generator, so every evaluation of the same data masks the
+    same positions and the numbers are comparable from one evaluation to the next. Only the
+    masked positions go through the MLM decoder, the vocabulary-sized matmul that dominates
+    the cost of a forward pass. Logits are reduced to counts per batch, never gathered.
+
+    `evaluate` on a sample uses a fixed, stratified sample of at most `sample_size` examples,
+    collated once and kept in memory. With `full=True` it streams the whole dataset.
+    Under torch.distributed every process evaluates its share of the batches and the counts
+    are summed across processes, so all of them return the same metrics.
+    """
+
+    def __init__(self, data_collator, batch_size=64, sample_size=2000, seed=42):
+        self.data_collator = data_collator
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.seed = seed
+        self._sample = None
+
+    def batches(self, dataset):
+        """
+        Batches of `dataset`, masked the same way on every call. Order does not matter for
+        evaluation, so examples are batched shortest first and batches carry almost no padding.
+        With several processes, each collates every world_size-th batch. The masks of a batch
+        are seeded by its position, so they do not depend on which process collates it.
+        """
+        order = np.argsort(dataset_lengths(dataset), kind="stable")
+        rank, world_size = world()
+        collator = copy.copy(self.data_collator)
+        collator.generator = torch.Generator()
+        fetch = getattr(dataset, "__getitems__", None)
+        for batch_index in range(rank, math.ceil(len(order) / self.batch_size), world_size):
+            indices = order[batch_index * self.batch_size:(batch_index + 1) * self.batch_size].tolist()
+            collator.generator.manual_seed(self.seed + batch_index)
+            yield collator(fetch(indices) if fetch else [dataset[i] for i in indices])
+
+    def sample_batches(self, dataset):
+        """The collated batches of the stratified evaluation sample of `dataset`, built on first use."""
+        if self._sample is None or self._sample[0] is not dataset:
+            indices = stratified_sample(dataset_lengths(dataset), dataset_labels(dataset), self.sample_size,
+                                        seed=self.seed)
+            self._sample = (dataset, list(self.batches(Subset(dataset, indices.tolist()))), len(indices))
+        return self._sample[1], self._sample[2]
+
+    @staticmethod
+    @torch.inference_mode()
+    def _counts(model, batch):
+        """Sums of losses and correct predictions of one batch."""
+        batch = {key: value.to(model.device) for key, value in batch.items()}
+        outputs = model.bert(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"],
+                             token_type_ids=batch["token_type_ids"])
+        sequence_output, pooled_output = outputs[0], outputs[1]
+
+        masked = batch["labels"] != -100
+        targets = batch["labels"][masked]
+        mlm_scores = model.cls.predictions(sequence_output[masked]).float()
+        nsp_scores = model.cls.seq_relationship(pooled_output).float()
+        nsp_labels = batch["next_sentence_label"]
+        return np.array([
+            F.cross_entropy(mlm_scores, targets, reduction="sum").item(),
+            (mlm_scores.argmax(dim=-1) == targets).sum().item(),
+            targets.numel(),
+            F.cross_entropy(nsp_scores, nsp_labels, reduction="sum").item(),
+            (nsp_scores.argmax(dim=-1) == nsp_labels).sum().item(),
+            nsp_labels.numel(),
+        ], dtype=np.float64)
+
+    def evaluate(self, model, dataset, full=False):
+        """Returns (metrics, number of examples evaluated)."""
+        if full:
+            batches, num_samples = self.batches(dataset), len(dataset)
+        else:
+            batches, num_samples = self.sample_batches(dataset)
+        was_training = model.training
+        model.eval()
+        try:
+            totals = sum((self._counts(model, batch) for batch in batches), np.zeros(6))
+        finally:
+            model.train(was_training)
+        all_reduce_sum(totals)
+
+        mlm_nll, mlm_correct, mlm_tokens, nsp_nll, nsp_correct, nsp_samples = totals.tolist()
+        mlm_loss = mlm_nll / max(mlm_tokens, 1)
+        nsp_loss = nsp_nll / max(nsp_samples, 1)
+        metrics = {
+            # Same as BertForPreTraining's training loss: mean MLM loss plus mean NSP loss.
+            "loss": mlm_loss + nsp_loss,
+            "mlm_loss": mlm_loss,
+            "mlm_perplexity": math.exp(min(mlm_loss, 50)),
+            "mlm_accuracy": mlm_correct / max(mlm_tokens, 1),
+            "nsp_loss": nsp_loss,
+            "nsp_accuracy": nsp_correct / max(nsp_samples, 1),
+            "full": int(full),
+        }
+        return metrics, num_samples
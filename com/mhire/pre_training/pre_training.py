@@ -1,5 +1,201 @@
+import os
+import json
+import math
+import time
+import shutil
 import torch
-from transformers import BertForPreTraining, DataCollatorForLanguageModeling, Trainer, TrainingArguments
+from logging import info as log, warning
+from transformers import BertForPreTraining, Trainer, TrainerCallback, TrainingArguments
+from transformers.trainer import OPTIMIZER_NAME, SCHEDULER_NAME
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, get_last_checkpoint, speed_metrics
+from com.mhire.data_processing.vocabulary_extender import VocabularyExtender
+from com.mhire.pre_training.checkpointing import STAGING_DIR_NAME, BackgroundCheckpointWriter, snapshot
+from com.mhire.pre_training import distributed
+from com.mhire.pre_training.data_collator import DynamicPaddingCollator
+from com.mhire.pre_training.evaluation import PretrainingEvaluator
+from com.mhire.pre_training.samplers import LengthGroupedSampler, RandomPermutationSampler, dataset_lengths
+
+SAMPLER_STATE_NAME = "sampler_state.json"
+
+
+class _EpochEndEvaluation(TrainerCallback):
+    """Requests a full evaluation at the end of every epoch."""
+
+    def __init__(self, trainer):
+        self.trainer = trainer
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        self.trainer._full_evaluation = True
+        control.should_evaluate = True
+        return control
+
+
+class PretrainingTrainer(Trainer):
+    """
+    Trainer that can group training batches by length using the dataset's own length index,
+    and whose data order is resumable: the training sampler's position is saved with every
+    checkpoint, and a resumed run starts the sampler there instead of replaying the epoch.
+
+    With `async_checkpoints`, Trainer's own checkpointing runs against a staging directory.
+    The weights and optimizer state are snapshotted in memory there instead of written, and a
+    BackgroundCheckpointWriter writes them and renames the finished checkpoint into place while
+    training continues. Runs with several processes or `load_best_model_at_end` save synchronously.
+
+    With an `evaluator` (a PretrainingEvaluator), evaluations during an epoch run on the
+    evaluator's fixed sample of the validation set, and the whole validation set is evaluated
+    once at the end of every epoch.
+
+    Under torch.distributed every process builds the same seeded sampler, and Trainer's
+    dataloader hands each process every world_size-th batch of its order: a disjoint shard
+    per rank. Sampler positions therefore count the samples of all processes.
+    """
+
+    def __init__(self, *args, group_by_length=False, async_checkpoints=False, evaluator=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # BertForPreTraining takes **kwargs but averages its loss over the batch itself. Trainer would
+        # otherwise take the loss as a sum over num_items_in_batch: it would skip the division by the
+        # gradient accumulation steps and multiply the loss by the number of processes.
+        self.model_accepts_loss_kwargs = False
+        self.group_by_length = group_by_length
+        self._sampler_state = None
+        self.train_sampler = None
+        self.checkpoint_writer = BackgroundCheckpointWriter() if async_checkpoints else None
+        self._staging = False
+        self.evaluator = evaluator
+        self._full_evaluation = False
+        if evaluator is not None:
+            self.add_callback(_EpochEndEvaluation(self))
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.group_by_length:
+            self.train_sampler = LengthGroupedSampler(
+                dataset_lengths(self.train_dataset),
+                batch_size=self.args.train_batch_size,
+                seed=self.args.seed,
+            )
+        else:
+            self.train_sampler = RandomPermutationSampler(len(self.train_dataset), seed=self.args.seed)
+        if self._sampler_state is not None:
+            self.train_sampler.load_state_dict(self._sampler_state)
+            log(f"Resuming the training data at sample {self._sampler_state['position']} "
+                f"of epoch {self._sampler_state['epoch']}")
+        return self.train_sampler
+
+    def _sampler_position(self):
+        """(epoch, samples trained on in that epoch) at the current global step, the way Trainer counts epochs."""
+        world_size = self.args.world_size
+        # Batches per process; the last ones are padded so that every process gets as many.
+        num_samples = self.train_sampler.num_samples
+        batches_per_epoch = math.ceil(math.ceil(num_samples / self.args.train_batch_size) / world_size)
+        accumulation = self.args.gradient_accumulation_steps
+        steps_per_epoch = max(batches_per_epoch // accumulation + int(batches_per_epoch % accumulation > 0), 1)
+        epoch, step = divmod(self.state.global_step, steps_per_epoch)
+        samples_per_step = accumulation * self.args.train_batch_size * world_size
+        return epoch, min(step * samples_per_step, num_samples)
+
+    def set_initial_training_values(self, args, dataloader):
+        # Epochs and max_steps are sized from full epochs, not from the shorter resumed pass.
+        if self.train_sampler is None:
+            return super().set_initial_training_values(args, dataloader)
+        with self.train_sampler.full_epochs():
+            return super().set_initial_training_values(args, dataloader)
+
+    def _run_epoch(self, *args, train_dataloader, steps_in_epoch, num_update_steps_per_epoch, **kwargs):
+        if self.train_sampler is not None and len(self.train_sampler) < self.train_sampler.num_samples:
+            # A resumed pass yields only the batches after its resume position. Ending the pass and its
+            # last gradient accumulation there keeps the optimizer steps aligned with a full epoch's.
+            steps_in_epoch = len(train_dataloader)
+            accumulation = self.args.gradient_accumulation_steps
+            num_update_steps_per_epoch = max(math.ceil(steps_in_epoch / accumulation), 1)
+        return super()._run_epoch(*args, train_dataloader=train_dataloader, steps_in_epoch=steps_in_epoch,
+                                  num_update_steps_per_epoch=num_update_steps_per_epoch, **kwargs)
+
+    def _save_sampler_state(self, checkpoint_dir):
+        if self.train_sampler is None or not self.args.should_save:
+            return
+        with open(os.path.join(checkpoint_dir, SAMPLER_STATE_NAME), "w", encoding="utf-8") as f:
+            json.dump(self.train_sampler.checkpoint_state(*self._sampler_position()), f, indent=2)
+
+    def _get_output_dir(self, trial):
+        run_dir = super()._get_output_dir(trial)
+        return os.path.join(run_dir, STAGING_DIR_NAME) if self._staging else run_dir
+
+    def _save(self, output_dir=None, state_dict=None):
+        if not self._staging:
+            return super()._save(output_dir, state_dict)
+        if state_dict is None:
+            state_dict = snapshot(self.model.state_dict())
+        self.checkpoint_writer.defer(super()._save, output_dir, state_dict)
+
+    def _save_optimizer_and_scheduler(self, output_dir):
+        if not self._staging:
+            return super()._save_optimizer_and_scheduler(output_dir)
+        if self.args.should_save:
+            os.makedirs(output_dir, exist_ok=True)
+            self.checkpoint_writer.defer(torch.save, snapshot(self.optimizer.state_dict()),
+                                         os.path.join(output_dir, OPTIMIZER_NAME))
+            torch.save(self.lr_scheduler.state_dict(), os.path.join(output_dir, SCHEDULER_NAME))
+
+    def _save_checkpoint(self, model, trial):
+        checkpoint_name = f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+        run_dir = self._get_output_dir(trial=trial)
+        if self.checkpoint_writer is None or self.args.world_size > 1 or self.args.load_best_model_at_end:
+            super()._save_checkpoint(model, trial)
+            self._save_sampler_state(os.path.join(run_dir, checkpoint_name))
+            return
+
+        # Only one checkpoint is in flight, so the staging directory is free once the last one is written.
+        self.checkpoint_writer.wait()
+        staging_dir = os.path.join(run_dir, STAGING_DIR_NAME, checkpoint_name)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        self._staging = True
+        try:
+            super()._save_checkpoint(model, trial)
+            self._save_sampler_state(staging_dir)
+        except BaseException:
+            self.checkpoint_writer.discard()
+            raise
+        finally:
+            self._staging = False
+        if self.args.should_save:
+            self.checkpoint_writer.submit(staging_dir, os.path.join(run_dir, checkpoint_name),
+                                          self.args.save_total_limit, self.state.best_model_checkpoint)
+        else:
+            self.checkpoint_writer.discard()
+
+    def evaluate(self, eval_dataset=None, ignore_keys=None, metric_key_prefix="eval"):
+        if self.evaluator is None:
+            return super().evaluate(eval_dataset, ignore_keys, metric_key_prefix)
+        eval_dataset = self.eval_dataset if eval_dataset is None else eval_dataset
+        full, self._full_evaluation = self._full_evaluation, False
+        start_time = time.time()
+        with self.autocast_smart_context_manager():
+            metrics, num_samples = self.evaluator.evaluate(self.model, eval_dataset, full=full)
+        metrics = {f"{metric_key_prefix}_{name}": value for name, value in metrics.items()}
+        metrics.update(speed_metrics(metric_key_prefix, start_time, num_samples=num_samples))
+        self.log(metrics)
+        self.control = self.callback_handler.on_evaluate(self.args, self.state, self.control, metrics)
+        return metrics
+
+    def train(self, resume_from_checkpoint=None, **kwargs):
+        if resume_from_checkpoint is True:
+            output_dir = self.args.output_dir
+            resume_from_checkpoint = get_last_checkpoint(output_dir) if os.path.isdir(output_dir) else None
+        self._sampler_state = None
+        if resume_from_checkpoint:
+            state_path = os.path.join(resume_from_checkpoint, SAMPLER_STATE_NAME)
+            if os.path.exists(state_path):
+                with open(state_path, "r", encoding="utf-8") as f:
+                    self._sampler_state = json.load(f)
+            else:
+                warning(f"No {SAMPLER_STATE_NAME} in {resume_from_checkpoint}; the resumed epoch starts over")
+        try:
+            return super().train(resume_from_checkpoint=resume_from_checkpoint, **kwargs)
+        finally:
+            if self.checkpoint_writer is not None:
+                # The last checkpoint must be on disk before train() returns.
+                self.checkpoint_writer.wait()
+
 
 class Pretraining:
     def __init__(self, model_name, output_dir, log_dir, tokenizer):
@@ -9,59 +205,122 @@ class Pretraining:
         self.log_dir = log_dir
 
     def initialize_model(self, model_name):
-        return BertForPreTraining.from_pretrained(model_name)
+        """
+        Loads the model and, if the tokenizer was extended with domain terms (see
+        VocabularyExtender), grows the embeddings to the tokenizer's vocabulary.
 
-    def create_data_collator(self, mlm_probability=0.15):
-        mlm_collator = DataCollatorForLanguageModeling(
-            tokenizer=self.tokenizer, mlm=True, mlm_probability=mlm_probability
-        )
-        
-        def collate_fn(batch):
-            mlm_inputs = [{
-                "input_ids": item["input_ids"],
-                "attention_mask": item["attention_mask"]
-            } for item in batch]
-
-            mlm_outputs = mlm_collator(mlm_inputs)
-            next_sentence_labels = torch.tensor([item["next_sentence_label"] for item in batch])
-            mlm_outputs["next_sentence_label"] = next_sentence_labels
-            return mlm_outputs
-        
-        return collate_fn
-
-    def create_training_args(self, epochs=3, batch_size=8):
+        With low_cpu_mem_usage the model is built without initializing weights that the
+        checkpoint overwrites anyway, and safetensors weights are memory-mapped and copied
+        into place tensor by tensor, so loading never holds a second copy of the model.
+        """
+        model = BertForPreTraining.from_pretrained(model_name, low_cpu_mem_usage=True)
+        old_size = model.get_input_embeddings().num_embeddings
+        if len(self.tokenizer) > old_size:
+            model.resize_token_embeddings(len(self.tokenizer))
+            self.initialize_new_embeddings(model, self.tokenizer, old_size)
+            log(f"Resized the embeddings from {old_size} to {len(self.tokenizer)} tokens")
+        return model
+
+    @staticmethod
+    @torch.no_grad()
+    def initialize_new_embeddings(model, tokenizer, old_size):
+        """
+        Starts every token id from `old_size` on at the mean embedding of the wordpieces it
+        replaces, so a new term begins where the model already understands it instead of at
+        a random vector. The MLM output bias is averaged the same way.
+        """
+        embeddings = model.get_input_embeddings().weight
+        bias = model.cls.predictions.bias if hasattr(model, "cls") else None
+        for token_id, token in tokenizer.added_tokens_decoder.items():
+            if token_id < old_size:
+                continue
+            pieces = [i for i in VocabularyExtender.subword_ids(tokenizer, token.content) if i < old_size]
+            if not pieces:
+                continue
+            embeddings[token_id] = embeddings[pieces].mean(dim=0)
+            if bias is not None and bias.shape[0] > token_id:
+                bias[token_id] = bias[pieces].mean()
+
+    def create_data_collator(self, mlm_probability=0.15, masking="token"):
+        return DynamicPaddingCollator(self.tokenizer, mlm_probability=mlm_probability, masking=masking)
+
+    def create_evaluator(self, data_collator, batch_size=64, sample_size=2000):
+        return PretrainingEvaluator(data_collator, batch_size=batch_size, sample_size=sample_size)
+
+    def create_training_args(self, epochs=3, batch_size=8, bf16=False, eval_steps=200, eval_batch_size=64,
+                             gradient_accumulation_steps=1):
+        # TrainingArguments no longer takes a logging_dir; the TensorBoard callback reads it from the environment.
+        os.environ["TENSORBOARD_LOGGING_DIR"] = self.log_dir
         return TrainingArguments(
             output_dir=self.output_dir,
-            overwrite_output_dir=True,
             num_train_epochs=epochs,
             per_device_train_batch_size=batch_size,
+            gradient_accumulation_steps=gradient_accumulation_steps,
+            # Otherwise Trainer drops the word_starts mask, which the model does not take but the collator masks with.
+            remove_unused_columns=False,
             save_steps=1000,
             save_total_limit=2,
-            logging_dir=self.log_dir,
             logging_strategy="steps",
             logging_steps=5,
             report_to="tensorboard",
+            # Step evaluations run on a small fixed sample; the full validation set at each epoch's end.
             eval_strategy="steps",
-            eval_steps=10,
-            save_strategy="steps"
+            eval_steps=eval_steps,
+            per_device_eval_batch_size=eval_batch_size,
+            save_strategy="steps",
+            # The sampler resumes at its saved position, so Trainer must not skip batches itself.
+            ignore_data_skip=True,
+            # bfloat16 autocast over fp32 master weights; worthwhile on CPUs with AVX512-BF16 or AMX.
+            bf16=bf16,
+            # Launched with several processes (see distributed.launch), gradients are averaged with gloo on CPU.
+            # A single process must not name a backend, or it waits for a process group that never forms.
+            ddp_backend=distributed.BACKEND if distributed.distributed_env()[2] > 1 else None,
+            ddp_find_unused_parameters=False,
         )
 
-    def train(self, train_dataset, val_dataset, mlm_probability=0.15, epochs=3, batch_size=8):
-        data_collator = self.create_data_collator(mlm_probability)
-        training_args = self.create_training_args(epochs, batch_size)
+    def train(self, train_dataset, val_dataset, mlm_probability=0.15, epochs=3, batch_size=8, group_by_length=True,
+              resume_from_checkpoint=None, masking="token", bf16=False, async_checkpoints=True,
+              eval_sample_size=2000, eval_steps=200, eval_batch_size=64, gradient_accumulation_steps=1):
+        """
+        Trains the model and saves it. `masking` is 'token', 'whole_word' or 'span' (see
+        DynamicPaddingCollator). With `resume_from_checkpoint` (a checkpoint directory, or True
+        for the latest one in the output directory), training continues from that checkpoint,
+        including the position in the training data. `bf16` trains under bfloat16 autocast, and
+        `async_checkpoints` writes checkpoints on a background thread (see PretrainingTrainer).
+        Every `eval_steps` steps the model is evaluated on a stratified sample of
+        `eval_sample_size` validation examples, and on all of them at the end of each epoch.
+        Each optimizer step accumulates the gradients of `gradient_accumulation_steps` batches
+        per process. Run under torchrun, every process trains on its own shard of the batches
+        and only the main process saves the model.
+        """
+        data_collator = self.create_data_collator(mlm_probability, masking)
+        training_args = self.create_training_args(epochs, batch_size, bf16, eval_steps, eval_batch_size,
+                                                  gradient_accumulation_steps)
 
-        trainer = Trainer(
+        trainer = PretrainingTrainer(
             model=self.model,
             args=training_args,
             train_dataset=train_dataset,
             eval_dataset=val_dataset,
-            data_collator=data_collator
+            data_collator=data_collator,
+            group_by_length=group_by_length,
+            async_checkpoints=async_checkpoints,
+            evaluator=self.create_evaluator(data_collator, eval_batch_size, eval_sample_size),
         )
 
-        trainer.train()
-        self.save_model()
+        train_output = trainer.train(resume_from_checkpoint=resume_from_checkpoint)
+        if trainer.is_world_process_zero():
+            self.save_model()
+        return train_output
 
     def save_model(self):
-        self.model.save_pretrained(self.output_dir)
-        self.tokenizer.save_pretrained(self.output_dir)
-        print(f"Model saved to {self.output_dir}")
\ No newline at end of file
+        # Written next to the checkpoints first, then each file is renamed into place, so the
+        # output directory never holds a partially written model.
+        tmp_dir = os.path.join(self.output_dir, ".model.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.model.save_pretrained(tmp_dir)
+        self.tokenizer.save_pretrained(tmp_dir)
+        for name in os.listdir(tmp_dir):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(self.output_dir, name))
+        os.rmdir(tmp_dir)
+        print(f"Model saved to {self.output_dir}")
@@ -0,0 +1,233 @@
+from contextlib import contextmanager
+
+import numpy as np
+from torch.utils.data import Dataset, Sampler, Subset
+
+_MASK64 = (1 << 64) - 1
+_MIX1, _MIX2 = 0xBF58476D1CE4E5B9, 0x94D049BB133111EB
+# Number of sampler positions permuted at once while iterating.
+_CHUNK_SIZE = 65536
+
+
+def _mix(x):
+    """splitmix64 finalizer on numpy uint64 arrays."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(_MIX1)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(_MIX2)
+    return x ^ (x >> np.uint64(31))
+
+
+def _mix_int(x):
+    """splitmix64 finalizer on a Python int, for single lookups without numpy overhead."""
+    x = ((x ^ (x >> 30)) * _MIX1) & _MASK64
+    x = ((x ^ (x >> 27)) * _MIX2) & _MASK64
+    return x ^ (x >> 31)
+
+
+class IndexPermutation:
+    """
+    Seeded pseudorandom permutation of range(n) that maps any position to its index in O(1),
+    without materializing the permutation: a balanced Feistel network over the smallest
+    even-bit domain holding n, with cycle walking to stay below n. Equal seeds give
+    equal permutations on every machine.
+    """
+
+    def __init__(self, n, seed, rounds=4):
+        self.n = n
+        self.half_bits = max(1, (max(n - 1, 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        self.keys = [int(key) for key in np.random.default_rng(seed).integers(0, 2**63, rounds, dtype=np.uint64)]
+
+    def _encrypt(self, x):
+        half, mask = np.uint64(self.half_bits), np.uint64(self.half_mask)
+        left, right = x >> half, x & mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix(right ^ np.uint64(key)) & mask)
+        return (left << half) | right
+
+    def __call__(self, positions):
+        """Indices at `positions` (an array) of the permutation."""
+        x = self._encrypt(np.asarray(positions, dtype=np.uint64))
+        outside = x >= self.n
+        while outside.any():
+            x[outside] = self._encrypt(x[outside])
+            outside = x >= self.n
+        return x.astype(np.int64)
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.n:
+            raise IndexError(position)
+        x = position
+        while True:
+            left, right = x >> self.half_bits, x & self.half_mask
+            for key in self.keys:
+                left, right = right, left ^ (_mix_int(right ^ key) & self.half_mask)
+            x = (left << self.half_bits) | right
+            if x < self.n:
+                return x
+
+    def __len__(self):
+        return self.n
+
+
+class DatasetSplit(Dataset):
+    """
+    One part of a dataset split by a seeded permutation: the first `len(dataset) - n_validation`
+    permuted positions are the training split and the rest the validation split. Which
+    examples belong to a split is computed per item, so no index list is ever built and
+    splitting is free however large the dataset is.
+    """
+
+    def __init__(self, dataset, start, stop, seed=42):
+        self.dataset = dataset
+        self.start = start
+        self.stop = stop
+        self.seed = seed
+        self.permutation = IndexPermutation(len(dataset), seed)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def indices(self, positions):
+        """Indices into the underlying dataset of the given positions of this split."""
+        return self.permutation(np.asarray(positions, dtype=np.int64) + self.start)
+
+    @property
+    def lengths(self):
+        return dataset_lengths(self.dataset)[self.indices(np.arange(len(self)))]
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self.dataset[self.permutation[self.start + idx]]
+
+    def __getitems__(self, indices):
+        # Used by the DataLoader to fetch a whole batch with one vectorized lookup.
+        return [self.dataset[int(i)] for i in self.indices(indices)]
+
+
+def split_dataset(dataset, validation_fraction=0.2, seed=42):
+    """Returns (train, validation) DatasetSplit views of a dataset."""
+    n_validation = int(round(len(dataset) * validation_fraction))
+    n_train = len(dataset) - n_validation
+    return DatasetSplit(dataset, 0, n_train, seed), DatasetSplit(dataset, n_train, len(dataset), seed)
+
+
+def dataset_lengths(dataset):
+    """Returns the number of real tokens of every example of a dataset as a numpy array."""
+    if isinstance(dataset, Subset):
+        return dataset_lengths(dataset.dataset)[np.asarray(dataset.indices)]
+    if hasattr(dataset, "lengths"):
+        return np.asarray(dataset.lengths)
+    return np.fromiter(
+        (np.count_nonzero(np.asarray(dataset[i]["attention_mask"])) for i in range(len(dataset))),
+        dtype=np.int64,
+        count=len(dataset),
+    )
+
+
+class ResumableSampler(Sampler):
+    """
+    Base of the seeded training samplers. The order of every epoch depends only on the seed
+    and the epoch, so a sampler can be resumed at (epoch, position) and picks up exactly
+    where the previous run left off.
+    """
+
+    def __init__(self, num_samples, seed=42):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        self._resume_at = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        """Samples of the next pass: a resumed pass yields only those from its resume position on."""
+        return self.num_samples - self._pending_start()
+
+    @contextmanager
+    def full_epochs(self):
+        """Within this block the sampler's length is that of a full epoch, even with a resume pending."""
+        resume_at, self._resume_at = self._resume_at, None
+        try:
+            yield self
+        finally:
+            self._resume_at = resume_at
+
+    def resume(self, epoch, position):
+        """Makes the next pass over `epoch` start at its `position`-th sample."""
+        self.epoch = epoch
+        self._resume_at = (epoch, position)
+
+    def checkpoint_state(self, epoch, position):
+        """State to save with a checkpoint taken after `position` samples of `epoch` were trained on."""
+        return {"seed": self.seed, "num_samples": self.num_samples, "epoch": epoch, "position": position}
+
+    def load_state_dict(self, state):
+        if state["seed"] != self.seed or state["num_samples"] != self.num_samples:
+            raise ValueError(
+                f"Sampler state for seed {state['seed']} and {state['num_samples']} samples does not match "
+                f"this sampler (seed {self.seed}, {self.num_samples} samples)"
+            )
+        self.resume(state["epoch"], state["position"])
+
+    def _pending_start(self):
+        if self._resume_at and self._resume_at[0] == self.epoch:
+            return self._resume_at[1]
+        return 0
+
+    def _start(self):
+        """Position the current pass starts at, consuming a pending resume point."""
+        start = self._pending_start()
+        self._resume_at = None
+        return start
+
+
+class RandomPermutationSampler(ResumableSampler):
+    """
+    Uniformly shuffled order, a fresh IndexPermutation per epoch. Resuming is O(1): the
+    sampler starts permuting at the resume position instead of replaying the epoch.
+    """
+
+    def __iter__(self):
+        permutation = IndexPermutation(self.num_samples, (self.seed, self.epoch))
+        start = self._start()
+        self.epoch += 1
+        for chunk_start in range(start, self.num_samples, _CHUNK_SIZE):
+            yield from permutation(np.arange(chunk_start, min(chunk_start + _CHUNK_SIZE, self.num_samples))).tolist()
+
+
+class LengthGroupedSampler(ResumableSampler):
+    """
+    Shuffles the dataset, then sorts each mega-batch of `batch_size * mega_batch_mult`
+    examples by length and cuts it into batches, so each batch holds examples of similar
+    length and dynamic padding has little to pad. The order of the batches is shuffled
+    again so training does not see lengths in a trend; a trailing partial batch stays last.
+    Resuming recomputes the epoch's order from the lengths, without touching the data.
+    """
+
+    def __init__(self, lengths, batch_size, mega_batch_mult=50, seed=42):
+        self.lengths = np.asarray(lengths)
+        super().__init__(len(self.lengths), seed)
+        self.batch_size = batch_size
+        self.mega_batch_size = batch_size * mega_batch_mult
+
+    def _order(self, rng):
+        indices = rng.permutation(len(self.lengths))
+
+        batches = []
+        for start in range(0, len(indices), self.mega_batch_size):
+            mega_batch = indices[start:start + self.mega_batch_size]
+            mega_batch = mega_batch[np.argsort(-self.lengths[mega_batch], kind="stable")]
+            batches.extend(mega_batch[i:i + self.batch_size] for i in range(0, len(mega_batch), self.batch_size))
+
+        # Keep a trailing partial batch last so the DataLoader's batches stay aligned with ours.
+        last = [batches.pop()] if batches and len(batches[-1]) < self.batch_size else []
+        ordered = [batches[batch_index] for batch_index in rng.permutation(len(batches))] + last
+        return np.concatenate(ordered) if ordered else np.zeros(0, dtype=np.int64)
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        start = self._start()
+        self.epoch += 1
+        yield from self._order(rng)[start:].tolist()
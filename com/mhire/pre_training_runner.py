@@ -1,10 +1,13 @@
 import os
-import torch
-from sklearn.model_selection import train_test_split
 from transformers import BertTokenizerFast
 from transformers.utils import logging
+from com.mhire.data_processing import jsonl_shards
 from com.mhire.data_processing.pre_training_data_handler import PreTrainingDataHandler
+from com.mhire.data_processing.vocabulary_extender import VocabularyExtender
+from com.mhire.pre_training import distributed
 from com.mhire.pre_training.pre_training import Pretraining
+from com.mhire.pre_training.samplers import split_dataset
+from com.mhire.utility.instrumentation import RunReport, configure_logging
 
 logger = logging.get_logger("transformers.trainer")
 logger.setLevel(logging.INFO)
@@ -14,29 +17,107 @@ def run_pretraining():
     LOCAL_DIR = "/tmp/datasets/"
     OUTPUT_DIR = "/tmp/trained_model/"
     LOG_DIR = "/tmp/logs/"
+    REPORT_DIR = "/tmp/reports/"
+    # Stage to run under cProfile ('tokenize', 'dataset', 'model' or 'train'), or None
+    PROFILE_STAGE = None
     
-    CLEAN_DATA_FILE = os.path.join(LOCAL_DIR, "mlm_format.jsonl")
-    NSP_FORMAT_FILE = os.path.join(LOCAL_DIR, "nsp_format.jsonl")
+    # Sharded by the PDF processing pipeline; a single nsp_format.jsonl file works as well
+    NSP_FORMAT_FILE = os.path.join(LOCAL_DIR, "nsp_format")
+    TOKEN_STORE_DIR = os.path.join(LOCAL_DIR, "token_store")
+    USE_TOKEN_STORE = True
+    # Add frequent domain terms that bert-base-uncased splits into many wordpieces to the vocabulary
+    EXTEND_VOCABULARY = True
+    VOCABULARY_CORPUS = os.path.join(LOCAL_DIR, "mlm_format")
+    TOKENIZER_DIR = os.path.join(LOCAL_DIR, "tokenizer")
+    MAX_NEW_TOKENS = 5000
+    MIN_TERM_FREQUENCY = 100
+    # Threads decompressing NSP shards ahead of the tokenizer
+    READER_WORKERS = os.cpu_count() or 1
+    EPOCHS = 3
+    BATCH_SIZE = 8
+    # MLM masking: 'token', 'whole_word' (all wordpieces of a word together) or 'span'
+    MASKING = "whole_word"
+    VALIDATION_FRACTION = 0.2
+    SPLIT_SEED = 42
+    # Evaluate a stratified sample of the validation set every EVAL_STEPS steps, all of it after each epoch
+    EVAL_SAMPLE_SIZE = 2000
+    EVAL_STEPS = 200
+    EVAL_BATCH_SIZE = 64
+    # bfloat16 autocast; speeds up CPUs with AVX512-BF16 or AMX, slows down older ones
+    BF16 = False
+    # Write checkpoints on a background thread instead of pausing training
+    ASYNC_CHECKPOINTS = True
+    # Batches per process whose gradients are summed into one optimizer step
+    GRADIENT_ACCUMULATION_STEPS = 1
+    # Local training processes. With more than one, the runner relaunches itself under torchrun and
+    # the processes train data-parallel with the gloo backend, each on its own shard of the batches.
+    NUM_PROCESSES = 1
+    # Bind every process to its own CPUs, spread evenly over the NUMA nodes
+    PIN_THREADS = True
+    # Continue from the latest checkpoint in OUTPUT_DIR, if there is one, at the same point in the data
+    RESUME = True
 
-    # Initialize tokenizer
-    tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased", model_max_length=512)
+    if NUM_PROCESSES > 1 and not distributed.is_launched():
+        distributed.launch("com.mhire.pre_training_runner", NUM_PROCESSES)
+        return
+    rank, local_rank, world_size, local_world_size = distributed.distributed_env()
+    # One log file and run report per process
+    suffix = f"-rank{rank}" if world_size > 1 else ""
+    configure_logging(log_file=os.path.join(LOG_DIR, f"pre_training_runner{suffix}.log"))
+    distributed.init_distributed()
+    if PIN_THREADS and local_world_size > 1:
+        distributed.pin_threads(local_rank, local_world_size)
 
-    # Initialize DataHandler and prepare datasets
-    data_handler = PreTrainingDataHandler(tokenizer)
-    nsp_dataset = data_handler.prepare_nsp_dataset(file_path=NSP_FORMAT_FILE)
-    mlm_dataset = data_handler.prepare_mlm_dataset(file_path=CLEAN_DATA_FILE)
-    combined_dataset = data_handler.combine_datasets(mlm_dataset, nsp_dataset)
+    with RunReport(f"pretraining{suffix}", REPORT_DIR, profile_stage=PROFILE_STAGE) as report:
+        # The main process mines the vocabulary and compiles the token store; the others then load them
+        with distributed.main_process_first():
+            # Initialize tokenizer
+            tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased", model_max_length=512)
+            if EXTEND_VOCABULARY:
+                with report.stage("vocabulary") as stage:
+                    extender = VocabularyExtender(tokenizer, max_new_tokens=MAX_NEW_TOKENS,
+                                                  min_frequency=MIN_TERM_FREQUENCY)
+                    # Mined once per corpus; the token store recompiles when the vocabulary changes
+                    if not extender.is_current(TOKENIZER_DIR, VOCABULARY_CORPUS):
+                        stage.extra.update(extender.extend(VOCABULARY_CORPUS, TOKENIZER_DIR,
+                                                           num_workers=READER_WORKERS))
+                        stage.bytes = jsonl_shards.dataset_size(VOCABULARY_CORPUS)
+                    tokenizer = BertTokenizerFast.from_pretrained(TOKENIZER_DIR, model_max_length=512)
+                    stage.items = len(tokenizer)
 
-    # Split datasets into train and validation
-    train_indices, val_indices = train_test_split(
-        range(len(combined_dataset)), test_size=0.2, random_state=42
-    )
-    train_dataset = torch.utils.data.Subset(combined_dataset, train_indices)
-    val_dataset = torch.utils.data.Subset(combined_dataset, val_indices)
+            # Initialize DataHandler and prepare datasets
+            data_handler = PreTrainingDataHandler(tokenizer)
+            with report.stage("tokenize") as stage:
+                if USE_TOKEN_STORE:
+                    # Compiled once into memory-mapped arrays; later runs start from the store directly
+                    combined_dataset = data_handler.prepare_token_store_dataset(
+                        NSP_FORMAT_FILE, TOKEN_STORE_DIR, num_workers=READER_WORKERS)
+                else:
+                    combined_dataset = data_handler.prepare_pair_dataset(NSP_FORMAT_FILE)
+                stage.items = len(combined_dataset)
+                stage.bytes = jsonl_shards.dataset_size(NSP_FORMAT_FILE)
 
-    # Initialize pretraining and train model
-    pretrainer = Pretraining("bert-base-uncased", OUTPUT_DIR, LOG_DIR, tokenizer)
-    pretrainer.train(train_dataset, val_dataset)
+        # Split datasets into train and validation
+        with report.stage("dataset") as stage:
+            # Split by a seeded permutation evaluated per example, so no index lists are built
+            train_dataset, val_dataset = split_dataset(
+                combined_dataset, validation_fraction=VALIDATION_FRACTION, seed=SPLIT_SEED
+            )
+            stage.items = len(combined_dataset)
+
+        # Initialize pretraining and train model
+        with report.stage("model"):
+            pretrainer = Pretraining("bert-base-uncased", OUTPUT_DIR, LOG_DIR, tokenizer)
+        with report.stage("train") as stage:
+            train_output = pretrainer.train(train_dataset, val_dataset, epochs=EPOCHS, batch_size=BATCH_SIZE,
+                                            resume_from_checkpoint=RESUME or None, masking=MASKING,
+                                            bf16=BF16, async_checkpoints=ASYNC_CHECKPOINTS,
+                                            eval_sample_size=EVAL_SAMPLE_SIZE, eval_steps=EVAL_STEPS,
+                                            eval_batch_size=EVAL_BATCH_SIZE,
+                                            gradient_accumulation_steps=GRADIENT_ACCUMULATION_STEPS)
+            # Examples this process trained on; train_samples_per_second in the metrics is for all of them
+            stage.items = len(train_dataset) * EPOCHS // world_size
+            stage.extra.update(train_output.metrics, processes=world_size)
 
 if __name__ == "__main__":
-    run_pretraining()
\ No newline at end of file
+    run_pretraining()
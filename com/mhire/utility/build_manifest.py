@@ -0,0 +1,80 @@
+# This file keeps track of what the PDF processing pipeline has already built.
+# Every output is keyed on the content hash of its inputs plus the parameters of
+# the stage that produced it, so a rerun only redoes the stages whose inputs changed.
+
+import os
+import json
+import hashlib
+from logging import info as log
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class BuildManifest:
+    """Manifest of content hashes and stage keys persisted between pipeline runs."""
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.files = {}
+        self.stages = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.files = data.get('files', {})
+            self.stages = data.get('stages', {})
+
+    def file_hash(self, path):
+        """Returns the sha256 of a file, reusing the cached hash while its size and mtime are unchanged."""
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        return self.files[path]['sha256']
+
+    @staticmethod
+    def stage_key(input_hashes, params=None):
+        """Combines input hashes and stage parameters into a single key."""
+        payload = json.dumps({'inputs': list(input_hashes), 'params': params or {}}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def is_current(self, stage, name, key):
+        """True if `name` was built by `stage` with `key` and its output is still on disk untouched."""
+        entry = self.stages.get(stage, {}).get(name)
+        if not entry or entry['key'] != key or not os.path.exists(entry['output']):
+            return False
+        return self.file_hash(entry['output']) == entry['output_hash']
+
+    def record(self, stage, name, key, output_path):
+        """Records that `stage` built `output_path` for `name` with `key`."""
+        self.stages.setdefault(stage, {})[name] = {
+            'key': key,
+            'output': output_path,
+            'output_hash': self.file_hash(output_path),
+        }
+
+    def output_hash(self, stage, name):
+        return self.stages[stage][name]['output_hash']
+
+    def prune(self, stage, names):
+        """Drops entries of `stage` that are not in `names` and deletes their outputs."""
+        entries = self.stages.get(stage, {})
+        for name in set(entries) - set(names):
+            output_path = entries.pop(name)['output']
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            self.files.pop(output_path, None)
+            log(f"Removed stale {stage} output: {output_path}")
+
+    def save(self):
+        """Writes the manifest atomically so an interrupted run never leaves it half-written."""
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'stages': self.stages}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
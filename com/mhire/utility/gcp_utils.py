@@ -1,48 +1,334 @@
 # Function to download from gcp bucket
 # Function to upload in gcp bucket
+#
+# Transfers run on a thread pool. Files at or above `sliced_threshold` bytes move in
+# parallel slices: downloads as ranged reads into a preallocated file, uploads as part
+# objects composed into the final blob. Files whose size and MD5 already match on the
+# other side are skipped, and interrupted sliced transfers resume from the slices that
+# completed.
 
 import os
+import json
+import time
+import base64
+import hashlib
 import logging
-from google.cloud import storage
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_SLICE_SIZE = 64 * 1024 * 1024
+DEFAULT_SLICED_THRESHOLD = 256 * 1024 * 1024
+# GCS composes at most 32 source objects in one request.
+MAX_COMPOSE_SOURCES = 32
+HASH_BLOCK_SIZE = 1024 * 1024
+MD5_METADATA_KEY = 'md5_hash'
+
+
+def _md5_base64(file_path, start=0, length=None):
+    """Base64 MD5 of a file, or of `length` bytes from `start`, in the format GCS reports."""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = os.path.getsize(file_path) - start if length is None else length
+        while remaining > 0:
+            block = f.read(min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return base64.b64encode(digest.digest()).decode('ascii')
+
+
+def _blob_md5(blob):
+    """MD5 of a blob; composite objects carry none, so uploads also record it in metadata."""
+    return blob.md5_hash or (blob.metadata or {}).get(MD5_METADATA_KEY)
+
+
+class _FileSlice:
+    """
+    Read-only, seekable file object over `length` bytes of a file starting at `start`.
+    Positions are relative to the slice, as the resumable upload of the GCS client
+    expects: it tells where the stream starts and seeks back to resend a chunk.
+    """
+
+    def __init__(self, file_path, start, length):
+        self._file = open(file_path, 'rb')
+        self._start = start
+        self._length = length
+        self._position = 0
+        self._file.seek(start)
+
+    def read(self, size=-1):
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self._file.read(size)
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+        elif whence != os.SEEK_SET:
+            raise ValueError(f'Invalid whence {whence}')
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self._position = min(offset, self._length)
+        self._file.seek(self._start + self._position)
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-# Configure logging
-logging.basicConfig(
-    filename='./logs/gcp_utils.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 
 class GCPUtils:
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, storage_client=None, max_workers=DEFAULT_MAX_WORKERS,
+                 slice_size=DEFAULT_SLICE_SIZE, sliced_threshold=DEFAULT_SLICED_THRESHOLD,
+                 max_retries=3, retry_delay=1.0):
+        """
+        Args:
+            bucket_name (str): Bucket all transfers go to and come from.
+            storage_client: Client with the google.cloud.storage.Client interface. Defaults to
+                a real GCS client.
+            max_workers (int): Maximum number of concurrent requests.
+            slice_size (int): Size of one slice of a sliced transfer, in bytes.
+            sliced_threshold (int): Files of at least this many bytes are transferred in slices.
+            max_retries (int): Attempts per request before giving up.
+            retry_delay (float): Delay before the first retry; doubled after each attempt.
+        """
+        if storage_client is None:
+            from google.cloud import storage
+            storage_client = storage.Client()
         self.bucket_name = bucket_name
-        self.storage_client = storage.Client()
+        self.storage_client = storage_client
+        self.max_workers = max_workers
+        self.slice_size = slice_size
+        self.sliced_threshold = sliced_threshold
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Slices run on their own pool so that file-level tasks never wait on their own pool.
+        self._slice_executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        """Shuts down the slice pool, waiting for running slices to finish."""
+        self._slice_executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _retry(self, description, func, *args, **kwargs):
+        """Runs `func`, retrying with exponential backoff."""
+        delay = self.retry_delay
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f'{description} failed (attempt {attempt}/{self.max_retries}): {str(e)}')
+                time.sleep(delay)
+                delay *= 2
+
+    def _run_slices(self, func, indices):
+        """
+        Runs `func` for each slice index on the slice pool and returns the results in order.
+        If a slice fails, the slices not yet started are cancelled and the running ones are
+        waited for before the error is raised, so none of them outlives the caller's files.
+        """
+        futures = [self._slice_executor.submit(func, index) for index in indices]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    def _bucket(self):
+        return self.storage_client.bucket(self.bucket_name)
 
     def download_file(self, gcs_file_path, local_file_path):
         """
         Downloads a file from GCS to a local path.
+        Skips the download if the local file already has the blob's size and MD5.
         """
         try:
-            bucket = self.storage_client.bucket(self.bucket_name)
-            blob = bucket.blob(gcs_file_path)
-            blob.download_to_filename(local_file_path)
+            blob = self._retry(f'Fetching {gcs_file_path}', self._bucket().get_blob, gcs_file_path)
+            if blob is None:
+                raise FileNotFoundError(f'gs://{self.bucket_name}/{gcs_file_path} does not exist')
+
+            remote_md5 = _blob_md5(blob)
+            if (os.path.exists(local_file_path) and os.path.getsize(local_file_path) == blob.size
+                    and remote_md5 and _md5_base64(local_file_path) == remote_md5):
+                logging.info(f'Skipped {gcs_file_path}: {local_file_path} is up to date')
+                return
+
+            os.makedirs(os.path.dirname(local_file_path) or '.', exist_ok=True)
+            if blob.size >= self.sliced_threshold:
+                self._download_sliced(blob, local_file_path)
+            else:
+                part_path = local_file_path + '.part'
+                self._retry(f'Downloading {gcs_file_path}', blob.download_to_filename, part_path)
+                os.replace(part_path, local_file_path)
+
+            if remote_md5 and _md5_base64(local_file_path) != remote_md5:
+                os.remove(local_file_path)
+                raise IOError(f'MD5 mismatch after downloading {gcs_file_path}')
             logging.info(f'Successfully downloaded {gcs_file_path} to {local_file_path}')
         except Exception as e:
             logging.error(f'Failed to download {gcs_file_path}: {str(e)}')
             raise
 
+    def _download_sliced(self, blob, local_file_path):
+        """Downloads a blob as parallel ranged reads, resuming the slices of an interrupted download."""
+        part_path = local_file_path + '.part'
+        state_path = part_path + '.json'
+        slices = [(start, min(start + self.slice_size, blob.size)) for start in range(0, blob.size, self.slice_size)]
+
+        done = set()
+        if os.path.exists(part_path) and os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('generation') == blob.generation and state.get('slice_size') == self.slice_size:
+                done = set(state['done'])
+        if not done:
+            with open(part_path, 'wb') as f:
+                f.truncate(blob.size)
+
+        lock = threading.Lock()
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            def fetch(index):
+                start, end = slices[index]
+                # GCS ranges are inclusive of `end`.
+                data = self._retry(f'Downloading bytes {start}-{end} of {blob.name}',
+                                   blob.download_as_bytes, start=start, end=end - 1)
+                os.pwrite(fd, data, start)
+                with lock:
+                    done.add(index)
+                    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+                        json.dump({'generation': blob.generation, 'slice_size': self.slice_size,
+                                   'done': sorted(done)}, f)
+                    os.replace(state_path + '.tmp', state_path)
+
+            pending = [index for index in range(len(slices)) if index not in done]
+            if len(pending) < len(slices):
+                logging.info(f'Resuming download of {blob.name}: {len(slices) - len(pending)} of {len(slices)} slices done')
+            self._run_slices(fetch, pending)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        os.replace(part_path, local_file_path)
+        os.remove(state_path)
+
+    def download_folder(self, remote_folder_path, local_folder_path):
+        """Downloads every blob under a GCS prefix into a local folder, concurrently."""
+        try:
+            prefix = remote_folder_path.rstrip('/') + '/'
+            blobs = self._retry(f'Listing {prefix}', lambda: list(self.storage_client.list_blobs(self.bucket_name, prefix=prefix)))
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(self.download_file, blob.name,
+                                    os.path.join(local_folder_path, os.path.relpath(blob.name, prefix)))
+                    for blob in blobs if not blob.name.endswith('/')
+                ]
+                for future in futures:
+                    future.result()
+        except Exception as e:
+            logging.error(f'Failed to download folder {remote_folder_path}: {str(e)}')
+            raise
+
+    def upload_file(self, local_file_path, remote_file_path):
+        """
+        Uploads a file to GCS.
+        Skips the upload if the blob already has the file's size and MD5.
+        """
+        try:
+            bucket = self._bucket()
+            size = os.path.getsize(local_file_path)
+            local_md5 = _md5_base64(local_file_path)
+            existing = self._retry(f'Fetching {remote_file_path}', bucket.get_blob, remote_file_path)
+            if existing is not None and existing.size == size and _blob_md5(existing) == local_md5:
+                logging.info(f'Skipped {local_file_path}: {remote_file_path} is up to date')
+                return
+
+            if size >= self.sliced_threshold:
+                self._upload_sliced(bucket, local_file_path, remote_file_path, size, local_md5)
+            else:
+                blob = bucket.blob(remote_file_path)
+                blob.metadata = {MD5_METADATA_KEY: local_md5}
+                self._retry(f'Uploading {local_file_path}', blob.upload_from_filename, local_file_path)
+            logging.info(f'Uploaded {local_file_path} to {remote_file_path}')
+        except Exception as e:
+            logging.error(f'Failed to upload {local_file_path}: {str(e)}')
+            raise
+
+    def _upload_sliced(self, bucket, local_file_path, remote_file_path, size, local_md5):
+        """
+        Uploads a file as parallel part objects and composes them into the final blob.
+        Parts that already exist with the right MD5 are reused, so an interrupted upload resumes.
+        """
+        slice_size = max(self.slice_size, -(-size // MAX_COMPOSE_SOURCES))
+        slices = [(start, min(start + slice_size, size)) for start in range(0, size, slice_size)]
+        part_names = [f'{remote_file_path}.part-{index:02d}-of-{len(slices):02d}' for index in range(len(slices))]
+
+        def send(index):
+            start, end = slices[index]
+            part_md5 = _md5_base64(local_file_path, start, end - start)
+            part = bucket.get_blob(part_names[index])
+            if part is not None and part.size == end - start and part.md5_hash == part_md5:
+                return part
+
+            def upload():
+                part = bucket.blob(part_names[index])
+                with _FileSlice(local_file_path, start, end - start) as file_slice:
+                    part.upload_from_file(file_slice, size=end - start)
+                return part
+            return self._retry(f'Uploading bytes {start}-{end} of {local_file_path}', upload)
+
+        parts = self._run_slices(send, range(len(slices)))
+
+        blob = bucket.blob(remote_file_path)
+        blob.metadata = {MD5_METADATA_KEY: local_md5}
+        self._retry(f'Composing {remote_file_path}', blob.compose, parts)
+        for part in parts:
+            self._retry(f'Deleting {part.name}', part.delete)
+
     def upload_folder(self, local_folder_path, remote_folder_path):
         """
-        Uploads a local folder to GCS.
+        Uploads a local folder to GCS, concurrently.
         """
         try:
-            bucket = self.storage_client.bucket(self.bucket_name)
-            for root, _, files in os.walk(local_folder_path):
-                for file in files:
-                    local_file_path = os.path.join(root, file)
-                    remote_file_path = os.path.join(remote_folder_path, os.path.relpath(local_file_path, local_folder_path))
-                    blob = bucket.blob(remote_file_path)
-                    blob.upload_from_filename(local_file_path)
-                    logging.info(f'Uploaded {local_file_path} to {remote_file_path}')
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = []
+                for root, _, files in os.walk(local_folder_path):
+                    for file in files:
+                        local_file_path = os.path.join(root, file)
+                        remote_file_path = os.path.join(remote_folder_path, os.path.relpath(local_file_path, local_folder_path))
+                        futures.append(executor.submit(self.upload_file, local_file_path, remote_file_path))
+                for future in futures:
+                    future.result()
         except Exception as e:
             logging.error(f'Failed to upload folder {local_folder_path}: {str(e)}')
             raise
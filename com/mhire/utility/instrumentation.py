@@ -0,0 +1,250 @@
+# Logging setup and per-stage run metrics for the pipeline and pretraining entry points.
+#
+# A RunReport times each stage of a run. For every stage it records wall time, CPU time
+# of this process and of the worker processes it waited on, peak resident memory, and
+# item and byte throughput. The results go to a JSON report that is rewritten after
+# every stage, so a failed run still leaves a report behind. One stage per run can be
+# profiled with cProfile.
+
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import platform
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+RSS_SAMPLE_INTERVAL = 0.05
+PROFILE_TOP_FUNCTIONS = 25
+
+
+def configure_logging(level=logging.INFO, log_file=None):
+    """
+    Configures the root logger once for the whole process: to stderr, and also to
+    `log_file` if given. Library modules only log; entry points call this.
+    """
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=handlers)
+
+
+def _current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss(who):
+    """Peak resident set size reported by getrusage, in bytes."""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _PeakRSSSampler:
+    """Samples this process's RSS on a background thread and keeps the highest value seen."""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = _current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = _current_rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+        rss = _current_rss()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+
+class StageMetrics:
+    """
+    Metrics of one stage. Inside the stage, set `items` and `bytes` to what the stage
+    processed, and add anything else worth keeping to `extra`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+        self.bytes = None
+        self.skipped = False
+        self.extra = {}
+        self.status = 'running'
+        self.error = None
+        self.wall_s = self.cpu_s = self.children_cpu_s = None
+        self.peak_rss_bytes = None
+        self.profile_path = None
+
+    def to_dict(self):
+        def per_second(amount):
+            if amount is None or not self.wall_s:
+                return None
+            return amount / self.wall_s
+
+        return {
+            'name': self.name,
+            'status': self.status,
+            'skipped': self.skipped,
+            'error': self.error,
+            'wall_s': self.wall_s,
+            'cpu_s': self.cpu_s,
+            'children_cpu_s': self.children_cpu_s,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'items': self.items,
+            'bytes': self.bytes,
+            'items_per_s': per_second(self.items),
+            'bytes_per_s': per_second(self.bytes),
+            'profile': self.profile_path,
+            'extra': self.extra,
+        }
+
+
+class RunReport:
+    """
+    Collects StageMetrics for a run and writes them to `<report_dir>/<name>-<timestamp>.json`.
+
+    Use as a context manager around the run and wrap each stage in `stage()`:
+
+        with RunReport('pdf_processing', 'tmp/reports') as report:
+            with report.stage('parse') as stage:
+                ...
+                stage.items = parsed_count
+
+    If `profile_stage` names a stage, that stage runs under cProfile. The profile is written
+    next to the report as `.prof` and its top functions are logged. cProfile only sees
+    this process, so profile a stage with its worker count set to 1. `metadata` (e.g. the
+    commit and the run's parameters) is stored in the report as is.
+    """
+
+    def __init__(self, name, report_dir, profile_stage=None, metadata=None):
+        self.name = name
+        self.profile_stage = profile_stage
+        self.metadata = dict(metadata or {})
+        self.started_at = datetime.now(timezone.utc)
+        os.makedirs(report_dir, exist_ok=True)
+        self.path = os.path.join(report_dir, f"{name}-{self.started_at.strftime('%Y%m%dT%H%M%S.%fZ')}.json")
+        self.stages = []
+        self.status = 'running'
+        self.error = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as stage `name` and yields its StageMetrics."""
+        metrics = StageMetrics(name)
+        self.stages.append(metrics)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        children_cpu_start = self._children_cpu()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            with _PeakRSSSampler() as sampler:
+                if profiler:
+                    profiler.enable()
+                try:
+                    yield metrics
+                finally:
+                    if profiler:
+                        profiler.disable()
+            metrics.status = 'ok'
+        except BaseException as e:
+            metrics.status = 'failed'
+            metrics.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            metrics.wall_s = time.perf_counter() - wall_start
+            metrics.cpu_s = time.process_time() - cpu_start
+            metrics.children_cpu_s = self._children_cpu() - children_cpu_start
+            metrics.peak_rss_bytes = sampler.peak
+            if profiler:
+                self._save_profile(metrics, profiler)
+            self._log_stage(metrics)
+            self.save()
+
+    @staticmethod
+    def _children_cpu():
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    def _save_profile(self, metrics, profiler):
+        metrics.profile_path = self.path[:-len('.json')] + f'-{metrics.name}.prof'
+        profiler.dump_stats(metrics.profile_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        logging.info(f"Profile of stage '{metrics.name}' saved to {metrics.profile_path}\n{summary.getvalue()}")
+
+    @staticmethod
+    def _log_stage(metrics):
+        parts = [f"{metrics.wall_s:.2f}s wall", f"{metrics.cpu_s + metrics.children_cpu_s:.2f}s CPU"]
+        if metrics.peak_rss_bytes is not None:
+            parts.append(f"peak RSS {metrics.peak_rss_bytes / 2**20:.0f} MiB")
+        if metrics.items is not None and metrics.wall_s:
+            parts.append(f"{metrics.items} items ({metrics.items / metrics.wall_s:.1f}/s)")
+        if metrics.bytes is not None and metrics.wall_s:
+            parts.append(f"{metrics.bytes / 2**20:.1f} MiB ({metrics.bytes / 2**20 / metrics.wall_s:.1f} MiB/s)")
+        skipped = ' (up to date)' if metrics.skipped else ''
+        logging.info(f"Stage '{metrics.name}' {metrics.status}{skipped}: {', '.join(parts)}")
+
+    def to_dict(self):
+        return {
+            'run': self.name,
+            'status': self.status,
+            'error': self.error,
+            'started_at': self.started_at.isoformat(),
+            'metadata': self.metadata,
+            'wall_s': time.perf_counter() - self._start,
+            # The kernel only keeps the largest peak of any finished worker process so far, which
+            # cannot be split by stage; per-stage peaks cover this process only.
+            'children_peak_rss_bytes': _max_rss(resource.RUSAGE_CHILDREN) or None,
+            'host': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'stages': [metrics.to_dict() for metrics in self.stages],
+        }
+
+    def save(self):
+        """Writes the report atomically."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.status = 'ok'
+        else:
+            self.status = 'failed'
+            self.error = f'{exc_type.__name__}: {exc}'
+        self.save()
+        logging.info(f"Run report saved to {self.path}")
+        return False
@@ -1,13 +1,36 @@
 # This module ensures that the necessary NLTK data is available for processing text.
-# - `ensure_nltk_data`: Checks if the NLTK 'punkt' tokenizer is installed, and downloads it if missing.
+# - `ensure_nltk_data`: Checks if the NLTK punkt sentence tokenizer data is installed, and downloads it if missing.
+# - `load_sentence_tokenizer`: Loads the English punkt sentence tokenizer once per process.
 
 import nltk
-from logging import info as log
+from functools import lru_cache
+from logging import info as log, warning
+
+# Newer NLTK releases load punkt from 'punkt_tab' instead of the pickled 'punkt' models.
+PUNKT_RESOURCES = ('punkt', 'punkt_tab')
+
 
 def ensure_nltk_data():
     """Ensure NLTK data is available."""
+    for resource in PUNKT_RESOURCES:
+        try:
+            nltk.data.find(f'tokenizers/{resource}')
+        except LookupError:
+            if nltk.download(resource, quiet=True):
+                log(f"Downloaded NLTK tokenizer data: {resource}.")
+
+
+@lru_cache(maxsize=None)
+def load_sentence_tokenizer(language='english'):
+    """
+    The pretrained punkt sentence tokenizer for `language`. Without the NLTK data, an untrained
+    punkt tokenizer, which splits on the same punctuation but knows no abbreviations.
+    """
+    from nltk.tokenize import punkt
     try:
-        nltk.data.find('tokenizers/punkt')
+        if hasattr(punkt, 'PunktTokenizer'):
+            return punkt.PunktTokenizer(language)
+        return nltk.data.load(f'tokenizers/punkt/{language}.pickle')
     except LookupError:
-        nltk.download('punkt')
-        log("Downloaded NLTK tokenizer data.")
+        warning("NLTK punkt data not found; splitting sentences with an untrained punkt tokenizer.")
+        return punkt.PunktSentenceTokenizer()
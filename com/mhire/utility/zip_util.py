@@ -1,14 +1,95 @@
 # To zip/unzip model files
+#
+# Weight files (.bin, .safetensors, ...) are already dense, so they are stored uncompressed
+# and streamed into the archive. Every other file is deflated in chunks on a thread pool,
+# the way pigz does: each chunk is compressed on its own, primed with the last 32 KiB of
+# the chunk before it, and sync-flushed so the chunks concatenate into one deflate stream.
+# The result is a standard zip archive that any unzip tool reads.
 import os
+import time
+import zlib
+import struct
+import shutil
+import fnmatch
 import zipfile
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Files that barely compress and are stored as-is.
+STORED_EXTENSIONS = ('.bin', '.safetensors', '.pt', '.pth', '.ckpt', '.h5', '.npy', '.onnx',
+                     '.zip', '.gz', '.zst', '.xz', '.bz2')
+DEFAULT_COMPRESSLEVEL = 6
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Deflate looks back at most 32 KiB, so priming each chunk with this much keeps the ratio.
+DEFLATE_WINDOW = 32 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _deflate_chunk(data, dictionary, level):
+    """Raw-deflates one chunk, sync-flushed so that chunks can be concatenated."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# An empty final block, which terminates a stream of sync-flushed chunks.
+_DEFLATE_END = zlib.compressobj(DEFAULT_COMPRESSLEVEL, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+
+class _DeflatedEntry:
+    """
+    Writes one entry whose deflate data is produced outside of zipfile, following what
+    ZipFile.open(..., 'w') does: the local header goes first, and the CRC and sizes are
+    patched into it (or appended as a data descriptor on unseekable output) at the end.
+    """
+
+    def __init__(self, zipf, zinfo):
+        self._zipf = zipf
+        self._zinfo = zinfo
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.compress_size = 0
+        zinfo.CRC = 0
+        zinfo.flag_bits = 0x00 if zipf._seekable else 0x08
+        # Compressed data can be slightly larger than the input.
+        self._zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        self._crc = 0
+        self._file_size = 0
+        self._compress_size = 0
+
+        if zipf._seekable:
+            zipf.fp.seek(zipf.start_dir)
+        zinfo.header_offset = zipf.fp.tell()
+        zipf._writecheck(zinfo)
+        zipf._didModify = True
+        zipf.fp.write(zinfo.FileHeader(self._zip64))
+
+    def write(self, data, compressed):
+        self._crc = zlib.crc32(data, self._crc)
+        self._file_size += len(data)
+        self._compress_size += len(compressed)
+        self._zipf.fp.write(compressed)
+
+    def close(self):
+        zipf, zinfo = self._zipf, self._zinfo
+        zipf.fp.write(_DEFLATE_END)
+        zinfo.compress_size = self._compress_size + len(_DEFLATE_END)
+        zinfo.file_size = self._file_size
+        zinfo.CRC = self._crc
+        if zinfo.flag_bits & 0x08:
+            fmt = '<LLQQ' if self._zip64 else '<LLLL'
+            zipf.fp.write(struct.pack(fmt, 0x08074b50, zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+            zipf.start_dir = zipf.fp.tell()
+        else:
+            zipf.start_dir = zipf.fp.tell()
+            zipf.fp.seek(zinfo.header_offset)
+            zipf.fp.write(zinfo.FileHeader(self._zip64))
+            zipf.fp.seek(zipf.start_dir)
+        zipf.filelist.append(zinfo)
+        zipf.NameToInfo[zinfo.filename] = zinfo
 
-# Configure logging
-logging.basicConfig(
-    filename='./logs/zip_utils.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 
 class ZipUtils:
     """
@@ -16,39 +97,104 @@ class ZipUtils:
     """
 
     @staticmethod
-    def zip_folder(folder_path, zip_file_path):
+    def _entries(folder_path, executor, compresslevel, chunk_size, store_extensions):
+        """
+        Yields the archive contents in order: ('stored', zinfo, path) for files copied as-is,
+        and for deflated files ('start', zinfo), then ('chunk', data, future) per chunk
+        and ('end',). Chunks are submitted for compression as they are yielded.
+        """
+        for root, dirs, files in os.walk(folder_path):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, folder_path)  # Maintain folder structure
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                if file.lower().endswith(store_extensions):
+                    yield 'stored', zinfo, file_path
+                    continue
+
+                yield 'start', zinfo
+                with open(file_path, 'rb') as f:
+                    dictionary = b''
+                    for data in iter(lambda: f.read(chunk_size), b''):
+                        yield 'chunk', data, executor.submit(_deflate_chunk, data, dictionary, compresslevel)
+                        dictionary = data[-DEFLATE_WINDOW:]
+                yield 'end',
+
+    @staticmethod
+    def zip_folder(folder_path, zip_file_path, compresslevel=DEFAULT_COMPRESSLEVEL, max_workers=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE, store_extensions=STORED_EXTENSIONS):
         """
-        Zips the contents of a folder.
+        Zips the contents of a folder. Files ending in one of `store_extensions` are stored
+        uncompressed; all other files are deflated in parallel chunks.
 
         Args:
             folder_path (str): Path to the folder to zip.
-            zip_file_path (str): Path where the zip file will be saved.
+            zip_file_path (str or file object): Path where the zip file will be saved, or a
+                writable binary file object to stream the archive into (it need not be seekable).
+            compresslevel (int): Deflate level of the compressed files.
+            max_workers (int): Number of compression threads. Defaults to the number of CPU cores.
+            chunk_size (int): Size of the chunks compressed independently, in bytes.
+            store_extensions (tuple): File extensions stored without compression.
 
         Raises:
             Exception: If there is an issue zipping the folder.
         """
         try:
             logging.info(f"Starting to zip folder: {folder_path} into {zip_file_path}")
-            with zipfile.ZipFile(zip_file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(folder_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, folder_path)  # Maintain folder structure
-                        zipf.write(file_path, arcname)
-                        logging.debug(f"Zipped file: {file_path} as {arcname}")
-            logging.info(f"Folder successfully zipped to {zip_file_path}")
+            start_time = time.perf_counter()
+            max_workers = max_workers or os.cpu_count() or 1
+            with zipfile.ZipFile(zip_file_path, 'w', zipfile.ZIP_DEFLATED) as zipf, \
+                    ThreadPoolExecutor(max_workers=max_workers) as executor:
+                entry = None
+                pending = deque()
+
+                def write_next():
+                    nonlocal entry
+                    kind, *args = pending.popleft()
+                    if kind == 'stored':
+                        zinfo, file_path = args
+                        zinfo.compress_type = zipfile.ZIP_STORED
+                        with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+                            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+                        logging.debug(f"Stored file: {file_path} as {zinfo.filename}")
+                    elif kind == 'start':
+                        entry = _DeflatedEntry(zipf, args[0])
+                    elif kind == 'chunk':
+                        data, future = args
+                        entry.write(data, future.result())
+                    else:
+                        entry.close()
+                        logging.debug(f"Zipped file: {entry._zinfo.filename}")
+
+                # Keep a bounded number of chunks in flight so memory stays flat on large files.
+                for item in ZipUtils._entries(folder_path, executor, compresslevel, chunk_size, store_extensions):
+                    pending.append(item)
+                    while len(pending) > max_workers * 2:
+                        write_next()
+                while pending:
+                    write_next()
+
+                total = sum(zinfo.file_size for zinfo in zipf.filelist)
+                compressed = sum(zinfo.compress_size for zinfo in zipf.filelist)
+            elapsed = time.perf_counter() - start_time
+            logging.info(f"Folder successfully zipped to {zip_file_path}: {total} bytes into {compressed} "
+                         f"in {elapsed:.1f}s ({total / max(elapsed, 1e-9) / 2**20:.1f} MiB/s)")
         except Exception as e:
             logging.error(f"Failed to zip folder {folder_path}: {str(e)}")
             raise
 
     @staticmethod
-    def unzip_file(zip_file_path, extract_to_folder):
+    def unzip_file(zip_file_path, extract_to_folder, members=None):
         """
         Unzips a zip file into a specified folder.
 
         Args:
-            zip_file_path (str): Path to the zip file.
+            zip_file_path (str or file object): Path to the zip file, or a seekable binary
+                file object to read the archive from.
             extract_to_folder (str): Directory where the contents will be extracted.
+            members (list): Names or glob patterns (e.g. 'config.json', '*.json') of the
+                files to extract. Extracts everything if None.
 
         Raises:
             Exception: If there is an issue unzipping the file.
@@ -56,8 +202,34 @@ class ZipUtils:
         try:
             logging.info(f"Starting to unzip file: {zip_file_path} into {extract_to_folder}")
             with zipfile.ZipFile(zip_file_path, 'r') as zipf:
-                zipf.extractall(extract_to_folder)
-                logging.info(f"Successfully extracted files to {extract_to_folder}")
+                names = zipf.namelist()
+                if members is not None:
+                    names = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in members)]
+                    if not names:
+                        raise KeyError(f"No files matching {members} in {zip_file_path}")
+                # Extract one member at a time so large files stream to disk.
+                for name in names:
+                    zipf.extract(name, extract_to_folder)
+                logging.info(f"Successfully extracted {len(names)} files to {extract_to_folder}")
         except Exception as e:
             logging.error(f"Failed to unzip file {zip_file_path}: {str(e)}")
             raise
+
+    @staticmethod
+    def read_file(zip_file_path, name):
+        """
+        Reads a single file out of a zip archive without extracting anything else.
+
+        Args:
+            zip_file_path (str or file object): Path to the zip file, or a seekable binary file object.
+            name (str): Name of the file inside the archive, e.g. 'config.json'.
+
+        Returns:
+            bytes: The file's contents.
+        """
+        try:
+            with zipfile.ZipFile(zip_file_path, 'r') as zipf:
+                return zipf.read(name)
+        except Exception as e:
+            logging.error(f"Failed to read {name} from {zip_file_path}: {str(e)}")
+            raise
@@ -0,0 +1,150 @@
+# A local-directory stand-in for google.cloud.storage.Client, covering the part of the
+# client, bucket and blob API that GCPUtils uses. Objects live under
+# <root>/<bucket>/objects/<name> and their metadata under <root>/<bucket>/meta/<name>.json,
+# so the tests can interrupt and resume transfers without network access or credentials.
+
+import os
+import json
+import base64
+import hashlib
+import shutil
+import threading
+
+_lock = threading.Lock()
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.size = None
+        self.md5_hash = None
+        self.generation = None
+
+    @property
+    def _object_path(self):
+        return os.path.join(self.bucket.root, 'objects', self.name)
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.bucket.root, 'meta', self.name + '.json')
+
+    def exists(self):
+        return os.path.exists(self._object_path)
+
+    def reload(self):
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            properties = json.load(f)
+        self.size = properties['size']
+        self.md5_hash = properties['md5_hash']
+        self.generation = properties['generation']
+        self.metadata = properties['metadata']
+
+    def _commit(self, tmp_path, md5_hash):
+        """Moves a fully written temp file into place and records its properties, like a GCS write."""
+        with _lock:
+            os.makedirs(os.path.dirname(self._object_path), exist_ok=True)
+            os.makedirs(os.path.dirname(self._meta_path), exist_ok=True)
+            os.replace(tmp_path, self._object_path)
+            self.size = os.path.getsize(self._object_path)
+            self.md5_hash = md5_hash
+            previous_generation = 0
+            if os.path.exists(self._meta_path):
+                with open(self._meta_path, 'r', encoding='utf-8') as f:
+                    previous_generation = json.load(f)['generation']
+            self.generation = previous_generation + 1
+            with open(self._meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'size': self.size, 'md5_hash': self.md5_hash, 'generation': self.generation,
+                           'metadata': self.metadata}, f)
+
+    def _write(self, chunks):
+        digest = hashlib.md5()
+        tmp_path = f'{self._object_path}.{threading.get_ident()}.tmp'
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        with open(tmp_path, 'wb') as out:
+            for chunk in chunks:
+                digest.update(chunk)
+                out.write(chunk)
+        return tmp_path, base64.b64encode(digest.digest()).decode('ascii')
+
+    def upload_from_file(self, file_obj, size=None):
+        def chunks():
+            remaining = size
+            while remaining is None or remaining > 0:
+                block = file_obj.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+                if not block:
+                    break
+                if remaining is not None:
+                    remaining -= len(block)
+                yield block
+        self._commit(*self._write(chunks()))
+
+    def upload_from_filename(self, filename):
+        with open(filename, 'rb') as f:
+            self.upload_from_file(f)
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self._object_path, filename)
+
+    def download_as_bytes(self, start=None, end=None):
+        """Reads the object, or the inclusive byte range [start, end] of it."""
+        with open(self._object_path, 'rb') as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+    def compose(self, sources):
+        def chunks():
+            for source in sources:
+                with open(source._object_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        yield block
+        tmp_path, _ = self._write(chunks())
+        # Like GCS, composite objects carry no MD5.
+        self._commit(tmp_path, None)
+
+    def delete(self):
+        with _lock:
+            os.remove(self._object_path)
+            os.remove(self._meta_path)
+
+
+class LocalBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.root = os.path.join(client.root, name)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        blob = LocalBlob(self, name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix=''):
+        objects_root = os.path.join(self.root, 'objects')
+        names = []
+        for root, _, files in os.walk(objects_root):
+            for file in files:
+                name = os.path.relpath(os.path.join(root, file), objects_root).replace(os.sep, '/')
+                if name.startswith(prefix) and not name.endswith('.tmp'):
+                    names.append(name)
+        return [self.get_blob(name) for name in sorted(names)]
+
+
+class LocalStorageClient:
+    """Storage client backed by a local directory instead of GCS."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def bucket(self, bucket_name):
+        return LocalBucket(self, bucket_name)
+
+    def list_blobs(self, bucket_or_name, prefix=''):
+        bucket = bucket_or_name if isinstance(bucket_or_name, LocalBucket) else self.bucket(bucket_or_name)
+        return bucket.list_blobs(prefix=prefix)
@@ -0,0 +1,127 @@
+# Exact, near and within-batch duplicate removal by Deduplicator, its persisted index and
+# remove_document, on small sentence JSONL files.
+
+import json
+
+from com.mhire.data_processing.deduplicator import Deduplicator
+
+LONG = ("Patients with chronic renal failure were treated with a combination of diuretics and "
+        "beta blockers over a period of twelve weeks")
+
+
+def _write(path, sentences, blank_lines=0):
+    with open(path, 'w', encoding='utf-8') as f:
+        for sentence in sentences:
+            f.write(json.dumps({'sentence': sentence}) + '\n')
+            f.write('\n' * blank_lines)
+    return str(path)
+
+
+def _read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['sentence'] for line in f]
+
+
+def _dedup(deduplicator, tmp_path, name, sentences, **kwargs):
+    output = tmp_path / f'{name}.out.jsonl'
+    stats = deduplicator.dedup_file(_write(tmp_path / f'{name}.jsonl', sentences, **kwargs), str(output), doc=name)
+    return _read(output), stats
+
+
+def test_exact_near_and_within_batch_duplicates(tmp_path):
+    deduplicator = Deduplicator(str(tmp_path / 'index.sqlite'), batch_size=2)
+    sentences = [
+        LONG,
+        'Copyright 2019 Elsevier Inc. All rights reserved',
+        # Same batch as the first occurrence above, then a later batch.
+        LONG.upper(),
+        '  ' + LONG + ' ',
+        # One word changed: a near duplicate.
+        LONG.replace('twelve', 'twenty'),
+        'Copyright 2019 Elsevier Inc. All rights reserved',
+        'An unrelated sentence about hepatic clearance of the drug',
+    ]
+    kept, stats = _dedup(deduplicator, tmp_path, 'a', sentences)
+
+    assert kept == [LONG, 'Copyright 2019 Elsevier Inc. All rights reserved',
+                    'An unrelated sentence about hepatic clearance of the drug']
+    assert stats['exact_duplicates'] == 3
+    assert stats['near_duplicates'] == 1
+    assert stats['sentences'] == len(sentences)
+
+
+def test_dose_and_lab_value_variants_are_kept(tmp_path):
+    deduplicator = Deduplicator(str(tmp_path / 'index.sqlite'))
+    sentences = [
+        'The patient was given 10 mg/kg of drug X.',
+        'The patient was given 90 mg/kg of drug X.',
+        'Administer 5 mg of morphine intravenously every four hours as needed for severe pain',
+        'Administer 50 mg of morphine intravenously every four hours as needed for severe pain',
+        'Serum potassium was 3.1 mmol/L on admission',
+        'Serum potassium was 5.1 mmol/L on admission',
+        'The dose was 5',
+        'The dose was 50',
+    ]
+    kept, stats = _dedup(deduplicator, tmp_path, 'doses', sentences)
+
+    assert kept == sentences
+    assert stats['exact_duplicates'] == stats['near_duplicates'] == 0
+
+
+def test_page_numbers_of_running_headers_and_footers_are_folded(tmp_path):
+    deduplicator = Deduplicator(str(tmp_path / 'index.sqlite'))
+    sentences = ['Chapter 3 Cardiology 112', 'Chapter 3 Cardiology 113', 'Page 7', 'Page 8', '12', '13']
+    kept, stats = _dedup(deduplicator, tmp_path, 'headers', sentences)
+
+    assert kept == ['Chapter 3 Cardiology 112', 'Page 7', '12']
+    assert stats['exact_duplicates'] == 3
+
+
+def test_batches_of_blank_lines_do_not_end_the_file(tmp_path):
+    deduplicator = Deduplicator(str(tmp_path / 'index.sqlite'), batch_size=1)
+    sentences = ['First sentence of the file', 'Second sentence of the file', 'Third sentence of the file']
+    kept, stats = _dedup(deduplicator, tmp_path, 'blank', sentences, blank_lines=2)
+
+    assert kept == sentences
+    assert stats['sentences'] == 3
+
+
+def test_index_persists_between_runs(tmp_path):
+    index_path = str(tmp_path / 'index.sqlite')
+    deduplicator = Deduplicator(index_path)
+    _dedup(deduplicator, tmp_path, 'a', [LONG, 'Only in the first file'])
+    deduplicator.close()
+
+    deduplicator = Deduplicator(index_path)
+    kept, stats = _dedup(deduplicator, tmp_path, 'b', [LONG, LONG.replace('twelve', 'twenty'), 'Only in the second file'])
+
+    assert kept == ['Only in the second file']
+    assert stats['exact_duplicates'] == stats['near_duplicates'] == 1
+    assert sorted(deduplicator.documents()) == ['a', 'b']
+
+
+def test_index_with_other_parameters_is_cleared(tmp_path):
+    index_path = str(tmp_path / 'index.sqlite')
+    deduplicator = Deduplicator(index_path)
+    _dedup(deduplicator, tmp_path, 'a', [LONG])
+    deduplicator.close()
+
+    deduplicator = Deduplicator(index_path, num_perm=32, bands=8)
+    kept, _ = _dedup(deduplicator, tmp_path, 'b', [LONG])
+
+    assert kept == [LONG]
+
+
+def test_remove_document(tmp_path):
+    deduplicator = Deduplicator(str(tmp_path / 'index.sqlite'))
+    _dedup(deduplicator, tmp_path, 'a', [LONG])
+    _dedup(deduplicator, tmp_path, 'b', ['Only in the second file'])
+
+    deduplicator.remove_document('a')
+    kept, stats = _dedup(deduplicator, tmp_path, 'c', [LONG, LONG.replace('twelve', 'twenty'),
+                                                       'Only in the second file'])
+
+    assert deduplicator.documents().count('a') == 0
+    # The removed document no longer masks its sentences; the other document still does.
+    assert kept == [LONG]
+    assert stats['exact_duplicates'] == stats['near_duplicates'] == 1
@@ -0,0 +1,120 @@
+# Sliced uploads through the real google-cloud-storage client. The client runs its own upload
+# code (a resumable upload for parts above its 8 MiB multipart limit) against an in-memory
+# transport that answers the JSON and upload APIs.
+
+import os
+import json
+import base64
+import hashlib
+import threading
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+import requests
+
+storage = pytest.importorskip('google.cloud.storage')
+import google_crc32c
+from google.auth.credentials import AnonymousCredentials
+
+from com.mhire.utility.gcp_utils import GCPUtils
+
+BUCKET = 'bucket'
+MIB = 1024 * 1024
+
+
+def _md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+
+def _crc32c(data):
+    return base64.b64encode(google_crc32c.value(data).to_bytes(4, 'big')).decode('ascii')
+
+
+def _response(status, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = json.dumps(body).encode() if body is not None else b''
+    if body is not None:
+        response.headers['Content-Type'] = 'application/json'
+    return response
+
+
+class FakeTransport:
+    """Serves the objects of one bucket from memory."""
+
+    is_mtls = False
+
+    def __init__(self):
+        self.objects = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def _resource(self, name):
+        data, metadata = self.objects[name]
+        return {'bucket': BUCKET, 'name': name, 'size': str(len(data)), 'md5Hash': _md5(data),
+                'crc32c': _crc32c(data), 'generation': '1', 'metadata': metadata}
+
+    def request(self, method, url, data=None, headers=None, timeout=None, **kwargs):
+        with self.lock:
+            response = self._handle(method, urlparse(url), data, headers or {})
+        response.request = requests.Request(method, url).prepare()
+        return response
+
+    def _handle(self, method, url, data, headers):
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        object_prefix = f'/storage/v1/b/{BUCKET}/o/'
+        if path.startswith('/session/'):
+            return self._upload_chunk(path, data, headers)
+        if path == f'/upload/storage/v1/b/{BUCKET}/o' and query['uploadType'] == ['resumable']:
+            resource = json.loads(data or '{}')
+            name = resource.get('name') or query['name'][0]
+            session = f'/session/{len(self.sessions)}'
+            self.sessions[session] = {'name': name, 'metadata': resource.get('metadata'), 'data': b''}
+            return _response(200, headers={'Location': f'https://storage.googleapis.com{session}'})
+        if path.endswith('/compose') and method == 'POST':
+            name = path[len(object_prefix):-len('/compose')]
+            request = json.loads(data)
+            content = b''.join(self.objects[source['name']][0] for source in request['sourceObjects'])
+            self.objects[name] = (content, request.get('destination', {}).get('metadata'))
+            return _response(200, self._resource(name))
+        if path.startswith(object_prefix):
+            name = path[len(object_prefix):]
+            if name not in self.objects:
+                return _response(404, {'error': {'code': 404, 'message': 'Not Found'}})
+            if method == 'DELETE':
+                del self.objects[name]
+                return _response(204)
+            return _response(200, self._resource(name))
+        raise AssertionError(f'Unexpected request {method} {url.geturl()}')
+
+    def _upload_chunk(self, path, data, headers):
+        session = self.sessions[path]
+        data = data.read() if hasattr(data, 'read') else data or b''
+        first, _, last_and_total = headers['content-range'].partition(' ')[2].partition('-')
+        assert int(first) == len(session['data']), 'chunk does not continue the persisted bytes'
+        total = int(last_and_total.partition('/')[2])
+        session['data'] += data
+        if len(session['data']) < total:
+            return _response(308, headers={'Range': f"bytes=0-{len(session['data']) - 1}"})
+        self.objects[session['name']] = (session['data'], session['metadata'])
+        return _response(200, self._resource(session['name']))
+
+
+def test_sliced_upload_with_real_client(tmp_path):
+    transport = FakeTransport()
+    client = storage.Client(project='project', credentials=AnonymousCredentials(), _http=transport)
+    # Parts above the client's 8 MiB multipart limit go through its resumable upload.
+    content = os.urandom(27 * MIB - 1000)
+    local_file = tmp_path / 'model.zip'
+    local_file.write_bytes(content)
+
+    with GCPUtils(BUCKET, storage_client=client, max_workers=2, slice_size=9 * MIB,
+                  sliced_threshold=16 * MIB, max_retries=1) as gcp:
+        gcp.upload_file(str(local_file), 'models/model.zip')
+
+    assert transport.objects['models/model.zip'][0] == content
+    assert transport.objects['models/model.zip'][1] == {'md5_hash': _md5(content)}
+    assert list(transport.objects) == ['models/model.zip']
+    assert len(transport.sessions) == 3
@@ -0,0 +1,107 @@
+# Interrupted sliced downloads and uploads resume from the slices that completed, against a
+# storage client backed by a local directory.
+
+import os
+import json
+
+import pytest
+
+from local_storage_client import LocalBlob, LocalStorageClient
+from com.mhire.utility.gcp_utils import GCPUtils
+
+BUCKET = 'bucket'
+SLICE_SIZE = 1000
+CONTENT_SIZE = 10 * SLICE_SIZE - 123
+_ORIGINAL = {method: getattr(LocalBlob, method) for method in ('download_as_bytes', 'upload_from_file')}
+
+
+def _gcp(tmp_path):
+    return GCPUtils(BUCKET, storage_client=LocalStorageClient(str(tmp_path / 'gcs')), max_workers=2,
+                    slice_size=SLICE_SIZE, sliced_threshold=2 * SLICE_SIZE, max_retries=1, retry_delay=0)
+
+
+def _fail_from(monkeypatch, method, should_fail):
+    """Makes LocalBlob.<method> raise whenever `should_fail` accepts its arguments, and records its calls."""
+    calls = []
+    original = _ORIGINAL[method]
+
+    def patched(self, *args, **kwargs):
+        calls.append((self.name, args, kwargs))
+        if should_fail(self, *args, **kwargs):
+            raise ConnectionError('connection reset')
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(LocalBlob, method, patched)
+    return calls
+
+
+def test_interrupted_sliced_download_resumes(tmp_path, monkeypatch):
+    content = os.urandom(CONTENT_SIZE)
+    source = tmp_path / 'model.zip'
+    source.write_bytes(content)
+    local_file = str(tmp_path / 'download' / 'model.zip')
+
+    with _gcp(tmp_path) as gcp:
+        gcp.upload_file(str(source), 'models/model.zip')
+
+        calls = _fail_from(monkeypatch, 'download_as_bytes',
+                           lambda blob, start=None, end=None: start in (3 * SLICE_SIZE, 7 * SLICE_SIZE))
+        with pytest.raises(ConnectionError):
+            gcp.download_file('models/model.zip', local_file)
+        assert not os.path.exists(local_file)
+        with open(local_file + '.part.json', 'r', encoding='utf-8') as f:
+            done = json.load(f)['done']
+        assert 3 not in done and len(done) >= 3
+
+        calls = _fail_from(monkeypatch, 'download_as_bytes', lambda blob, start=None, end=None: False)
+        gcp.download_file('models/model.zip', local_file)
+
+    # Only the slices missing from the saved state are fetched again.
+    assert sorted(kwargs['start'] // SLICE_SIZE for _, _, kwargs in calls) == sorted(set(range(10)) - set(done))
+    with open(local_file, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(local_file + '.part')
+    assert not os.path.exists(local_file + '.part.json')
+
+
+def test_interrupted_sliced_upload_reuses_uploaded_parts(tmp_path, monkeypatch):
+    content = os.urandom(CONTENT_SIZE)
+    local_file = tmp_path / 'model.zip'
+    local_file.write_bytes(content)
+    client = LocalStorageClient(str(tmp_path / 'gcs'))
+
+    with _gcp(tmp_path) as gcp:
+        calls = _fail_from(monkeypatch, 'upload_from_file', lambda blob, *args, **kwargs: '.part-04-' in blob.name)
+        with pytest.raises(ConnectionError):
+            gcp.upload_file(str(local_file), 'models/model.zip')
+        assert client.bucket(BUCKET).get_blob('models/model.zip') is None
+        uploaded = {blob.name for blob in client.list_blobs(BUCKET, prefix='models/')}
+        assert 'models/model.zip.part-00-of-10' in uploaded and len(uploaded) >= 4
+
+        calls = _fail_from(monkeypatch, 'upload_from_file', lambda blob, *args, **kwargs: False)
+        gcp.upload_file(str(local_file), 'models/model.zip')
+
+    # Only the parts that were not uploaded before are sent again.
+    parts = {f'models/model.zip.part-{index:02d}-of-10' for index in range(10)}
+    assert sorted(name for name, _, _ in calls) == sorted(parts - uploaded)
+    blob = client.bucket(BUCKET).get_blob('models/model.zip')
+    assert blob.download_as_bytes() == content
+    # The part objects are deleted once composed.
+    assert [blob.name for blob in client.list_blobs(BUCKET, prefix='models/')] == ['models/model.zip']
+
+
+def test_unchanged_files_are_skipped(tmp_path, monkeypatch):
+    content = os.urandom(CONTENT_SIZE)
+    local_file = tmp_path / 'model.zip'
+    local_file.write_bytes(content)
+
+    with _gcp(tmp_path) as gcp:
+        gcp.upload_file(str(local_file), 'models/model.zip')
+        gcp.download_file('models/model.zip', str(local_file))
+
+        uploads = _fail_from(monkeypatch, 'upload_from_file', lambda blob, *args, **kwargs: False)
+        downloads = _fail_from(monkeypatch, 'download_as_bytes', lambda blob, start=None, end=None: False)
+        gcp.upload_file(str(local_file), 'models/model.zip')
+        gcp.download_file('models/model.zip', str(local_file))
+
+    assert uploads == downloads == []
@@ -0,0 +1,66 @@
+# Lines recovered by page_lines from a hand-written page: text shown by several operators on
+# one baseline, two columns written row by row, a form XObject, rotated text and a page number.
+
+import io
+
+from PyPDF2 import PdfReader
+
+from com.mhire.data_processing.pdf_layout import page_lines
+
+WIDTHS = ' '.join(str(250 + (code * 7) % 400) for code in range(32, 127))
+FORM = b'BT /F2 9 Tf 0 0 Td (Inside the form) Tj ET'
+CONTENT = b"""
+BT /F1 10 Tf 14 TL 50 700 Td
+[(Kerned) -120 (wo) 30 (rd) -600 (spaced)] TJ 2 Tc ( and char spaced) Tj 0 Tc
+1 0 0 1 300 700 Tm (Right column) Tj
+1 0 0 1 50 686 Tm 80 Tz (Scaled) Tj 100 Tz
+1 0 0 1 300 686 Tm (Second row) Tj
+1 0 0 1 50 672 Tm (Quoted) Tj (Next line) '
+0 1 -1 0 580 300 Tm (Rotated stamp) Tj
+ET
+q 1 0 0 1 100 200 cm /Fm1 Do Q
+q 2 0 0 2 0 0 cm BT /F1 10 Tf 30 100 Td (Scaled by cm) Tj ET Q
+BT /F1 10 Tf 300 30 Td (12) Tj ET
+"""
+
+
+def _page():
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 4 0 R /F2 5 0 R >> '
+        b'/XObject << /Fm1 6 0 R >> >> /Contents 7 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /FirstChar 32 /LastChar 126 /Widths [%s] '
+        b'/Encoding /WinAnsiEncoding >>' % WIDTHS.encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Times-Roman >>',
+        b'<< /Type /XObject /Subtype /Form /BBox [0 0 300 100] /Matrix [1 0 0 1 10 20] '
+        b'/Resources << /Font << /F2 5 0 R >> >> /Length %d >>\nstream\n%s\nendstream' % (len(FORM), FORM),
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(CONTENT), CONTENT),
+    ]
+    pdf = io.BytesIO(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(pdf.tell())
+        pdf.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = pdf.tell()
+    pdf.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    pdf.writelines(b'%010d 00000 n \n' % offset for offset in offsets)
+    pdf.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return PdfReader(pdf).pages[0]
+
+
+def test_page_lines():
+    lines = page_lines(_page())
+
+    assert [line.text for line in lines] == [
+        'Kernedword spaced and char spaced', 'Right column', 'Scaled', 'Second row', 'Quoted', 'Next line',
+        'Inside the form', 'Scaled by cm',
+    ]
+    by_text = {line.text: line for line in lines}
+    # Text shown by several operators on one baseline, placed one after the other.
+    assert by_text['Kernedword spaced and char spaced'].x1 < by_text['Right column'].x0
+    assert (by_text['Right column'].x0, by_text['Right column'].y) == (300, 700)
+    # The form is drawn at its matrix, within the current transformation.
+    assert (by_text['Inside the form'].x0, by_text['Inside the form'].y, by_text['Inside the form'].size) == (110, 220, 9)
+    assert (by_text['Scaled by cm'].x0, by_text['Scaled by cm'].y, by_text['Scaled by cm'].size) == (60, 200, 20)
+    assert by_text['Next line'].y == 658
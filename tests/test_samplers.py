@@ -0,0 +1,28 @@
+# Resuming the seeded training samplers mid-epoch.
+
+import numpy as np
+import pytest
+
+from com.mhire.pre_training.samplers import LengthGroupedSampler, RandomPermutationSampler
+
+
+@pytest.mark.parametrize('make_sampler', [
+    lambda: RandomPermutationSampler(100, seed=3),
+    lambda: LengthGroupedSampler(np.arange(100) % 17, batch_size=8, seed=3),
+])
+def test_resumed_pass_yields_and_counts_the_rest_of_the_epoch(make_sampler):
+    sampler = make_sampler()
+    sampler.set_epoch(1)
+    epoch = list(sampler)
+
+    resumed = make_sampler()
+    resumed.load_state_dict(sampler.checkpoint_state(1, 40))
+    assert len(resumed) == 60
+    with resumed.full_epochs():
+        assert len(resumed) == 100
+    assert list(resumed) == epoch[40:]
+
+    # The next pass is a full epoch again.
+    assert len(resumed) == 100
+    sampler.set_epoch(2)
+    assert list(resumed) == list(sampler)